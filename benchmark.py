@@ -0,0 +1,422 @@
+"""Offline micro-benchmarks for the bot's hot paths.
+
+Runs without Discord or Lavalink: searches go to a stubbed node that answers with
+fake_lavalink payloads, and SQLite files are written to a temporary directory.
+
+    python benchmark.py                  # run and print results
+    python benchmark.py --save           # run and store results as the new baseline
+    python benchmark.py --compare        # run and fail if anything regressed against the baseline
+    python benchmark.py -k queue         # only benchmarks whose name contains "queue"
+
+Each benchmark records the median and best time per call, the peak memory of one
+call and the memory still held per call afterwards (tracemalloc). Baselines are machine specific, so save them on the machine
+that runs the comparison.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+import urllib.parse
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(ROOT, "benchmark_baseline.json")
+TIME_TOLERANCE = 0.25  # Allowed slowdown against the baseline before --compare fails
+ALLOC_TOLERANCE = 0.10  # Allowed growth in peak and retained memory
+ROUNDS = 7  # Timed rounds per benchmark, the median round is reported
+MIN_ROUND_TIME = 0.05  # Seconds each round should take at least, sets the calls per round
+
+QUEUE_SIZE = 10_000  # Tracks in the queue for the queue mutation benchmarks
+GUILD_ROLES = 250  # Roles in the guild for the DJ permission benchmark
+MEMBER_ROLES = 50  # Roles held by the member for the DJ permission benchmark
+SETTINGS_GUILDS = 1000  # Guilds with changed settings per flush
+RECOMMEND_TRACKS = 5000  # Tracks in the recommendation index for the autoplay benchmark
+RECOMMEND_PLAYS = 100_000  # Plays recorded into that index
+SUGGEST_TRACKS = 20_000  # Titles in the /play autocomplete index
+RESTORE_TRACKS = 1000  # Encoded tracks decoded per restored queue
+
+# SQLite files the bot creates go to a scratch directory, not the working tree
+os.chdir(tempfile.mkdtemp(prefix="stellara-bench-"))
+sys.path.insert(0, ROOT)
+
+import wavelink  # noqa: E402
+
+import fake_lavalink  # noqa: E402
+import test as stellara  # noqa: E402
+
+BENCHMARKS: Dict[str, Callable] = {}
+
+
+def benchmark(func: Callable) -> Callable:
+    """Register a benchmark. It's called once for setup and returns the callable to time"""
+    BENCHMARKS[func.__name__.removeprefix("bench_")] = func
+    return func
+
+
+class StubNode:
+    """Stands in for a wavelink.Node, answering loadtracks from fake_lavalink"""
+    identifier = "stub"
+
+    def __init__(self):
+        self.requests = 0
+
+    async def _fetch_tracks(self, query: str) -> dict:
+        self.requests += 1
+        # wavelink sends the identifier quoted, Lavalink unquotes it before loading
+        return fake_lavalink.load_result(urllib.parse.unquote(query))
+
+
+def make_tracks(count: int, prefix: str = "track") -> List[wavelink.Playable]:
+    return [wavelink.Playable(fake_lavalink.fake_track(f"{prefix} {i}")) for i in range(count)]
+
+
+_idle_nodes: List[wavelink.Node] = []
+
+
+def make_player() -> stellara.MusicPlayer:
+    # A node that is never connected, the player only needs it for construction
+    if not _idle_nodes:
+        _idle_nodes.append(wavelink.Node(identifier="idle", uri="http://127.0.0.1:1", password="unused"))
+    channel = types.SimpleNamespace(guild=None)
+    return stellara.MusicPlayer(stellara.bot, channel, nodes=_idle_nodes)
+
+
+def filled_queue(count: int = QUEUE_SIZE) -> stellara.MusicQueue:
+    queue = stellara.MusicQueue()
+    queue.put(make_tracks(count))
+    return queue
+
+
+@benchmark
+def bench_search_tracks_cold():
+    """search_tracks for a query that misses the track cache"""
+    node = StubNode()
+    stellara.bot.node_balancer.best_node = lambda: node
+    counter = iter(range(10**9))
+
+    async def run():
+        return await stellara.search_tracks(f"cold query {next(counter)}")
+    return run
+
+
+@benchmark
+def bench_search_tracks_cached():
+    """search_tracks for a query served from the track cache"""
+    node = StubNode()
+    stellara.bot.node_balancer.best_node = lambda: node
+
+    async def run():
+        return await stellara.search_tracks("warm query")
+    return run
+
+
+@benchmark
+def bench_search_tracks_playlist():
+    """search_tracks for a cached 100 track playlist URL"""
+    node = StubNode()
+    stellara.bot.node_balancer.best_node = lambda: node
+
+    async def run():
+        return await stellara.search_tracks("https://www.youtube.com/playlist?list=bench")
+    return run
+
+
+@benchmark
+def bench_queue_remove_middle():
+    """/remove of a single track from the middle of the queue"""
+    queue = filled_queue()
+    spare = make_tracks(1, "spare")[0]
+
+    def run():
+        queue.remove_at(QUEUE_SIZE // 2)
+        queue.insert_at(QUEUE_SIZE // 3, spare)
+    return run
+
+
+@benchmark
+def bench_queue_remove_range():
+    """/remove of a 100 track range"""
+    queue = filled_queue()
+    spare = make_tracks(100, "spare")
+
+    def run():
+        queue.remove_range(1000, 1100)
+        queue.insert_at(5000, spare)
+    return run
+
+
+@benchmark
+def bench_queue_move():
+    """/move of a track from the back to the front of the queue"""
+    queue = filled_queue()
+
+    def run():
+        queue.move(QUEUE_SIZE - 1, 0)
+    return run
+
+
+@benchmark
+def bench_queue_shuffle():
+    """/shuffle of the whole queue"""
+    queue = filled_queue()
+
+    def run():
+        queue.shuffle()
+    return run
+
+
+@benchmark
+def bench_queue_page():
+    """Rendering a /queue page after the queue changed"""
+    player = make_player()
+    player.queue = filled_queue()
+    spare = make_tracks(1, "spare")[0]
+
+    def run():
+        player.queue.put(spare)
+        return player.queue_page_text(50)
+    return run
+
+
+@benchmark
+def bench_format_duration():
+    """MusicPlayer.format_duration"""
+    lengths = [random.randrange(0, 3_600_000) for _ in range(100)]
+
+    def run():
+        for length in lengths:
+            stellara.MusicPlayer.format_duration(length)
+    return run
+
+
+@benchmark
+def bench_progress_bar():
+    """MusicPlayer.create_progress_bar"""
+    player = make_player()
+
+    def run():
+        for position in range(0, 300_000, 3_000):
+            player.create_progress_bar(position, 300_000)
+    return run
+
+
+@benchmark
+def bench_now_playing_embed():
+    """Embed built by on_wavelink_track_start"""
+    player = make_player()
+    track = make_tracks(1)[0]
+
+    def run():
+        return stellara.build_now_playing_embed(player, track).to_dict()
+    return run
+
+
+@benchmark
+def bench_settings_flush():
+    """Writing changed volumes for many guilds to the settings store"""
+    store = stellara.GuildSettingsStore(file_path="bench_settings.db", legacy_volume_path="missing.json")
+    volumes = iter(range(10**9))
+
+    async def run():
+        volume = next(volumes) % 100
+        for guild_id in range(SETTINGS_GUILDS):
+            await store.set_volume(guild_id, volume)
+        await store.flush()
+    return run
+
+
+@benchmark
+def bench_dj_permissions():
+    """has_dj_permissions for a member without DJ rights in a guild with many roles"""
+    roles = [types.SimpleNamespace(id=i, name=f"role {i}") for i in range(GUILD_ROLES)]
+    roles.append(types.SimpleNamespace(id=GUILD_ROLES, name=stellara.DJ_ROLE_NAME))
+    player = make_player()
+    guild = types.SimpleNamespace(id=1, roles=roles, owner_id=1, voice_client=player)
+    # discord.Member.get_role: the role, if its ID is among the member's role IDs
+    member_roles = {role.id: role for role in roles[:MEMBER_ROLES]}
+    member = types.SimpleNamespace(id=2, guild=guild, get_role=member_roles.get)
+    interaction = types.SimpleNamespace(guild=guild, user=member)
+    stellara.bot.owner_id = 1
+
+    async def run():
+        return await stellara.has_dj_permissions(interaction)
+    return run
+
+
+@benchmark
+def bench_autoplay_recommend():
+    """Picking autoplay tracks from a recommendation index built from many guilds' plays"""
+    index = stellara.RecommendationIndex(file_path="bench_recommendations.db")
+    index.loaded = True
+    tracks = make_tracks(RECOMMEND_TRACKS)
+    rng = random.Random(0)
+    for play in range(RECOMMEND_PLAYS):
+        # Guilds drift through neighbouring tracks, so links cluster the way listening sessions do
+        guild_id = play % 100
+        index.record(guild_id, tracks[(guild_id * 50 + int(rng.gauss(0, 20)) + play // 100) % RECOMMEND_TRACKS])
+    seeds = tracks[100:100 + stellara.RECOMMEND_SEED_TRACKS]
+    recent = tracks[50:100]
+
+    async def run():
+        return await index.recommend(seeds, recent)
+    return run
+
+
+@benchmark
+def bench_play_autocomplete():
+    """/play autocomplete for a partly typed title, against a full suggestion index"""
+    index = stellara.TrackSuggestionIndex(max_tracks=SUGGEST_TRACKS)
+    rng = random.Random(0)
+    words = [f"{rng.choice('bcdfghklmnprst')}{rng.choice('aeiou')}{rng.choice('lmnrst')}{rng.choice('aeiouy')}"
+             for _ in range(500)]
+    for i in range(SUGGEST_TRACKS):
+        data = fake_lavalink.fake_track(f"suggest {i}")
+        data["info"]["title"] = " ".join(rng.choices(words, k=3))
+        index.add(wavelink.Playable(data))
+    queries = [" ".join(rng.choices(words, k=2))[:rng.randrange(3, 10)] for _ in range(50)]
+    counter = iter(range(10**9))
+
+    def run():
+        return index.search(queries[next(counter) % len(queries)])
+    return run
+
+
+@benchmark
+def bench_decode_tracks():
+    """Decoding a restored queue's encoded tracks locally, instead of a decodetracks request"""
+    encoded = [track.encoded for track in make_tracks(RESTORE_TRACKS)]
+
+    def run():
+        return stellara.decode_tracks(encoded)
+    return run
+
+
+async def run_setup(setup: Callable) -> Callable:
+    # Some of the objects benchmarks build, like wavelink nodes, need a running loop
+    return setup()
+
+
+def measure(func: Callable, loop: asyncio.AbstractEventLoop) -> dict:
+    """Time a benchmark callable and measure its allocations"""
+    is_async = asyncio.iscoroutinefunction(func)
+
+    def call_many(count: int) -> float:
+        started = time.perf_counter()
+        if is_async:
+            async def batch():
+                for _ in range(count):
+                    await func()
+            loop.run_until_complete(batch())
+        else:
+            for _ in range(count):
+                func()
+        return time.perf_counter() - started
+
+    # Warm up and pick a call count that makes each round long enough to time
+    calls = 1
+    while call_many(calls) < MIN_ROUND_TIME and calls < 1_000_000:
+        calls *= 2
+
+    rounds = [call_many(calls) / calls for _ in range(ROUNDS)]
+
+    # Peak memory of a single call, then memory still held after a batch of calls
+    tracemalloc.start()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    call_many(1)
+    _, peak = tracemalloc.get_traced_memory()
+
+    alloc_calls = min(calls, 100)
+    snapshot_before = tracemalloc.take_snapshot()
+    call_many(alloc_calls)
+    snapshot_after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    retained = sum(stat.size_diff for stat in snapshot_after.compare_to(snapshot_before, "filename"))
+    return {
+        "median_us": statistics.median(rounds) * 1e6,
+        "min_us": min(rounds) * 1e6,
+        "calls": calls,
+        "peak_bytes": max(0, peak - current),
+        "retained_bytes": max(0, retained / alloc_calls),
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict]) -> List[str]:
+    """Regressions of results against the baseline"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["median_us"] > base["median_us"] * (1 + TIME_TOLERANCE):
+            regressions.append(f"{name}: {base['median_us']:.1f}us -> {result['median_us']:.1f}us")
+        # Small absolute numbers are noise, only flag growth of at least 1 KiB
+        for key in ("peak_bytes", "retained_bytes"):
+            if result[key] > base[key] * (1 + ALLOC_TOLERANCE) + 1024:
+                regressions.append(f"{name}: {key} {base[key]:.0f}B -> {result[key]:.0f}B")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run the offline micro-benchmarks")
+    parser.add_argument("-k", dest="filter", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="Store the results as the baseline")
+    parser.add_argument("--compare", action="store_true", help="Exit non-zero if a benchmark regressed")
+    args = parser.parse_args()
+
+    # The bot's own INFO logging would drown out the results
+    logging.getLogger().setLevel(logging.ERROR)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if args.filter and args.filter not in name:
+            continue
+        func = loop.run_until_complete(run_setup(setup))
+        results[name] = result = measure(func, loop)
+        print(
+            f"{name:<28} {result['median_us']:>12.2f} us  (best {result['min_us']:.2f})"
+            f"  peak {result['peak_bytes']:>10.0f} B  retained {result['retained_bytes']:>8.0f} B/call  x{result['calls']}"
+        )
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+
+    exit_code = 0
+    if args.compare:
+        regressions = compare(results, baseline)
+        if not baseline:
+            print(f"No baseline at {args.baseline}, run with --save first")
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        exit_code = 1 if regressions else 0
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Saved {len(results)} results to {args.baseline}")
+
+    stellara.bot.track_cache.close()
+    for node in _idle_nodes:
+        loop.run_until_complete(node._session.close())
+    loop.close()
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
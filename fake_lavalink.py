@@ -0,0 +1,419 @@
+"""Fake Lavalink v4 servers for exercising the bot's node routing and failover locally.
+
+Run one or more nodes:
+
+    python fake_lavalink.py --port 2333 --port 2334
+
+and point the bot at them with the printed LAVALINK_NODES value. Each node can be
+loaded, slowed down, killed and revived while the bot is running:
+
+    curl -X POST localhost:2333/fake/load -d '{"cpu": 0.95, "deficit": 1500, "latency": 0.2}'
+    curl -X POST localhost:2333/fake/kill
+    curl -X POST localhost:2333/fake/revive
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import secrets
+import struct
+import time
+from typing import Dict, List, Optional
+
+from aiohttp import web, WSMsgType
+
+DEFAULT_PASSWORD = "youshallnotpass"
+STATS_INTERVAL = 10  # Seconds between stats messages on the websocket
+PLAYER_UPDATE_INTERVAL = 5  # Seconds between playerUpdate messages for playing players
+SEARCH_RESULTS = 5  # Tracks returned for a text search
+PLAYLIST_SIZE = 100  # Tracks returned for a playlist URL
+
+
+def fake_track(identifier: str, source: str = "youtube") -> dict:
+    """Build a deterministic Lavalink track payload for an identifier"""
+    digest = hashlib.sha1(identifier.encode()).digest()
+    info = {
+        "identifier": digest.hex()[:11],
+        "isSeekable": True,
+        "author": f"Artist {digest[0] % 50}",
+        "length": 120_000 + int.from_bytes(digest[1:3], "big") % 240_000,
+        "isStream": False,
+        "position": 0,
+        "title": f"Track {identifier}",
+        "uri": f"https://example.com/watch?v={digest.hex()[:11]}",
+        "artworkUrl": None,
+        "isrc": None,
+        "sourceName": source,
+    }
+    return {"encoded": encode_track(info), "info": info, "pluginInfo": {}, "userData": {}}
+
+
+def _utf(text: str) -> bytes:
+    # Fake titles never hold NUL or characters outside the BMP, so plain UTF-8 matches Java's writeUTF
+    raw = text.encode()
+    return struct.pack(">H", len(raw)) + raw
+
+
+def encode_track(info: dict) -> str:
+    """Encode track info the way Lavalink v4 does (version 3, no source specific fields)"""
+    body = bytes([3]) + _utf(info["title"]) + _utf(info["author"]) + struct.pack(">q", info["length"])
+    body += _utf(info["identifier"]) + bytes([info["isStream"]])
+    for field in ("uri", "artworkUrl", "isrc"):
+        body += b"\x00" if info[field] is None else b"\x01" + _utf(info[field])
+    body += _utf(info["sourceName"]) + struct.pack(">q", info["position"])
+    return base64.b64encode(struct.pack(">I", 1 << 30 | len(body)) + body).decode()
+
+
+def decode_fake_track(encoded: str, user_data: Optional[dict] = None) -> dict:
+    data = base64.b64decode(encoded)
+    offset = 5
+    values = []
+
+    def utf() -> str:
+        nonlocal offset
+        size, = struct.unpack_from(">H", data, offset)
+        offset += 2 + size
+        return data[offset - size:offset].decode()
+
+    title, author = utf(), utf()
+    length, = struct.unpack_from(">q", data, offset)
+    offset += 8
+    identifier = utf()
+    is_stream = bool(data[offset])
+    offset += 1
+    for _ in range(3):
+        offset += 1
+        values.append(utf() if data[offset - 1] else None)
+    uri, artwork, isrc = values
+
+    info = {
+        "identifier": identifier, "isSeekable": not is_stream, "author": author, "length": length,
+        "isStream": is_stream, "position": 0, "title": title, "uri": uri, "artworkUrl": artwork,
+        "isrc": isrc, "sourceName": utf(),
+    }
+    return {"encoded": encoded, "info": info, "pluginInfo": {}, "userData": user_data or {}}
+
+
+def load_result(identifier: str, playlist_size: int = PLAYLIST_SIZE) -> dict:
+    """Answer a loadtracks request the way Lavalink would"""
+    if identifier.startswith(("http://", "https://")):
+        if "list=" in identifier or "/playlist/" in identifier or "/album/" in identifier:
+            tracks = [fake_track(f"{identifier}#{i}") for i in range(playlist_size)]
+            return {
+                "loadType": "playlist",
+                "data": {"info": {"name": f"Playlist {identifier}", "selectedTrack": -1}, "pluginInfo": {}, "tracks": tracks},
+            }
+        return {"loadType": "track", "data": fake_track(identifier)}
+
+    prefix, _, query = identifier.partition(":")
+    if not query.strip():
+        return {"loadType": "empty", "data": {}}
+    source = {"spsearch": "spotify", "scsearch": "soundcloud"}.get(prefix, "youtube")
+    return {"loadType": "search", "data": [fake_track(f"{query} {i}", source) for i in range(1, SEARCH_RESULTS + 1)]}
+
+
+class FakePlayer:
+    """State of one guild's player on a fake node"""
+    def __init__(self, guild_id: str):
+        self.guild_id = guild_id
+        self.track: Optional[dict] = None
+        self.position = 0
+        self.started_at = 0.0
+        self.paused = False
+        self.volume = 100
+        self.filters: dict = {}
+        self.voice: dict = {}
+        self.end_task: Optional[asyncio.Task] = None
+
+    def current_position(self) -> int:
+        if not self.track or self.paused:
+            return self.position
+        return self.position + int((time.monotonic() - self.started_at) * 1000)
+
+    def to_json(self) -> dict:
+        return {
+            "guildId": self.guild_id,
+            "track": self.track,
+            "volume": self.volume,
+            "paused": self.paused,
+            "state": {"time": int(time.time() * 1000), "position": self.current_position(), "connected": True, "ping": 20},
+            "voice": self.voice,
+            "filters": self.filters,
+        }
+
+
+class FakeLavalinkNode:
+    """One fake Lavalink server with adjustable load"""
+    def __init__(self, port: int, password: str = DEFAULT_PASSWORD, playlist_size: int = PLAYLIST_SIZE):
+        self.port = port
+        self.password = password
+        self.playlist_size = playlist_size
+        self.cpu = 0.05  # System load reported in stats, 0-1
+        self.deficit = 0  # Frame deficit reported in stats, per minute
+        self.nulled = 0
+        self.latency = 0.0  # Extra seconds added to every REST response
+        self.alive = True
+        self.session_id = secrets.token_hex(8)
+        self.players: Dict[str, FakePlayer] = {}
+        self.sockets: Dict[web.WebSocketResponse, web.Request] = {}  # Open websockets and their upgrade requests
+        self.requests = 0
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application(middlewares=[self._middleware])
+        self.app.add_routes([
+            web.get("/version", self.version),
+            web.get("/v4/websocket", self.websocket),
+            web.get("/v4/info", self.info),
+            web.get("/v4/stats", self.stats),
+            web.get("/v4/loadtracks", self.loadtracks),
+            web.patch("/v4/sessions/{session}", self.update_session),
+            web.get("/v4/sessions/{session}/players", self.get_players),
+            web.get("/v4/sessions/{session}/players/{guild}", self.get_player),
+            web.patch("/v4/sessions/{session}/players/{guild}", self.update_player),
+            web.delete("/v4/sessions/{session}/players/{guild}", self.destroy_player),
+            web.post("/fake/load", self.set_load),
+            web.post("/fake/kill", self.kill),
+            web.post("/fake/revive", self.revive),
+        ])
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        if request.path.startswith("/fake/"):
+            return await handler(request)
+
+        if not self.alive:
+            raise web.HTTPServiceUnavailable()
+        if request.headers.get("Authorization") != self.password:
+            raise web.HTTPUnauthorized()
+
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    def stats_json(self) -> dict:
+        playing = sum(1 for player in self.players.values() if player.track and not player.paused)
+        return {
+            "players": len(self.players),
+            "playingPlayers": playing,
+            "uptime": 1000,
+            "memory": {"free": 1, "used": 1, "allocated": 2, "reservable": 4},
+            "cpu": {"cores": 4, "systemLoad": self.cpu, "lavalinkLoad": self.cpu / 2},
+            "frameStats": {"sent": 3000 * playing, "nulled": self.nulled, "deficit": self.deficit},
+        }
+
+    async def send(self, data: dict):
+        for ws in list(self.sockets):
+            try:
+                await ws.send_json(data)
+            except ConnectionError:
+                pass
+
+    async def version(self, request: web.Request) -> web.Response:
+        return web.Response(text="4.0.8")
+
+    async def info(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "version": {"semver": "4.0.8", "major": 4, "minor": 0, "patch": 8, "preRelease": None, "build": None},
+            "buildTime": 0,
+            "git": {"branch": "fake", "commit": "fake", "commitTime": 0},
+            "jvm": "fake",
+            "lavaplayer": "fake",
+            "sourceManagers": ["youtube", "soundcloud"],
+            "filters": ["equalizer", "timescale", "rotation", "lowPass"],
+            "plugins": [],
+        })
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats_json())
+
+    async def loadtracks(self, request: web.Request) -> web.Response:
+        return web.json_response(load_result(request.query.get("identifier", ""), self.playlist_size))
+
+    async def update_session(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        return web.json_response({"resuming": data.get("resuming", False), "timeout": data.get("timeout", 60)})
+
+    async def get_players(self, request: web.Request) -> web.Response:
+        return web.json_response([player.to_json() for player in self.players.values()])
+
+    async def get_player(self, request: web.Request) -> web.Response:
+        player = self.players.get(request.match_info["guild"])
+        if player is None:
+            return web.json_response(
+                {"timestamp": int(time.time() * 1000), "status": 404, "error": "Not Found",
+                 "message": "Player not found", "path": request.path},
+                status=404
+            )
+        return web.json_response(player.to_json())
+
+    async def update_player(self, request: web.Request) -> web.Response:
+        guild_id = request.match_info["guild"]
+        data = await request.json()
+        player = self.players.setdefault(guild_id, FakePlayer(guild_id))
+
+        if "voice" in data:
+            player.voice = data["voice"]
+        if "volume" in data:
+            player.volume = data["volume"]
+        if "filters" in data:
+            player.filters = data["filters"]
+        if "paused" in data:
+            player.position = player.current_position()
+            player.started_at = time.monotonic()
+            player.paused = data["paused"]
+        if "position" in data and "track" not in data:
+            player.position = data["position"]
+            player.started_at = time.monotonic()
+
+        track = data.get("track")
+        if track and "encoded" in track:
+            if track["encoded"] is None:
+                await self._stop(player, "stopped")
+            elif request.query.get("noReplace") != "true" or not player.track:
+                if player.track:
+                    await self._stop(player, "replaced")
+                self._start(player, decode_fake_track(track["encoded"], track.get("userData")), data.get("position", 0))
+                await self.send({"op": "event", "type": "TrackStartEvent", "guildId": guild_id, "track": player.track})
+                await self.send({"op": "playerUpdate", "guildId": guild_id, "state": player.to_json()["state"]})
+
+        return web.json_response(player.to_json())
+
+    async def destroy_player(self, request: web.Request) -> web.Response:
+        player = self.players.pop(request.match_info["guild"], None)
+        if player and player.end_task:
+            player.end_task.cancel()
+        return web.Response(status=204)
+
+    def _start(self, player: FakePlayer, track: dict, position: int):
+        player.track = track
+        player.position = position
+        player.started_at = time.monotonic()
+        if player.end_task:
+            player.end_task.cancel()
+        player.end_task = asyncio.create_task(self._finish(player))
+
+    async def _stop(self, player: FakePlayer, reason: str):
+        if player.end_task:
+            player.end_task.cancel()
+            player.end_task = None
+        if player.track:
+            track, player.track = player.track, None
+            await self.send({"op": "event", "type": "TrackEndEvent", "guildId": player.guild_id, "track": track, "reason": reason})
+
+    async def _finish(self, player: FakePlayer):
+        while player.track:
+            remaining = player.track["info"]["length"] - player.current_position()
+            if remaining <= 0 and not player.paused:
+                break
+            await asyncio.sleep(max(remaining, 1000) / 1000)
+
+        track, player.track, player.end_task = player.track, None, None
+        if track:
+            await self.send({"op": "event", "type": "TrackEndEvent", "guildId": player.guild_id, "track": track, "reason": "finished"})
+
+    async def websocket(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        resumed = request.headers.get("Session-Id") == self.session_id
+        self.sockets[ws] = request
+
+        await ws.send_json({"op": "ready", "resumed": resumed, "sessionId": self.session_id})
+        ticker = asyncio.create_task(self._tick(ws))
+        try:
+            async for message in ws:
+                if message.type is WSMsgType.ERROR:
+                    break
+        finally:
+            ticker.cancel()
+            self.sockets.pop(ws, None)
+        return ws
+
+    async def _tick(self, ws: web.WebSocketResponse):
+        last_stats = 0.0
+        while not ws.closed:
+            if time.monotonic() - last_stats >= STATS_INTERVAL:
+                await ws.send_json({"op": "stats", **self.stats_json()})
+                last_stats = time.monotonic()
+
+            for player in list(self.players.values()):
+                if player.track:
+                    state = player.to_json()["state"]
+                    await ws.send_json({"op": "playerUpdate", "guildId": player.guild_id, "state": state})
+            await asyncio.sleep(PLAYER_UPDATE_INTERVAL)
+
+    async def set_load(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        self.cpu = data.get("cpu", self.cpu)
+        self.deficit = data.get("deficit", self.deficit)
+        self.nulled = data.get("nulled", self.nulled)
+        self.latency = data.get("latency", self.latency)
+        return web.json_response(self.stats_json())
+
+    async def kill(self, request: Optional[web.Request] = None) -> web.Response:
+        """Drop every websocket and fail REST calls, like a crashed node"""
+        self.alive = False
+        for player in self.players.values():
+            if player.end_task:
+                player.end_task.cancel()
+        self.players.clear()
+        self.session_id = secrets.token_hex(8)
+        # Cut the connections without a close frame, the way a crashed process would
+        for request in list(self.sockets.values()):
+            if request.transport:
+                request.transport.abort()
+        logging.info(f"Fake node on port {self.port} killed")
+        return web.json_response({"alive": False})
+
+    async def revive(self, request: Optional[web.Request] = None) -> web.Response:
+        self.alive = True
+        logging.info(f"Fake node on port {self.port} revived")
+        return web.json_response({"alive": True})
+
+    @property
+    def uri(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+
+    async def close(self):
+        for ws in list(self.sockets):
+            await ws.close()
+        if self._runner:
+            await self._runner.cleanup()
+
+
+async def start_fake_nodes(ports: List[int], password: str = DEFAULT_PASSWORD, **kwargs) -> List[FakeLavalinkNode]:
+    """Start a fake node on each port, for use from scripts in the same event loop"""
+    nodes = [FakeLavalinkNode(port, password, **kwargs) for port in ports]
+    for node in nodes:
+        await node.start()
+    return nodes
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Run fake Lavalink v4 nodes")
+    parser.add_argument("--port", type=int, action="append", help="Port to serve a node on, repeat for several nodes")
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--playlist-size", type=int, default=PLAYLIST_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    nodes = await start_fake_nodes(args.port or [2333], args.password, playlist_size=args.playlist_size)
+    config = [{"identifier": f"fake-{node.port}", "uri": node.uri, "password": node.password} for node in nodes]
+    print(f"LAVALINK_NODES='{json.dumps(config)}'")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for node in nodes:
+            await node.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
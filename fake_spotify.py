@@ -0,0 +1,207 @@
+"""Fake Spotify Web API for exercising the bot's Spotify playlist resolution locally.
+
+Run it:
+
+    python fake_spotify.py --port 8900
+
+and point the bot at it with the printed environment variables. Every playlist and
+album ID exists: a playlist has --playlist-size tracks and an album --album-size,
+with metadata and ISRCs derived from the ID, so the same link always expands to the
+same tracks. Rate limiting can be switched on while the bot is running:
+
+    curl -X POST localhost:8900/fake/rate-limit -d '{"every": 3, "retry_after": 1}'
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import secrets
+from typing import List, Optional
+
+from aiohttp import web
+
+CLIENT_ID = "fake-client"
+CLIENT_SECRET = "fake-secret"
+PLAYLIST_SIZE = 500  # Tracks in every playlist
+ALBUM_SIZE = 12  # Tracks in every album
+PLAYLIST_PAGE_LIMIT = 100  # Most items Spotify returns per playlist page
+ALBUM_PAGE_LIMIT = 50  # Most items Spotify returns per album page or /tracks batch
+
+
+def fake_track(track_id: str, album_id: Optional[str] = None) -> dict:
+    """Build a deterministic Spotify track object for a track ID"""
+    digest = hashlib.sha1(track_id.encode()).digest()
+    artist = f"Artist {digest[0] % 50}"
+    return {
+        "type": "track",
+        "id": track_id,
+        "name": f"Song {track_id}",
+        "artists": [{"name": artist, "id": f"artist{digest[0] % 50}"}],
+        "album": {"id": album_id or f"album{digest[1] % 200}", "name": f"Album {digest[1] % 200}"},
+        "duration_ms": 120_000 + int.from_bytes(digest[2:4], "big") % 240_000,
+        "external_ids": {"isrc": f"QZ{digest.hex()[:10].upper()}"},
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+        "is_local": False,
+    }
+
+
+def simplified_track(track: dict) -> dict:
+    """Album listings leave out the album and the ISRC, like the real API"""
+    return {key: value for key, value in track.items() if key not in ("album", "external_ids")}
+
+
+class FakeSpotify:
+    """Fake Spotify accounts and Web API endpoints on one port"""
+    def __init__(self, port: int, playlist_size: int = PLAYLIST_SIZE, album_size: int = ALBUM_SIZE):
+        self.port = port
+        self.playlist_size = playlist_size
+        self.album_size = album_size
+        self.tokens = set()
+        self.requests = 0
+        self.rate_limit_every = 0  # Every nth API request is answered with 429, 0 disables
+        self.retry_after = 1
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application(middlewares=[self._middleware])
+        self.app.add_routes([
+            web.post("/api/token", self.token),
+            web.get("/v1/playlists/{id}", self.playlist),
+            web.get("/v1/playlists/{id}/tracks", self.playlist_tracks),
+            web.get("/v1/albums/{id}", self.album),
+            web.get("/v1/albums/{id}/tracks", self.album_tracks),
+            web.get("/v1/tracks", self.tracks),
+            web.get("/v1/tracks/{id}", self.track),
+            web.post("/fake/rate-limit", self.set_rate_limit),
+        ])
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        if not request.path.startswith("/v1/"):
+            return await handler(request)
+
+        auth = request.headers.get("Authorization", "")
+        if auth.removeprefix("Bearer ") not in self.tokens:
+            raise web.HTTPUnauthorized()
+
+        self.requests += 1
+        if self.rate_limit_every and self.requests % self.rate_limit_every == 0:
+            return web.json_response({"error": {"status": 429, "message": "API rate limit exceeded"}},
+                                     status=429, headers={"Retry-After": str(self.retry_after)})
+        return await handler(request)
+
+    @property
+    def api_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    @property
+    def token_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/api/token"
+
+    def playlist_items(self, playlist_id: str) -> List[dict]:
+        return [{"track": fake_track(f"{playlist_id}x{i}")} for i in range(self.playlist_size)]
+
+    def album_items(self, album_id: str) -> List[dict]:
+        return [fake_track(f"{album_id}x{i}", album_id) for i in range(self.album_size)]
+
+    @staticmethod
+    def page(request: web.Request, items: List[dict], max_limit: int) -> dict:
+        offset = int(request.query.get("offset", 0))
+        limit = min(int(request.query.get("limit", max_limit)), max_limit)
+        return {"items": items[offset:offset + limit], "offset": offset, "limit": limit, "total": len(items)}
+
+    async def token(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        if request.headers.get("Authorization") is None or data.get("grant_type") != "client_credentials":
+            raise web.HTTPBadRequest()
+
+        token = secrets.token_hex(16)
+        self.tokens.add(token)
+        return web.json_response({"access_token": token, "token_type": "Bearer", "expires_in": 3600})
+
+    async def playlist(self, request: web.Request) -> web.Response:
+        playlist_id = request.match_info["id"]
+        return web.json_response({
+            "id": playlist_id,
+            "name": f"Playlist {playlist_id}",
+            "owner": {"display_name": "Fake Curator"},
+            "images": [{"url": f"https://example.com/playlist/{playlist_id}.jpg"}],
+            "external_urls": {"spotify": f"https://open.spotify.com/playlist/{playlist_id}"},
+            "tracks": self.page(request, self.playlist_items(playlist_id), PLAYLIST_PAGE_LIMIT),
+        })
+
+    async def playlist_tracks(self, request: web.Request) -> web.Response:
+        items = self.playlist_items(request.match_info["id"])
+        return web.json_response(self.page(request, items, PLAYLIST_PAGE_LIMIT))
+
+    async def album(self, request: web.Request) -> web.Response:
+        album_id = request.match_info["id"]
+        items = [simplified_track(track) for track in self.album_items(album_id)]
+        return web.json_response({
+            "id": album_id,
+            "name": f"Album {album_id}",
+            "artists": [{"name": "Fake Band"}],
+            "images": [{"url": f"https://example.com/album/{album_id}.jpg"}],
+            "external_urls": {"spotify": f"https://open.spotify.com/album/{album_id}"},
+            "tracks": self.page(request, items, ALBUM_PAGE_LIMIT),
+        })
+
+    async def album_tracks(self, request: web.Request) -> web.Response:
+        items = [simplified_track(track) for track in self.album_items(request.match_info["id"])]
+        return web.json_response(self.page(request, items, ALBUM_PAGE_LIMIT))
+
+    async def tracks(self, request: web.Request) -> web.Response:
+        ids = [track_id for track_id in request.query.get("ids", "").split(",") if track_id]
+        if len(ids) > ALBUM_PAGE_LIMIT:
+            raise web.HTTPBadRequest()
+        # Tracks of fake albums are named "<album>x<n>", keep their album so the metadata matches
+        return web.json_response({"tracks": [fake_track(track_id, track_id.rpartition("x")[0] or None) for track_id in ids]})
+
+    async def track(self, request: web.Request) -> web.Response:
+        return web.json_response(fake_track(request.match_info["id"]))
+
+    async def set_rate_limit(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        self.rate_limit_every = int(data.get("every", 0))
+        self.retry_after = data.get("retry_after", self.retry_after)
+        return web.json_response({"every": self.rate_limit_every, "retry_after": self.retry_after})
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+
+    async def close(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def start_fake_spotify(port: int, **kwargs) -> FakeSpotify:
+    """Start the fake API on a port, for use from scripts in the same event loop"""
+    server = FakeSpotify(port, **kwargs)
+    await server.start()
+    return server
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a fake Spotify Web API")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--playlist-size", type=int, default=PLAYLIST_SIZE)
+    parser.add_argument("--album-size", type=int, default=ALBUM_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = await start_fake_spotify(args.port, playlist_size=args.playlist_size, album_size=args.album_size)
+    print(f"SPOTIFY_CLIENT_ID={CLIENT_ID}")
+    print(f"SPOTIFY_CLIENT_SECRET={CLIENT_SECRET}")
+    print(f"SPOTIFY_API_URL={server.api_url}")
+    print(f"SPOTIFY_TOKEN_URL={server.token_url}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
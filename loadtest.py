@@ -0,0 +1,475 @@
+"""End-to-end load test of the real bot against fake Lavalink nodes and synthetic interactions.
+
+Imports the Bot and command tree from test.py, runs its setup_hook (without syncing
+commands to Discord) and drives /play, /skip, /queue and /volume in thousands of
+simulated guilds. Voice connections go through a fake gateway that answers voice
+state changes, and Lavalink is served by fake_lavalink nodes.
+
+    python loadtest.py --guilds 500,1000,2000 --duration 60
+    python loadtest.py --guilds 5000 --duration 1800 --mix play=40,skip=10,queue=40,volume=10 --json soak.json
+
+Each stage adds guilds until the stage's guild count is reached, connects a player in
+every new guild with /play, then runs the command mix for --duration seconds at
+--rate-per-guild commands per guild per second. Every stage reports command latency
+(time to the first response and to completion), event loop lag and RSS.
+
+The fake nodes run in this process by default, so they share the event loop with the
+bot. Start them separately with fake_lavalink.py and pass --fake-nodes 0 (with
+LAVALINK_NODES set) to keep their work out of the measurements.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import traceback
+from collections import Counter
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+import fake_lavalink  # noqa: E402
+
+BOT_USER_ID = 1  # User ID the bot presents to Lavalink
+LAG_SAMPLE_INTERVAL = 0.05  # Seconds between event loop lag samples
+RSS_SAMPLE_INTERVAL = 1  # Seconds between RSS samples
+CONNECT_CONCURRENCY = 50  # Guilds connecting at the same time while a stage warms up
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def rss_bytes() -> int:
+    """Current resident set size, falling back to the peak where /proc isn't available"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Recorder:
+    """Collects command latencies, event loop lag and RSS for one stage"""
+    def __init__(self):
+        self.ack: Dict[str, List[float]] = {}  # Seconds until the first response, per command
+        self.done: Dict[str, List[float]] = {}  # Seconds until the command returned, per command
+        self.errors: Counter = Counter()
+        self.lag: List[float] = []
+        self.rss: List[int] = []
+        self.started = time.perf_counter()
+
+    def record(self, command: str, ack: Optional[float], done: float):
+        self.done.setdefault(command, []).append(done)
+        if ack is not None:
+            self.ack.setdefault(command, []).append(ack)
+
+    def summary(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        commands = {}
+        for command, durations in sorted(self.done.items()):
+            acks = self.ack.get(command, [])
+            commands[command] = {
+                "count": len(durations),
+                "ack_p50_ms": percentile(acks, 50) * 1000,
+                "ack_p99_ms": percentile(acks, 99) * 1000,
+                "p50_ms": percentile(durations, 50) * 1000,
+                "p99_ms": percentile(durations, 99) * 1000,
+                "max_ms": max(durations) * 1000,
+            }
+        total = sum(len(durations) for durations in self.done.values())
+        return {
+            "elapsed_s": elapsed,
+            "throughput": total / elapsed if elapsed else 0.0,
+            "commands": commands,
+            "errors": dict(self.errors),
+            "loop_lag_p50_ms": percentile(self.lag, 50) * 1000,
+            "loop_lag_p99_ms": percentile(self.lag, 99) * 1000,
+            "loop_lag_max_ms": max(self.lag, default=0.0) * 1000,
+            "rss_start_mb": self.rss[0] / 2**20 if self.rss else 0.0,
+            "rss_end_mb": self.rss[-1] / 2**20 if self.rss else 0.0,
+            "rss_growth_mb": (self.rss[-1] - self.rss[0]) / 2**20 if self.rss else 0.0,
+        }
+
+
+class FakeUser:
+    def __init__(self, user_id: int, channel: "FakeVoiceChannel"):
+        self.id = user_id
+        self.name = f"user-{user_id}"
+        self.mention = f"<@{user_id}>"
+        self.voice = type("VoiceState", (), {"channel": channel})()
+
+    def get_role(self, role_id: int):
+        return None
+
+
+class FakeTextChannel:
+    def __init__(self, channel_id: int, harness: "LoadHarness"):
+        self.id = channel_id
+        self.mention = f"<#{channel_id}>"
+        self.harness = harness
+        self.messages = 0
+
+    async def send(self, content=None, **kwargs):
+        self.messages += 1
+        await self.harness.api_call()
+        return FakeMessage(self)
+
+
+class FakeMessage:
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def delete(self):
+        pass
+
+    async def edit(self, **kwargs):
+        pass
+
+
+class FakeGuild:
+    """Just enough of discord.Guild for the music commands"""
+    def __init__(self, guild_id: int, harness: "LoadHarness"):
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+        self.harness = harness
+        self.owner_id = guild_id  # The simulated user owns the guild, so DJ checks pass
+        self.roles = []
+        self.voice_channel = FakeVoiceChannel(guild_id * 10 + 1, self)
+        self.text_channel = FakeTextChannel(guild_id * 10 + 2, harness)
+        self.user = FakeUser(guild_id, self.voice_channel)
+
+    @property
+    def voice_client(self):
+        return self.harness.bot._connection._get_voice_client(self.id)
+
+    def get_role(self, role_id: int):
+        return None
+
+    async def change_voice_state(self, *, channel, self_mute: bool = False, self_deaf: bool = False):
+        """Answer a gateway voice state change the way Discord would, after a short delay"""
+        player = self.voice_client
+        if channel is None:
+            self.harness.bot._connection._remove_voice_client(self.id)
+            return
+        asyncio.create_task(self._voice_updates(player, channel))
+
+    async def _voice_updates(self, player, channel):
+        await asyncio.sleep(self.harness.gateway_latency)
+        await player.on_voice_state_update({"session_id": f"session-{self.id}", "channel_id": channel.id})
+        # wavelink looks the channel up in the client's cache, which the fake guilds aren't part of
+        player.channel = channel
+        await player.on_voice_server_update({"token": f"token-{self.id}", "endpoint": "voice.fake", "guild_id": self.id})
+
+
+class FakeVoiceChannel:
+    def __init__(self, channel_id: int, guild: FakeGuild):
+        self.id = channel_id
+        self.guild = guild
+        self.name = f"voice-{channel_id}"
+        self.mention = f"<#{channel_id}>"
+        self.members = []
+
+    async def connect(self, *, cls, timeout: float = 60.0, reconnect: bool = True, self_deaf: bool = False, self_mute: bool = False):
+        """Mirrors discord.VoiceChannel.connect"""
+        state = self.guild.harness.bot._connection
+        if state._get_voice_client(self.guild.id):
+            raise RuntimeError("Already connected to a voice channel.")
+
+        voice = cls(self.guild.harness.bot, self)
+        state._add_voice_client(self.guild.id, voice)
+        try:
+            await voice.connect(timeout=timeout, reconnect=reconnect, self_deaf=self_deaf, self_mute=self_mute)
+        except BaseException:
+            state._remove_voice_client(self.guild.id)
+            raise
+        return voice
+
+
+class FakeResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def _respond(self):
+        if self._done:
+            raise RuntimeError("This interaction has already been responded to before")
+        self._done = True
+        self.interaction.acked_at = time.perf_counter()
+        await self.interaction.harness.api_call()
+
+    async def defer(self, **kwargs):
+        await self._respond()
+
+    async def send_message(self, content=None, **kwargs):
+        await self._respond()
+        self.interaction.sent.append(kwargs.get("embed") or content)
+
+
+class FakeFollowup:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        if not self.interaction.response.is_done():
+            raise RuntimeError("Followup sent before the interaction was responded to")
+        await self.interaction.harness.api_call()
+        self.interaction.sent.append(kwargs.get("embed") or content)
+        return FakeMessage(self.interaction.channel)
+
+
+class FakeInteraction:
+    """Synthetic slash command interaction from the guild's user"""
+    def __init__(self, guild: FakeGuild, harness: "LoadHarness"):
+        self.harness = harness
+        self.guild = guild
+        self.guild_id = guild.id
+        self.user = guild.user
+        self.channel = guild.text_channel
+        self.client = harness.bot
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.acked_at: Optional[float] = None
+        self.sent = []
+
+
+class LoadHarness:
+    """Runs the bot from test.py against fake Discord and Lavalink"""
+    def __init__(self, args):
+        self.args = args
+        self.gateway_latency = args.gateway_latency
+        self.api_latency = args.api_latency
+        self.mix = parse_mix(args.mix)
+        self.guilds: List[FakeGuild] = []
+        self.fake_nodes = []
+        self.recorder = Recorder()
+        self.bot = None
+        self.stellara = None
+        self._samplers: List[asyncio.Task] = []
+
+    async def api_call(self):
+        # Discord REST round trip for responses and messages
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+    async def start(self):
+        if self.args.fake_nodes:
+            ports = [self.args.base_port + i for i in range(self.args.fake_nodes)]
+            self.fake_nodes = await fake_lavalink.start_fake_nodes(ports)
+            os.environ["LAVALINK_NODES"] = json.dumps([
+                {"identifier": f"fake-{node.port}", "uri": node.uri, "password": node.password}
+                for node in self.fake_nodes
+            ])
+
+        # Import after LAVALINK_NODES is set, the bot reads its config at import time
+        import test as stellara
+        self.stellara = stellara
+        self.bot = bot = stellara.bot
+
+        logging.getLogger().setLevel(self.args.log_level)
+        bot._connection.user = type("ClientUser", (), {"id": BOT_USER_ID, "name": "stellara-load"})()
+        bot.owner_id = 0
+
+        # The real setup hook, minus the command sync against Discord
+        async def skip_sync(*args, **kwargs):
+            return []
+        bot.tree.sync = skip_sync
+        await bot._async_setup_hook()
+        await bot.setup_hook()
+
+        import wavelink
+        while not any(node.status is wavelink.NodeStatus.CONNECTED for node in wavelink.Pool.nodes.values()):
+            await asyncio.sleep(0.05)
+
+        self._samplers = [asyncio.create_task(self._sample_lag()), asyncio.create_task(self._sample_rss())]
+
+    async def close(self):
+        for task in self._samplers:
+            task.cancel()
+        for guild in self.guilds:
+            player = guild.voice_client
+            if player:
+                self.bot._connection._remove_voice_client(guild.id)
+        import wavelink
+        await wavelink.Pool.close()
+        await self.bot.close()
+        for node in self.fake_nodes:
+            await node.close()
+
+    async def _sample_lag(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+            self.recorder.lag.append(max(0.0, time.perf_counter() - started - LAG_SAMPLE_INTERVAL))
+
+    async def _sample_rss(self):
+        while True:
+            self.recorder.rss.append(rss_bytes())
+            await asyncio.sleep(RSS_SAMPLE_INTERVAL)
+
+    def query(self) -> str:
+        # A fixed catalog, so the track cache sees realistic repeat requests
+        return f"https://fake.example/watch?v={random.randrange(self.args.catalog)}"
+
+    async def invoke(self, guild: FakeGuild, command: str) -> None:
+        """Run one command through the bot's command tree and record its latency"""
+        app_command = self.bot.tree.get_command(command)
+        if command == "play":
+            kwargs = {"query": self.query()}
+        elif command == "volume":
+            kwargs = {"value": random.randrange(101)}
+        else:
+            kwargs = {}
+
+        interaction = FakeInteraction(guild, self)
+        started = time.perf_counter()
+        try:
+            await app_command.callback(interaction, **kwargs)
+        except Exception as e:
+            self.recorder.errors[f"{command}: {type(e).__name__}"] += 1
+            if self.args.verbose:
+                traceback.print_exc()
+        finished = time.perf_counter()
+
+        ack = interaction.acked_at - started if interaction.acked_at else None
+        self.recorder.record(command, ack, finished - started)
+
+    async def add_guilds(self, count: int):
+        """Create guilds and connect a player in each with /play"""
+        first = len(self.guilds) + 1
+        new_guilds = [FakeGuild(guild_id, self) for guild_id in range(first, first + count)]
+        self.guilds.extend(new_guilds)
+
+        slots = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+        async def connect(guild: FakeGuild):
+            async with slots:
+                await self.invoke(guild, "play")
+
+        await asyncio.gather(*(connect(guild) for guild in new_guilds))
+
+    async def run_mix(self, duration: float):
+        """Issue commands as a Poisson process across every guild for duration seconds"""
+        rate = self.args.rate_per_guild * len(self.guilds)
+        commands, weights = zip(*self.mix.items())
+        deadline = time.perf_counter() + duration
+        inflight = set()
+
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(random.expovariate(rate))
+            guild = random.choice(self.guilds)
+            command = random.choices(commands, weights)[0]
+            task = asyncio.create_task(self.invoke(guild, command))
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+
+        if inflight:
+            await asyncio.wait(inflight)
+
+    async def run(self) -> List[dict]:
+        stages = []
+        for target in parse_guild_counts(self.args.guilds):
+            missing = target - len(self.guilds)
+            if missing > 0:
+                self.recorder = Recorder()
+                await self.add_guilds(missing)
+                warmup = self.recorder.summary()
+                print(f"Connected {missing} guilds ({len(self.guilds)} total) in {warmup['elapsed_s']:.1f}s")
+
+            self.recorder = Recorder()
+            await self.run_mix(self.args.duration)
+            summary = self.recorder.summary()
+            summary["guilds"] = len(self.guilds)
+            summary["players"] = len(self.bot.voice_clients)
+            stages.append(summary)
+            print_stage(summary)
+        return stages
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        command, _, weight = part.partition("=")
+        if command.strip() not in ("play", "skip", "queue", "volume"):
+            raise SystemExit(f"Unknown command in --mix: {command}")
+        mix[command.strip()] = float(weight or 1)
+    return mix
+
+
+def parse_guild_counts(text: str) -> List[int]:
+    return sorted(int(count) for count in text.split(","))
+
+
+def print_stage(summary: dict):
+    print(
+        f"\n== {summary['guilds']} guilds, {summary['players']} players: "
+        f"{summary['throughput']:.1f} commands/s over {summary['elapsed_s']:.0f}s"
+    )
+    print(f"{'command':<8} {'count':>7} {'ack p50':>9} {'ack p99':>9} {'p50':>9} {'p99':>9} {'max':>9}")
+    for command, stats in summary["commands"].items():
+        print(
+            f"{command:<8} {stats['count']:>7} {stats['ack_p50_ms']:>7.1f}ms {stats['ack_p99_ms']:>7.1f}ms "
+            f"{stats['p50_ms']:>7.1f}ms {stats['p99_ms']:>7.1f}ms {stats['max_ms']:>7.1f}ms"
+        )
+    print(
+        f"loop lag p50 {summary['loop_lag_p50_ms']:.1f}ms, p99 {summary['loop_lag_p99_ms']:.1f}ms, "
+        f"max {summary['loop_lag_max_ms']:.1f}ms"
+    )
+    print(
+        f"RSS {summary['rss_start_mb']:.1f}MB -> {summary['rss_end_mb']:.1f}MB "
+        f"({summary['rss_growth_mb']:+.1f}MB)"
+    )
+    if summary["errors"]:
+        print(f"errors: {summary['errors']}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the bot against fake Discord and Lavalink")
+    parser.add_argument("--guilds", default="100,500,1000", help="Comma separated guild counts, one stage each")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of commands per stage")
+    parser.add_argument("--rate-per-guild", type=float, default=0.05, help="Commands per guild per second")
+    parser.add_argument("--mix", default="play=40,skip=15,queue=30,volume=15", help="Command weights")
+    parser.add_argument("--catalog", type=int, default=5000, help="Distinct tracks /play picks from")
+    parser.add_argument("--fake-nodes", type=int, default=1, help="Fake Lavalink nodes to run in-process, 0 to use LAVALINK_NODES")
+    parser.add_argument("--base-port", type=int, default=23330, help="Port of the first in-process fake node")
+    parser.add_argument("--gateway-latency", type=float, default=0.02, help="Seconds before the fake gateway answers voice updates")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Seconds added to every Discord API call")
+    parser.add_argument("--json", help="Write the stage summaries to this file")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--verbose", action="store_true", help="Print command tracebacks")
+    args = parser.parse_args()
+
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    # Settings and track cache databases go to a scratch directory
+    os.chdir(tempfile.mkdtemp(prefix="stellara-load-"))
+
+    harness = LoadHarness(args)
+    await harness.start()
+    try:
+        stages = await harness.run()
+    finally:
+        await harness.close()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "stages": stages}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
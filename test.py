@@ -1,15 +1,37 @@
+import array
 import asyncio
+import base64
+import bisect
+import contextvars
+import hashlib
+import heapq
 import logging
+import math
+import signal
+import sys
 import time
 import random
 import re
-from typing import cast, Optional, Dict, List, Union
+import sqlite3
+import struct
+import threading
+import traceback
+import urllib.parse
+from collections import OrderedDict, deque
+from typing import cast, Callable, Optional, Dict, Iterable, List, Set, Tuple, Union
 from datetime import datetime, timedelta
 
+import aiohttp
+from aiohttp import web
 import discord
 from discord import app_commands
-from discord.ext import commands, tasks
+from discord.ext import commands
 import wavelink
+import yarl
+try:
+    import numpy as np
+except ImportError:  # Recommendations fall back to scoring in pure Python
+    np = None
 from dotenv import load_dotenv
 import os
 import json
@@ -19,68 +41,3997 @@ load_dotenv()
 
 LAVALINK_URI = os.getenv("LAVALINK_URI")
 LAVALINK_PASSWORD = os.getenv("LAVALINK_PASSWORD")
+# Optional JSON list of nodes, e.g. [{"identifier": "eu-1", "uri": "http://...", "password": "..."}]
+LAVALINK_NODES = os.getenv("LAVALINK_NODES")
 DJ_ROLE_NAME = "DJ"  # Role name for DJ permissions
 INACTIVITY_TIMEOUT = 300  # 5 minutes in seconds
+QUEUE_PAGE_SIZE = 10  # Tracks per page of /queue
+QUEUE_VIEW_TIMEOUT = 180  # Seconds before /queue buttons stop responding
+SEARCH_RESULT_LIMIT = 5  # Results offered when a search matches several tracks
+SEARCH_SESSION_TTL = 60  # Seconds search results stay selectable
+SEARCH_SESSION_MAX = 10000  # Pending search sessions kept in memory before the oldest are dropped
+SEARCH_SESSION_REAP_INTERVAL = 10  # Seconds between sweeps for expired search sessions
+DEFAULT_VOLUME = 30  # Volume for guilds that never changed it
+DEFAULT_SEARCH_PREFIX = "ytmsearch"  # Same default source as wavelink.Playable.search
+
+# Hedged free-text searches
+SEARCH_SOURCES = tuple(os.getenv("SEARCH_SOURCES", "ytmsearch,ytsearch,scsearch").split(","))  # Backups in order of preference
+SEARCH_HEDGE_PERCENTILE = 0.9  # A backup search goes out once the first source is slower than this share of its searches
+SEARCH_HEDGE_DEFAULT_DELAY = 1.0  # Seconds before the backup search while a source has too few samples
+SEARCH_HEDGE_MIN_DELAY = 0.2  # Seconds the first source always gets before a backup search goes out
+SEARCH_HEDGE_MAX_DELAY = 3.0  # Seconds after which a backup search always goes out
+SOURCE_HEALTH_WINDOW = 100  # Recent searches kept per source
+SOURCE_HEALTH_TTL = 5 * 60  # Seconds a search counts towards its source's health, so failed sources get retried
+SOURCE_HEALTH_MIN_SAMPLES = 10  # Searches a source needs before its latency and error rate are trusted
+SOURCE_MAX_ERROR_RATE = 0.5  # Sources failing more often than this are tried after the others
+
+# /play autocomplete
+SUGGEST_MAX_TRACKS = 20_000  # Titles kept for autocomplete, the least recently seen are dropped first
+SUGGEST_SEED_TRACKS = 5000  # Recent tracks loaded from the track cache and play history at startup
+SUGGEST_PER_SEARCH = 3  # Top results of each search that become suggestions
+SUGGEST_MIN_SIMILARITY = 0.5  # Share of the typed trigrams a title has to contain to be suggested
+SUGGEST_MAX_CANDIDATES = 1000  # Titles scored per keystroke at most, generic queries get stricter matching
+SUGGEST_LIMIT = 25  # Most choices Discord shows for an autocomplete
+
+# Lazy playlist loading
+PLAYLIST_EAGER_TRACKS = 50  # Playlist tracks queued right away, the rest are built as the queue drains
+PLAYLIST_REFILL_THRESHOLD = 25  # Queue more playlist tracks once fewer than this are waiting
+PLAYLIST_BATCH_SIZE = 100  # Playlist tracks built per background batch
+
+# Filter presets and player updates
+FILTER_PRESETS_PATH = os.getenv("FILTER_PRESETS_PATH", "filter_presets.json")  # Optional user-defined presets
+PLAYER_UPDATE_WINDOW = 0.05  # Seconds volume, filter, pause and seek changes are gathered into one Lavalink update
+EQ_BANDS = 15  # Lavalink equalizer bands, 25Hz to 16kHz
+EQ_GAIN_RANGE = (-0.25, 1.0)  # Gain limits Lavalink accepts per equalizer band
+
+# Guild settings storage
+SETTINGS_DB_PATH = "guild_settings.db"
+SETTINGS_FLUSH_INTERVAL = 5  # Seconds between background writes of changed settings
+
+# Persistent track resolution cache settings
+TRACK_CACHE_PATH = "track_cache.db"
+TRACK_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 256 MB of cached Lavalink payloads
+TRACK_CACHE_TTL = 60 * 60 * 24  # Text searches are reused for a day
+TRACK_CACHE_URL_TTL = 60 * 60 * 24 * 7  # Direct links rarely change, keep them for a week
+TRACK_CACHE_STREAM_TTL = 60 * 5  # Live streams go stale quickly
+
+# Lavalink node routing and failover
+NODE_PROBE_INTERVAL = 15  # Seconds between node health checks
+NODE_PROBE_TIMEOUT = 5  # Seconds before a health check counts as failed
+NODE_MAX_PROBE_FAILURES = 2  # Failed health checks in a row before a node counts as down
+NODE_DEGRADED_PENALTY = 300  # CPU/frame penalty above which players are moved off a node
+NODE_LATENCY_PENALTY_MS = 10  # Milliseconds of REST latency that weigh as much as one playing player
+NODE_MIGRATION_CONCURRENCY = 10  # Players moved between nodes at the same time
+
+# Lavalink REST requests
+LAVALINK_NODE_CONCURRENCY = 32  # REST requests in flight per node, the rest wait for a slot
+LAVALINK_KEEPALIVE = 30  # Seconds idle REST connections are kept open
+LAVALINK_REQUEST_TIMEOUT = 10  # Seconds a REST call may take, less when the interaction it serves expires sooner
+LAVALINK_RETRY_STATUSES = (502, 503, 504)  # Responses that mean the node didn't handle the request
+LAVALINK_MAX_RETRIES = 2  # Retries per call, only for calls that are safe to send twice
+LAVALINK_RETRY_BACKOFF = 0.1  # Seconds the first retry waits at most, doubled for each one after (full jitter)
+LAVALINK_RETRY_RATIO = 0.1  # Retries earned per call, shared by every node so a failing node can't multiply traffic
+LAVALINK_RETRY_MIN_RATE = 1  # Retries per second allowed however little traffic there is
+LAVALINK_RETRY_BURST = 20  # Retries that can be saved up for a burst of failures
+INTERACTION_ACK_WINDOW = 3  # Seconds Discord allows before an interaction must be acknowledged
+INTERACTION_TOKEN_LIFETIME = 15 * 60  # Seconds an acknowledged interaction can still be followed up
+
+# Prometheus metrics endpoint
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 disables the /metrics endpoint
+COMMAND_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Seconds
+LAVALINK_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)  # Seconds
+QUEUE_LENGTH_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000)  # Tracks
+
+# Event loop monitoring
+LOOP_LAG_SAMPLE_INTERVAL = 0.5  # Seconds between event loop lag samples
+LOOP_LAG_HISTORY = 600  # Lag samples kept for percentiles, 5 minutes at the default interval
+SLOW_CALLBACK_THRESHOLD = float(os.getenv("SLOW_CALLBACK_THRESHOLD", "0.1"))  # Seconds a callback may block the loop
+SLOW_CALLBACK_TOP_N = 10  # Worst offenders kept for /debug
+SLOW_CALLBACK_WINDOW = 3600  # Seconds an offender stays listed after it was last seen
+SLOW_CALLBACK_STACK_DEPTH = 12  # Innermost frames kept per offender
+# Time every callback by patching asyncio's private Handle._run, instead of probing the loop from a thread
+LOOP_MONITOR_PATCH = os.getenv("LOOP_MONITOR_PATCH", "0") == "1"
+
+# Startup
+COMMAND_TREE_HASH_PATH = "command_tree.sha256"  # Hash of the last synced command tree, the sync is skipped while it matches
+NODE_READY_TIMEOUT = 15  # Seconds /play waits for the first Lavalink node after a restart
+
+# Player snapshots, restored after a restart
+SNAPSHOT_DB_PATH = "player_snapshots.db"
+SNAPSHOT_INTERVAL = 10  # Seconds between snapshot flushes, only players that changed are written
+SNAPSHOT_MAX_AGE = 600  # Seconds after which a snapshot is dropped instead of restored
+SESSION_RESUME_TIMEOUT = 60  # Seconds Lavalink keeps our players running after the bot disconnects
+RESTORE_CONCURRENCY = 5  # Players rejoining voice at the same time after a restart
+
+# Autoplay recommendations
+RECOMMEND_DB_PATH = "recommendations.db"
+RECOMMEND_FLUSH_INTERVAL = 30  # Seconds between background writes of new plays
+RECOMMEND_SESSION_SPAN = 5  # Earlier plays in a guild that a new play is linked to
+RECOMMEND_SESSION_GAP = 30 * 60  # Seconds of silence after which a guild's listening session starts over
+RECOMMEND_MAX_TRACKS = 50_000  # Tracks kept in the index, the least recently played are dropped first
+RECOMMEND_MAX_NEIGHBORS = 200  # Strongest links kept per track
+RECOMMEND_SEED_TRACKS = 5  # Recent plays a recommendation is based on
+AUTOPLAY_BATCH = 10  # Recommended tracks added to the auto queue at a time
+AUTOPLAY_REFILL_THRESHOLD = 2  # Refill the auto queue once fewer tracks than this are waiting
+AUTOPLAY_EXCLUDE_RECENT = 50  # Recent plays that aren't recommended again
+
+# Play history
+HISTORY_DB_PATH = "play_history.db"
+HISTORY_FLUSH_INTERVAL = 5  # Seconds between batched writes of new plays
+HISTORY_COMPACT_INTERVAL = 60 * 60  # Seconds between sweeps that drop old plays
+HISTORY_RETENTION = 60 * 60 * 24 * 90  # Plays are kept for 90 days
+HISTORY_MAX_PLAYS = 10_000  # Plays kept per guild, the oldest go first
+HISTORY_PAGE_SIZE = 10  # Plays per page of /history, and tracks shown by /top
+HISTORY_CURSORS = 1000  # Histories (per guild, or per guild and member) whose page positions are remembered
+HISTORY_CURSOR_TTL = 15 * 60  # Seconds /history pages and /replay numbers keep counting from the same newest play
+HISTORY_MEMORY_TRACKS = 100  # Played tracks each player keeps in memory, older ones are only in the history store
+
+# Spotify playlists and albums, expanded through the Web API and matched track by track.
+# Without credentials Spotify links go to Lavalink as they are
+SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
+SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL", "https://api.spotify.com/v1")
+SPOTIFY_TOKEN_URL = os.getenv("SPOTIFY_TOKEN_URL", "https://accounts.spotify.com/api/token")
+SPOTIFY_MAX_TRACKS = 1000  # Playlist and album tracks read at most
+SPOTIFY_REQUEST_CONCURRENCY = 4  # Requests sent to the Spotify API at the same time
+SPOTIFY_MAX_RETRIES = 3  # Rate limited or failed Spotify requests retried before giving up
+SPOTIFY_RESOLVE_CONCURRENCY = 8  # Tracks searched on Lavalink at the same time
+SPOTIFY_LENGTH_TOLERANCE = 5000  # Milliseconds a match may differ from the Spotify track's length
+SPOTIFY_MAP_PATH = "spotify_tracks.db"
+SPOTIFY_MAP_TTL = 60 * 60 * 24 * 30  # Matched tracks are reused for 30 days
+
+# Lavalink's track encoding, read and written locally so restoring queues needs no decode requests
+TRACK_INFO_VERSION = 3  # Encoding version with artwork URL and ISRC, what Lavalink v4 writes
+TRACK_INFO_VERSIONED = 1  # Header flag marking that a version byte follows
+
+# Sharding. With SHARD_WORKERS above 1, main() runs a launcher that spreads shards over worker processes
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))  # 0 uses Discord's recommended shard count
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "1"))  # Worker processes, 1 runs every shard in this process
+SHARD_IDS = os.getenv("SHARD_IDS")  # Comma separated shards this process runs, set by the launcher
+CLUSTER_ID = int(os.getenv("CLUSTER_ID", "0"))  # Index of this worker process, set by the launcher
+IPC_HOST = "127.0.0.1"
+IPC_PORT = int(os.getenv("IPC_PORT", "0"))  # Launcher IPC port, 0 when running without a launcher
+IPC_TIMEOUT = 5  # Seconds to wait for every cluster to answer a cross-cluster request
+WORKER_RESTART_DELAY = 5  # Seconds before a crashed worker is started again
+IDENTIFY_WINDOW = 5  # Seconds Discord allows max_concurrency shard identifies in
 
 # Define regex patterns for streaming service URLs
 SPOTIFY_REGEX = re.compile(r"https?://open.spotify.com/(?P<type>track|playlist|album)/(?P<id>[a-zA-Z0-9]+)")
 YOUTUBE_PLAYLIST_REGEX = re.compile(r"(?:https?://)?(?:www\.)?youtube\.com/playlist\?list=(?P<id>[a-zA-Z0-9_-]+)")
 
 
-class VolumeManager:
-    """Class to manage volume settings per guild"""
-    def __init__(self, file_path="volume_settings.json"):
-        self.file_path = file_path
-        self.volumes = self._load()
+class GuildSettings:
+    """Settings for a single guild, held in memory by GuildSettingsStore"""
+    __slots__ = ("guild_id", "volume", "dj_mode", "dj_members", "presets", "filters")
+
+    def __init__(self, guild_id: int, volume: int = DEFAULT_VOLUME, dj_mode: bool = True,
+                 dj_members: Optional[List[int]] = None, presets: Optional[List[str]] = None,
+                 filters: Optional[dict] = None):
+        self.guild_id = guild_id
+        self.volume = volume
+        self.dj_mode = dj_mode  # Whether DJ permissions are required for certain commands
+        self.dj_members = set(dj_members or ())  # User IDs with DJ permissions
+        self.presets: List[str] = list(presets or ())  # Default filter presets applied when a player connects
+        self.filters = filters or {}  # Raw filter payload saved before presets were stored by name
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "volume": self.volume,
+            "dj_mode": self.dj_mode,
+            "dj_members": sorted(self.dj_members),
+            "presets": self.presets,
+            "filters": self.filters,
+        })
+
+    @classmethod
+    def from_json(cls, guild_id: int, data: str) -> "GuildSettings":
+        return cls(guild_id, **json.loads(data))
+
+
+class GuildSettingsStore:
+    """Per-guild settings served from memory, with changes written to SQLite in the background"""
+    def __init__(self, file_path=SETTINGS_DB_PATH, flush_interval=SETTINGS_FLUSH_INTERVAL,
+                 legacy_volume_path="volume_settings.json"):
+        self.file_path = file_path
+        self.flush_interval = flush_interval
+        self.legacy_volume_path = legacy_volume_path
+        self._settings: Dict[int, GuildSettings] = {}
+        self._dirty = set()
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.file_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS guild_settings (guild_id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+            self._db = db
+            self._migrate_legacy_volumes(db)
+        return self._db
+
+    def _migrate_legacy_volumes(self, db: sqlite3.Connection):
+        """Import the old volume_settings.json written by VolumeManager, once"""
+        try:
+            with open(self.legacy_volume_path, "r") as f:
+                volumes = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+
+        db.executemany(
+            "INSERT OR IGNORE INTO guild_settings (guild_id, data) VALUES (?, ?)",
+            [(int(guild_id), GuildSettings(int(guild_id), volume=volume).to_json()) for guild_id, volume in volumes.items()]
+        )
+        db.commit()
+        os.replace(self.legacy_volume_path, f"{self.legacy_volume_path}.migrated")
+        logging.info(f"Migrated {len(volumes)} guild volumes from {self.legacy_volume_path}")
+
+    def _load(self, guild_id: int) -> Optional[str]:
+        with self._lock:
+            row = self._connect().execute("SELECT data FROM guild_settings WHERE guild_id = ?", (guild_id,)).fetchone()
+        return row[0] if row else None
+
+    def _write(self, rows: List[tuple]):
+        with self._lock:
+            db = self._connect()
+            db.executemany("INSERT OR REPLACE INTO guild_settings (guild_id, data) VALUES (?, ?)", rows)
+            db.commit()
+
+    def get_cached(self, guild_id: int) -> Optional[GuildSettings]:
+        return self._settings.get(guild_id)
+
+    async def get(self, guild_id: int) -> GuildSettings:
+        """Return the settings for a guild, loading them from disk the first time they're needed"""
+        settings = self._settings.get(guild_id)
+        if settings is not None:
+            return settings
+
+        data = await asyncio.to_thread(self._load, guild_id)
+        settings = GuildSettings.from_json(guild_id, data) if data else GuildSettings(guild_id)
+        # Another task may have loaded (and changed) this guild while we were reading
+        return self._settings.setdefault(guild_id, settings)
+
+    def mark_dirty(self, guild_id: int):
+        self._dirty.add(guild_id)
+
+    async def set_volume(self, guild_id: int, volume: int):
+        settings = await self.get(guild_id)
+        settings.volume = volume
+        self.mark_dirty(guild_id)
+
+    async def set_dj_mode(self, guild_id: int, enabled: bool):
+        settings = await self.get(guild_id)
+        settings.dj_mode = enabled
+        self.mark_dirty(guild_id)
+
+    async def add_dj_member(self, guild_id: int, user_id: int):
+        settings = await self.get(guild_id)
+        settings.dj_members.add(user_id)
+        self.mark_dirty(guild_id)
+
+    async def remove_dj_member(self, guild_id: int, user_id: int) -> bool:
+        settings = await self.get(guild_id)
+        if user_id not in settings.dj_members:
+            return False
+        settings.dj_members.remove(user_id)
+        self.mark_dirty(guild_id)
+        return True
+
+    async def set_presets(self, guild_id: int, names: tuple):
+        settings = await self.get(guild_id)
+        settings.presets = list(names)
+        settings.filters = {}
+        self.mark_dirty(guild_id)
+
+    async def flush(self):
+        """Write every dirty guild to disk in a single transaction, off the event loop"""
+        if not self._dirty:
+            return
+
+        dirty, self._dirty = self._dirty, set()
+        rows = [(guild_id, self._settings[guild_id].to_json()) for guild_id in dirty]
+        try:
+            await asyncio.to_thread(self._write, rows)
+        except BaseException:
+            # Written again on the next flush, with any change made in the meantime
+            self._dirty |= dirty
+            raise
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Error flushing guild settings: {e}", exc_info=True)
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+        await self.flush()
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class PlayerSnapshotStore:
+    """Player state written to SQLite in the background, so a restarted process can pick its players back up"""
+    def __init__(self, file_path=SNAPSHOT_DB_PATH, flush_interval=SNAPSHOT_INTERVAL, cluster_id=CLUSTER_ID):
+        self.file_path = file_path
+        self.flush_interval = flush_interval
+        self.cluster_id = cluster_id  # Workers share the file, but each has its own Lavalink sessions
+        self._signatures: Dict[int, tuple] = {}  # Guild ID -> signature of the last snapshot written
+        # Guild ID -> (queue, its edits, tracks taken from it) when the queue was last written
+        self._queues: Dict[int, tuple] = {}
+        self._deleted = set()
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._players: Optional[Callable[[], list]] = None
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.file_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS player_snapshots ("
+                "guild_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL, queue TEXT)"
+            )
+            if "queue" not in [row[1] for row in db.execute("PRAGMA table_info(player_snapshots)")]:
+                db.execute("ALTER TABLE player_snapshots ADD COLUMN queue TEXT")
+            columns = [row[1] for row in db.execute("PRAGMA table_info(node_sessions)")]
+            if columns and "cluster_id" not in columns:
+                # Written before sessions were kept per worker, there's no telling whose they were
+                db.execute("DROP TABLE node_sessions")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS node_sessions (cluster_id INTEGER NOT NULL, identifier TEXT NOT NULL, "
+                "session_id TEXT NOT NULL, PRIMARY KEY (cluster_id, identifier))"
+            )
+            db.commit()
+            self._db = db
+        return self._db
+
+    def _write(self, rows: List[tuple], deleted: List[int]) -> List[int]:
+        """Write (guild ID, state, queue or None to keep the stored one, updated_at) rows. Returns the guilds
+        whose stored queue was missing, which need a full snapshot"""
+        # Serializing large queues happens here too, off the event loop
+        missing = []
+        with self._lock:
+            db = self._connect()
+            with db:
+                for guild_id, state, queue, updated_at in rows:
+                    data = json.dumps(state, separators=(",", ":"))
+                    if queue is not None:
+                        db.execute(
+                            "INSERT OR REPLACE INTO player_snapshots (guild_id, data, updated_at, queue) VALUES (?, ?, ?, ?)",
+                            (guild_id, data, updated_at, json.dumps(queue, separators=(",", ":")))
+                        )
+                    elif not db.execute(
+                        "UPDATE player_snapshots SET data = ?, updated_at = ? WHERE guild_id = ? AND queue IS NOT NULL",
+                        (data, updated_at, guild_id)
+                    ).rowcount:
+                        missing.append(guild_id)
+                db.executemany("DELETE FROM player_snapshots WHERE guild_id = ?", [(guild_id,) for guild_id in deleted])
+        return missing
+
+    def _load_all(self) -> List[tuple]:
+        with self._lock:
+            rows = self._connect().execute("SELECT guild_id, data, queue, updated_at FROM player_snapshots").fetchall()
+
+        snapshots = []
+        for guild_id, data, queue, updated_at in rows:
+            state = json.loads(data)
+            if queue is not None:
+                # Tracks played since the queue was written are skipped
+                state["tracks"] = json.loads(queue)[state.get("skip", 0):]
+            else:
+                state["tracks"] = state.get("queue", []) + state.get("pending", [])
+            snapshots.append((guild_id, state, updated_at))
+        return snapshots
+
+    def _drop_stale(self, cutoff: float) -> int:
+        with self._lock:
+            db = self._connect()
+            with db:
+                return db.execute("DELETE FROM player_snapshots WHERE updated_at < ?", (cutoff,)).rowcount
+
+    def _load_sessions(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._connect().execute(
+                "SELECT identifier, session_id FROM node_sessions WHERE cluster_id = ?", (self.cluster_id,)
+            ).fetchall())
+
+    def _save_session(self, identifier: str, session_id: str):
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO node_sessions (cluster_id, identifier, session_id) VALUES (?, ?, ?)",
+                (self.cluster_id, identifier, session_id)
+            )
+            db.commit()
+
+    async def load_all(self) -> List[tuple]:
+        """Every stored snapshot as (guild ID, state, updated_at)"""
+        return await asyncio.to_thread(self._load_all)
+
+    async def load_sessions(self) -> Dict[str, str]:
+        """This worker's last Lavalink session ID on every node, by node identifier"""
+        return await asyncio.to_thread(self._load_sessions)
+
+    async def save_session(self, identifier: str, session_id: str):
+        await asyncio.to_thread(self._save_session, identifier, session_id)
+
+    async def drop_stale(self, max_age: float = SNAPSHOT_MAX_AGE) -> int:
+        """Delete snapshots too old to be restored, like those of guilds the bot left while it was down"""
+        return await asyncio.to_thread(self._drop_stale, time.time() - max_age)
+
+    def discard(self, guild_id: int):
+        """Forget a guild's player, for players that were stopped on purpose"""
+        if self._closed:
+            return
+        self._forget((guild_id,))
+        self._deleted.add(guild_id)
+
+    async def flush(self):
+        """Write the players that changed since the last flush in a single transaction"""
+        rows = []
+        now = time.time()
+        live = set()
+        for player in self._players() if self._players else ():
+            if not isinstance(player, MusicPlayer) or not player.guild:
+                continue
+            guild_id = player.guild.id
+            live.add(guild_id)
+            signature = player.snapshot_signature()
+            if self._signatures.get(guild_id) == signature:
+                continue
+            self._signatures[guild_id] = signature
+            self._deleted.discard(guild_id)
+
+            # The queue is only written again after an edit, tracks played from it just move the skip count
+            queue = player.queue
+            written = self._queues.get(guild_id)
+            tracks = None
+            if written is None or written[0] is not queue or written[1] != queue.edits:
+                tracks = player.snapshot_queue()
+                written = self._queues[guild_id] = (queue, queue.edits, queue.taken)
+            state = player.snapshot_state()
+            state["skip"] = queue.taken - written[2]
+            rows.append((guild_id, state, tracks, now))
+
+        # Players that went away without being stopped, like after the bot was removed from the guild
+        for guild_id in self._signatures.keys() - live:
+            self.discard(guild_id)
+
+        deleted = list(self._deleted)
+        self._deleted.clear()
+        if not rows and not deleted:
+            return
+        try:
+            missing = await asyncio.to_thread(self._write, rows, deleted)
+        except BaseException:
+            # Snapshotted in full again on the next flush
+            self._forget(guild_id for guild_id, *_ in rows)
+            self._deleted.update(deleted)
+            raise
+        self._forget(missing)
+
+    def _forget(self, guild_ids):
+        for guild_id in guild_ids:
+            self._signatures.pop(guild_id, None)
+            self._queues.pop(guild_id, None)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Error writing player snapshots: {e}", exc_info=True)
+
+    def start(self, players: Callable[[], list]):
+        self._players = players
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Write a final snapshot of every player. Players disconnected after this keep their snapshot"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+        await self.flush()
+        self._closed = True
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class RecommendationIndex:
+    """Links between tracks played one after another in the same guild, used to pick autoplay tracks locally"""
+    def __init__(self, file_path=RECOMMEND_DB_PATH, flush_interval=RECOMMEND_FLUSH_INTERVAL,
+                 max_tracks=RECOMMEND_MAX_TRACKS, max_neighbors=RECOMMEND_MAX_NEIGHBORS):
+        self.file_path = file_path
+        self.flush_interval = flush_interval
+        self.max_tracks = max_tracks
+        self.max_neighbors = max_neighbors
+        self._ids: Dict[str, int] = {}  # Track key -> dense ID
+        self._keys: List[Optional[str]] = []  # Dense ID -> track key, None once the track was dropped
+        self._free: List[int] = []  # IDs of dropped tracks, reused for new ones
+        self._plays = array.array("d")  # Play count per ID, viewed as a NumPy array when scoring
+        self._played_at = array.array("d")
+        self._links: List[Dict[int, float]] = []  # Per ID, the linked IDs and their weights
+        self._arrays: Dict[int, tuple] = {}  # Per ID, its links as NumPy arrays, rebuilt when they change
+        self._sessions: Dict[int, deque] = {}  # Guild ID -> (track key, played at) of its recent plays
+        # Changes since the last flush. Counts are written as deltas, so worker processes sharing the file add up
+        self._payloads: Dict[str, dict] = {}
+        self._play_deltas: Dict[str, float] = {}
+        self._link_deltas: Dict[tuple, float] = {}
+        self._unlinked = set()
+        self._dropped = set()
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.file_path, check_same_thread=False, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS tracks ("
+                "key TEXT PRIMARY KEY, data TEXT NOT NULL, plays REAL NOT NULL, played_at REAL NOT NULL)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS links ("
+                "source TEXT NOT NULL, target TEXT NOT NULL, weight REAL NOT NULL, PRIMARY KEY (source, target))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS links_target ON links (target)")
+            self._db = db
+        return self._db
+
+    def _load(self) -> tuple:
+        """Build the index from disk, keeping the most recently played tracks"""
+        with self._lock:
+            db = self._connect()
+            tracks = db.execute(
+                "SELECT key, plays, played_at FROM tracks ORDER BY played_at DESC LIMIT ?", (self.max_tracks,)
+            ).fetchall()
+            links = db.execute("SELECT source, target, weight FROM links").fetchall()
+
+        ids = {key: i for i, (key, _, _) in enumerate(tracks)}
+        adjacency: List[Dict[int, float]] = [{} for _ in tracks]
+        for source, target, weight in links:
+            a, b = ids.get(source), ids.get(target)
+            if a is not None and b is not None:
+                adjacency[a][b] = adjacency[b][a] = weight
+        return (
+            ids,
+            [key for key, _, _ in tracks],
+            array.array("d", (plays for _, plays, _ in tracks)),
+            array.array("d", (played_at for _, _, played_at in tracks)),
+            adjacency,
+        )
+
+    def _write(self, payloads: Dict[str, dict], plays: Dict[str, tuple], links: Dict[tuple, float],
+               unlinked: List[tuple], dropped: List[str]):
+        rows = [(key, json.dumps(payloads[key], separators=(",", ":")), count, played_at)
+                for key, (count, played_at) in plays.items()]
+        with self._lock:
+            db = self._connect()
+            # Rolled back as a whole on failure, so a retried flush never counts anything twice
+            with db:
+                db.executemany("DELETE FROM links WHERE source = ? AND target = ?", unlinked)
+                db.executemany("DELETE FROM tracks WHERE key = ?", [(key,) for key in dropped])
+                db.executemany("DELETE FROM links WHERE source = ? OR target = ?", [(key, key) for key in dropped])
+                db.executemany(
+                    "INSERT INTO tracks (key, data, plays, played_at) VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE "
+                    "SET plays = plays + excluded.plays, played_at = MAX(played_at, excluded.played_at)", rows
+                )
+                db.executemany(
+                    "INSERT INTO links (source, target, weight) VALUES (?, ?, ?) ON CONFLICT (source, target) DO UPDATE "
+                    "SET weight = weight + excluded.weight", [(a, b, weight) for (a, b), weight in links.items()]
+                )
+
+    def _read_payloads(self, keys: List[str]) -> Dict[str, dict]:
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT key, data FROM tracks WHERE key IN ({','.join('?' * len(keys))})", keys
+            ).fetchall()
+        return {key: json.loads(data) for key, data in rows}
+
+    def _add(self, key: str) -> int:
+        if self._free:
+            track_id = self._free.pop()
+            self._keys[track_id] = key
+            self._plays[track_id] = self._played_at[track_id] = 0
+        else:
+            track_id = len(self._keys)
+            self._keys.append(key)
+            self._plays.append(0)
+            self._played_at.append(0)
+            self._links.append({})
+        self._ids[key] = track_id
+        return track_id
+
+    def _link(self, a: int, b: int, weight: float):
+        for source, target in ((a, b), (b, a)):
+            links = self._links[source]
+            links[target] = links.get(target, 0) + weight
+            self._arrays.pop(source, None)
+        pair = tuple(sorted((self._keys[a], self._keys[b])))
+        self._link_deltas[pair] = self._link_deltas.get(pair, 0) + weight
+
+        for track_id in (a, b):
+            # Trimmed in bulk so the sort isn't repeated on every play
+            if len(self._links[track_id]) > self.max_neighbors * 2:
+                self._prune(track_id)
+
+    def _prune(self, track_id: int):
+        """Keep only the strongest links of a track"""
+        links = self._links[track_id]
+        weakest = heapq.nsmallest(len(links) - self.max_neighbors, links, key=links.get)
+        for neighbor in weakest:
+            self._unlink(track_id, neighbor)
+
+    def _unlink(self, a: int, b: int):
+        self._links[a].pop(b, None)
+        self._links[b].pop(a, None)
+        self._arrays.pop(a, None)
+        self._arrays.pop(b, None)
+        pair = tuple(sorted((self._keys[a], self._keys[b])))
+        self._link_deltas.pop(pair, None)
+        self._unlinked.add(pair)
+
+    def _drop_oldest(self):
+        """Forget the least recently played tracks once the index holds more than max_tracks"""
+        excess = len(self._ids) - self.max_tracks
+        if excess <= 0:
+            return
+        played_at = self._played_at
+        for track_id in heapq.nsmallest(excess, self._ids.values(), key=played_at.__getitem__):
+            for neighbor in list(self._links[track_id]):
+                self._unlink(track_id, neighbor)
+            key = self._keys[track_id]
+            del self._ids[key]
+            self._keys[track_id] = None
+            self._free.append(track_id)
+            self._payloads.pop(key, None)
+            self._play_deltas.pop(key, None)
+            self._dropped.add(key)
+
+    def record(self, guild_id: int, track: wavelink.Playable):
+        """Count a play and link it to the tracks the guild played just before it"""
+        if not self.loaded:
+            return
+        now = time.time()
+        key = track_key(track)
+        session = self._sessions.get(guild_id)
+        if session is None:
+            session = self._sessions[guild_id] = deque(maxlen=RECOMMEND_SESSION_SPAN)
+        elif session and now - session[-1][1] > RECOMMEND_SESSION_GAP:
+            session.clear()
+
+        # A looped or restarted track isn't a new play
+        if session and session[-1][0] == key:
+            session[-1] = (key, now)
+            return
+
+        track_id = self._ids.get(key)
+        if track_id is None:
+            track_id = self._add(key)
+        self._plays[track_id] += 1
+        self._played_at[track_id] = now
+        self._payloads[key] = {**track.raw_data, "userData": {}}
+        self._play_deltas[key] = self._play_deltas.get(key, 0) + 1
+
+        # Closer plays are linked more strongly
+        for distance, (previous, _) in enumerate(reversed(session), 1):
+            previous_id = self._ids.get(previous)
+            if previous_id is not None and previous_id != track_id:
+                self._link(previous_id, track_id, 1 / distance)
+        session.append((key, now))
+
+    def _neighbor_arrays(self, track_id: int) -> tuple:
+        arrays = self._arrays.get(track_id)
+        if arrays is None:
+            links = self._links[track_id]
+            arrays = self._arrays[track_id] = (
+                np.fromiter(links.keys(), dtype=np.int64, count=len(links)),
+                np.fromiter(links.values(), dtype=np.float64, count=len(links)),
+            )
+        return arrays
+
+    def score(self, seeds: Dict[int, float], exclude: set, limit: int) -> List[int]:
+        """IDs of the tracks most strongly linked to the weighted seeds, best first"""
+        # Each seed's links add up to its weight, and candidates are damped by the square root of their plays
+        # so tracks that follow everything don't crowd out the ones specific to the seeds
+        if np is None:
+            return self._score_python(seeds, exclude, limit)
+
+        ids, weights = [], []
+        for seed_id, seed_weight in seeds.items():
+            neighbor_ids, link_weights = self._neighbor_arrays(seed_id)
+            if len(neighbor_ids):
+                ids.append(neighbor_ids)
+                weights.append(link_weights * (seed_weight / link_weights.sum()))
+        if not ids:
+            return []
+
+        candidates, inverse = np.unique(np.concatenate(ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weights))
+        scores /= np.sqrt(np.frombuffer(self._plays, dtype=np.float64)[candidates])
+        if exclude:
+            scores[np.isin(candidates, np.fromiter(exclude, dtype=np.int64, count=len(exclude)))] = 0
+
+        count = min(limit, len(candidates))
+        best = np.argpartition(-scores, count - 1)[:count]
+        best = best[np.argsort(-scores[best])]
+        return candidates[best[scores[best] > 0]].tolist()
+
+    def _score_python(self, seeds: Dict[int, float], exclude: set, limit: int) -> List[int]:
+        scores: Dict[int, float] = {}
+        for seed_id, seed_weight in seeds.items():
+            links = self._links[seed_id]
+            total = sum(links.values())
+            for neighbor, weight in links.items():
+                scores[neighbor] = scores.get(neighbor, 0) + weight * seed_weight / total
+
+        plays = self._plays
+        candidates = (track_id for track_id in scores if track_id not in exclude)
+        return heapq.nlargest(limit, candidates, key=lambda track_id: scores[track_id] / math.sqrt(plays[track_id]))
+
+    async def recommend(self, seeds: List[wavelink.Playable], exclude: List[wavelink.Playable],
+                        limit: int = AUTOPLAY_BATCH) -> List[wavelink.Playable]:
+        """Tracks to play after the seeds, most recent seed first. Built from stored payloads, nothing is searched"""
+        if not self.loaded:
+            return []
+
+        seed_weights: Dict[int, float] = {}
+        for rank, track in enumerate(seeds, 1):
+            track_id = self._ids.get(track_key(track))
+            if track_id is not None and self._links[track_id]:
+                seed_weights.setdefault(track_id, 1 / rank)
+        if not seed_weights:
+            return []
+
+        excluded = set(seed_weights)
+        for track in exclude:
+            track_id = self._ids.get(track_key(track))
+            if track_id is not None:
+                excluded.add(track_id)
+
+        keys = [self._keys[track_id] for track_id in self.score(seed_weights, excluded, limit)]
+        payloads = {key: self._payloads[key] for key in keys if key in self._payloads}
+        missing = [key for key in keys if key not in payloads]
+        if missing:
+            payloads.update(await asyncio.to_thread(self._read_payloads, missing))
+        return [wavelink.Playable(payloads[key]) for key in keys if key in payloads]
+
+    async def flush(self):
+        """Write the plays and links added since the last flush in a single transaction"""
+        self._drop_oldest()
+        if not (self._play_deltas or self._link_deltas or self._unlinked or self._dropped):
+            return
+
+        play_deltas, self._play_deltas = self._play_deltas, {}
+        plays = {key: (count, self._played_at[self._ids[key]]) for key, count in play_deltas.items()}
+        payloads, self._payloads = self._payloads, {}
+        links, self._link_deltas = self._link_deltas, {}
+        unlinked, self._unlinked = self._unlinked, set()
+        dropped, self._dropped = self._dropped, set()
+        try:
+            await asyncio.to_thread(self._write, payloads, plays, links, unlinked, dropped)
+        except BaseException:
+            # Put the deltas back so the next flush writes them, merged with anything recorded since
+            for key, count in play_deltas.items():
+                if key in self._ids:
+                    self._play_deltas[key] = self._play_deltas.get(key, 0) + count
+            for key, data in payloads.items():
+                self._payloads.setdefault(key, data)
+            for pair, weight in links.items():
+                if pair not in self._unlinked:
+                    self._link_deltas[pair] = self._link_deltas.get(pair, 0) + weight
+            self._unlinked |= unlinked
+            self._dropped |= dropped
+            raise
+
+    async def _run(self):
+        try:
+            ids, keys, plays, played_at, links = await asyncio.to_thread(self._load)
+        except Exception as e:
+            logging.error(f"Error loading the recommendation index: {e}", exc_info=True)
+        else:
+            self._ids, self._keys, self._plays, self._played_at, self._links = ids, keys, plays, played_at, links
+            logging.info(f"Loaded {len(ids)} tracks into the recommendation index")
+        self.loaded = True
+
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Error writing the recommendation index: {e}", exc_info=True)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        if self.loaded:
+            await self.flush()
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class HistoryPager:
+    """Where /history pages of one guild or member start, counted from the newest play when page 1 was shown"""
+    __slots__ = ("anchor", "expires_at", "cursors")
+
+    def __init__(self, ttl: float = HISTORY_CURSOR_TTL):
+        self.anchor: Optional[tuple] = None  # (played at, ID) of the newest play, set by the first read
+        self.expires_at = time.monotonic() + ttl
+        self.cursors: Dict[int, tuple] = {}  # Position -> (played at, ID) of the play just before it
+
+
+class PlayHistoryStore:
+    """Append-only log of every guild's plays, written to SQLite in batches"""
+    def __init__(self, file_path=HISTORY_DB_PATH, flush_interval=HISTORY_FLUSH_INTERVAL,
+                 compact_interval=HISTORY_COMPACT_INTERVAL, retention=HISTORY_RETENTION, max_plays=HISTORY_MAX_PLAYS):
+        self.file_path = file_path
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+        self.retention = retention
+        self.max_plays = max_plays
+        self._pending: List[tuple] = []  # (guild ID, track key, requester ID, played at) not written yet
+        self._payloads: Dict[str, dict] = {}  # Track key -> Lavalink payload of the pending plays
+        self._last_compact = time.monotonic()
+        self._pagers: OrderedDict = OrderedDict()  # (guild ID, requester ID) -> HistoryPager
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.file_path, check_same_thread=False, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            # Each track's payload is stored once, plays only refer to it
+            db.execute("CREATE TABLE IF NOT EXISTS tracks (key TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS plays (id INTEGER PRIMARY KEY, guild_id INTEGER NOT NULL, "
+                "track_key TEXT NOT NULL, requester_id INTEGER, played_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS plays_by_time ON plays (guild_id, played_at)")
+            db.execute("CREATE INDEX IF NOT EXISTS plays_by_requester ON plays (guild_id, requester_id, played_at)")
+            # Running play counts per track, so /top reads its rows straight off an index
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS play_counts (guild_id INTEGER NOT NULL, track_key TEXT NOT NULL, "
+                "plays INTEGER NOT NULL, last_played REAL NOT NULL, PRIMARY KEY (guild_id, track_key))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS play_counts_by_plays ON play_counts (guild_id, plays DESC, last_played DESC)")
+            self._db = db
+        return self._db
+
+    def _write(self, rows: List[tuple], payloads: Dict[str, dict]):
+        encoded = [(key, json.dumps(data, separators=(",", ":"))) for key, data in payloads.items()]
+        with self._lock:
+            db = self._connect()
+            # Rolled back as a whole on failure, so a retried flush never counts anything twice
+            with db:
+                db.executemany("INSERT OR IGNORE INTO tracks (key, data) VALUES (?, ?)", encoded)
+                db.executemany("INSERT INTO plays (guild_id, track_key, requester_id, played_at) VALUES (?, ?, ?, ?)", rows)
+                db.executemany(
+                    "INSERT INTO play_counts (guild_id, track_key, plays, last_played) VALUES (?, ?, 1, ?) "
+                    "ON CONFLICT (guild_id, track_key) DO UPDATE "
+                    "SET plays = plays + 1, last_played = MAX(last_played, excluded.last_played)",
+                    [(guild_id, key, played_at) for guild_id, key, _, played_at in rows]
+                )
+
+    def _compact(self, cutoff: float) -> int:
+        """Drop plays older than the cutoff and each guild's plays beyond max_plays, with their counts"""
+        with self._lock:
+            db = self._connect()
+            expired = db.execute("SELECT id, guild_id, track_key FROM plays WHERE played_at < ?", (cutoff,)).fetchall()
+            full = db.execute(
+                "SELECT guild_id FROM plays GROUP BY guild_id HAVING COUNT(*) > ?", (self.max_plays,)
+            ).fetchall()
+            for guild_id, in full:
+                expired += db.execute(
+                    "SELECT id, guild_id, track_key FROM plays WHERE guild_id = ? AND played_at >= ? "
+                    "ORDER BY played_at DESC LIMIT -1 OFFSET ?", (guild_id, cutoff, self.max_plays)
+                ).fetchall()
+            if not expired:
+                return 0
+
+            counts: Dict[tuple, int] = {}
+            for _, guild_id, key in expired:
+                counts[guild_id, key] = counts.get((guild_id, key), 0) + 1
+            db.executemany("DELETE FROM plays WHERE id = ?", [(play_id,) for play_id, _, _ in expired])
+            db.executemany(
+                "UPDATE play_counts SET plays = plays - ? WHERE guild_id = ? AND track_key = ?",
+                [(count, guild_id, key) for (guild_id, key), count in counts.items()]
+            )
+            db.execute("DELETE FROM play_counts WHERE plays <= 0")
+            db.execute("DELETE FROM tracks WHERE key NOT IN (SELECT track_key FROM play_counts)")
+            db.commit()
+        return len(expired)
+
+    def _recent(self, guild_id: int, limit: int, anchor: Optional[tuple], before: Optional[tuple], skip: int,
+                requester_id: Optional[int]) -> tuple:
+        """Up to limit plays from skip plays past the before cursor, or past the anchor when there's no cursor.
+        Returns the anchor, the newest play when none was given, and the plays"""
+        where, params = ("p.guild_id = ?", [guild_id]) if requester_id is None else \
+            ("p.guild_id = ? AND p.requester_id = ?", [guild_id, requester_id])
+        order = "ORDER BY p.played_at DESC, p.id DESC"
+        with self._lock:
+            db = self._connect()
+            if anchor is None:
+                anchor = db.execute(f"SELECT p.played_at, p.id FROM plays p WHERE {where} {order} LIMIT 1", params).fetchone()
+                if anchor is None:
+                    return None, []
+
+            # Plays newer than the anchor came after the positions were counted, so they're left out
+            bound = f"{where} AND (p.played_at, p.id) {'<=' if before is None else '<'} (?, ?)"
+            params += before or anchor
+            if skip:
+                # Only the index is walked to find where an unread position starts
+                before = db.execute(
+                    f"SELECT p.played_at, p.id FROM plays p WHERE {bound} {order} LIMIT 1 OFFSET ?", (*params, skip - 1)
+                ).fetchone()
+                if before is None:
+                    return anchor, []
+                bound = f"{where} AND (p.played_at, p.id) < (?, ?)"
+                params[-2:] = before
+
+            # Read off the (guild, played at) indexes, whose entries end in the play ID
+            return anchor, db.execute(
+                "SELECT p.id, t.data, p.requester_id, p.played_at FROM plays p JOIN tracks t ON t.key = p.track_key "
+                f"WHERE {bound} {order} LIMIT ?", (*params, limit)
+            ).fetchall()
+
+    def _top(self, guild_id: int, limit: int) -> List[tuple]:
+        with self._lock:
+            return self._connect().execute(
+                "SELECT t.data, c.plays, c.last_played FROM play_counts c JOIN tracks t ON t.key = c.track_key "
+                "WHERE c.guild_id = ? ORDER BY c.plays DESC, c.last_played DESC LIMIT ?", (guild_id, limit)
+            ).fetchall()
+
+    def _popular_tracks(self, limit: int) -> List[tuple]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT t.data, SUM(c.plays) FROM play_counts c JOIN tracks t ON t.key = c.track_key "
+                "GROUP BY c.track_key ORDER BY MAX(c.last_played) DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [(json.loads(data), plays) for data, plays in rows]
+
+    async def popular_tracks(self, limit: int) -> List[tuple]:
+        """Payloads of the most recently played tracks across guilds, with their play counts"""
+        return await asyncio.to_thread(self._popular_tracks, limit)
+
+    def record(self, guild_id: int, track: wavelink.Playable):
+        key = track_key(track)
+        self._pending.append((guild_id, key, track_requester(track), time.time()))
+        self._payloads[key] = {**track.raw_data, "userData": {}}
+
+    async def recent(self, guild_id: int, start: int = 0, limit: int = HISTORY_PAGE_SIZE,
+                     requester_id: Optional[int] = None, fresh: bool = False) -> List[tuple]:
+        """Up to limit plays from position start of the guild's history as (track, requester ID, played at), newest
+        first. Positions count from the newest play when the history was last read fresh, so /history pages and
+        /replay numbers agree until the pager expires"""
+        await self.flush()
+        key = (guild_id, requester_id)
+        pager = self._pagers.pop(key, None)
+        if fresh or pager is None or pager.expires_at <= time.monotonic():
+            pager = HistoryPager()
+        self._pagers[key] = pager
+        while len(self._pagers) > HISTORY_CURSORS:
+            self._pagers.popitem(last=False)
+
+        # Read on from the nearest position an earlier read ended at
+        position = max((known for known in pager.cursors if known <= start), default=0)
+        pager.anchor, rows = await asyncio.to_thread(
+            self._recent, guild_id, limit, pager.anchor, pager.cursors.get(position), start - position, requester_id
+        )
+        if rows:
+            pager.cursors[start + len(rows)] = (rows[-1][3], rows[-1][0])
+        return [(wavelink.Playable(json.loads(data)), requester, played_at) for _, data, requester, played_at in rows]
+
+    async def top(self, guild_id: int, limit: int = HISTORY_PAGE_SIZE) -> List[tuple]:
+        """The guild's most played tracks as (track, plays, last played)"""
+        await self.flush()
+        rows = await asyncio.to_thread(self._top, guild_id, limit)
+        return [(wavelink.Playable(json.loads(data)), plays, last_played) for data, plays, last_played in rows]
+
+    async def flush(self):
+        """Write the plays recorded since the last flush in a single transaction"""
+        if not self._pending:
+            return
+
+        rows, self._pending = self._pending, []
+        payloads, self._payloads = self._payloads, {}
+        try:
+            await asyncio.to_thread(self._write, rows, payloads)
+        except BaseException:
+            # Older plays go back in front, so the next flush writes everything in order
+            self._pending[:0] = rows
+            for key, data in payloads.items():
+                self._payloads.setdefault(key, data)
+            raise
+
+    async def compact(self):
+        removed = await asyncio.to_thread(self._compact, time.time() - self.retention)
+        if removed:
+            logging.info(f"Removed {removed} old plays from the play history")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_compact >= self.compact_interval:
+                    self._last_compact = time.monotonic()
+                    await self.compact()
+            except Exception as e:
+                logging.error(f"Error writing the play history: {e}", exc_info=True)
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+        await self.flush()
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class DJRoleIndex:
+    """IDs of each guild's DJ roles, so permission checks don't scan the guild's roles"""
+    def __init__(self, role_name=DJ_ROLE_NAME):
+        self.role_name = role_name
+        self._roles: Dict[int, tuple] = {}
+
+    def role_ids(self, guild: discord.Guild) -> tuple:
+        role_ids = self._roles.get(guild.id)
+        if role_ids is None:
+            role_ids = self._roles[guild.id] = tuple(role.id for role in guild.roles if role.name == self.role_name)
+        return role_ids
+
+    def invalidate(self, guild_id: int):
+        self._roles.pop(guild_id, None)
+
+
+class TrackCache:
+    """Persistent cache of Lavalink load results, keyed by normalized search term"""
+    def __init__(self, file_path=TRACK_CACHE_PATH, max_bytes=TRACK_CACHE_MAX_BYTES):
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._db: Optional[sqlite3.Connection] = None
+        # SQLite work runs in worker threads, one at a time
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.file_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS tracks ("
+                "key TEXT PRIMARY KEY, payload TEXT NOT NULL, size INTEGER NOT NULL, "
+                "is_stream INTEGER NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL, "
+                "hits INTEGER NOT NULL DEFAULT 0)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS tracks_last_access ON tracks (last_access)")
+            db.execute("CREATE INDEX IF NOT EXISTS tracks_expires_at ON tracks (expires_at)")
+            # Cluster workers share the file, so the cache's size is kept in it rather than per process
+            db.execute("CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), total_bytes INTEGER NOT NULL)")
+            db.execute("INSERT OR IGNORE INTO cache_size VALUES (0, (SELECT COALESCE(SUM(size), 0) FROM tracks))")
+            db.commit()
+            self._db = db
+        return self._db
+
+    @staticmethod
+    def _is_stream(result: dict) -> bool:
+        if result["loadType"] == "track":
+            return result["data"]["info"]["isStream"]
+        if result["loadType"] == "search":
+            return any(track["info"]["isStream"] for track in result["data"])
+        return False
+
+    def _ttl_for(self, key: str, is_stream: bool) -> int:
+        if is_stream:
+            return TRACK_CACHE_STREAM_TTL
+        if yarl.URL(key).host:
+            return TRACK_CACHE_URL_TTL
+        return TRACK_CACHE_TTL
+
+    def _get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            db = self._connect()
+            row = db.execute("SELECT payload, size, expires_at FROM tracks WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            now = time.time()
+            if row[2] <= now:
+                db.execute("DELETE FROM tracks WHERE key = ?", (key,))
+                db.execute("UPDATE cache_size SET total_bytes = total_bytes - ?", (row[1],))
+                db.commit()
+                return None
+
+            db.execute("UPDATE tracks SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            db.commit()
+
+        return json.loads(row[0])
+
+    def _put(self, key: str, result: dict):
+        payload = json.dumps(result, separators=(",", ":"))
+        size = len(payload.encode())
+        if size > self.max_bytes:
+            return
+
+        is_stream = self._is_stream(result)
+        now = time.time()
+
+        with self._lock:
+            db = self._connect()
+            # Take the write lock up front so another worker can't change the entry between the reads and writes
+            db.execute("BEGIN IMMEDIATE")
+            old = db.execute("SELECT size FROM tracks WHERE key = ?", (key,)).fetchone()
+            db.execute(
+                "INSERT OR REPLACE INTO tracks (key, payload, size, is_stream, expires_at, last_access, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (key, payload, size, int(is_stream), now + self._ttl_for(key, is_stream), now)
+            )
+            total = db.execute(
+                "UPDATE cache_size SET total_bytes = total_bytes + ? RETURNING total_bytes", (size - (old[0] if old else 0),)
+            ).fetchone()[0]
+
+            if total > self.max_bytes:
+                self._evict(db, now)
+            db.commit()
+
+    def _evict(self, db: sqlite3.Connection, now: float):
+        """Drop expired entries, then least recently used ones until we're back under budget"""
+        # Recounted inside the write transaction, so entries every worker added are included
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM tracks").fetchone()[0]
+        expired = db.execute("SELECT COALESCE(SUM(size), 0) FROM tracks WHERE expires_at <= ?", (now,)).fetchone()[0]
+        if expired:
+            db.execute("DELETE FROM tracks WHERE expires_at <= ?", (now,))
+            total -= expired
+
+        while total > self.max_bytes:
+            rows = db.execute("SELECT key, size FROM tracks ORDER BY last_access LIMIT 64").fetchall()
+            if not rows:
+                total = 0
+                break
+
+            db.executemany("DELETE FROM tracks WHERE key = ?", [(row[0],) for row in rows])
+            total -= sum(row[1] for row in rows)
+        db.execute("UPDATE cache_size SET total_bytes = ?", (total,))
+
+    def _recent_tracks(self, limit: int) -> List[dict]:
+        """Track payloads of the most recently used single track and search results"""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT payload FROM tracks WHERE expires_at > ? ORDER BY last_access DESC LIMIT ?", (time.time(), limit)
+            ).fetchall()
+
+        tracks = []
+        for payload, in rows:
+            result = json.loads(payload)
+            if result["loadType"] == "track":
+                tracks.append(result["data"])
+            elif result["loadType"] == "search":
+                tracks.extend(result["data"][:SUGGEST_PER_SEARCH])
+        return tracks[:limit]
+
+    async def recent_tracks(self, limit: int) -> List[dict]:
+        return await asyncio.to_thread(self._recent_tracks, limit)
+
+    async def get(self, key: str) -> Optional[dict]:
+        result = await asyncio.to_thread(self._get, key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    async def put(self, key: str, result: dict):
+        await asyncio.to_thread(self._put, key, result)
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class SearchCoalescer:
+    """Collapses identical concurrent searches into one in-flight Lavalink request"""
+    def __init__(self):
+        self.requests = 0  # Total searches seen
+        self.collapsed = 0  # Searches that joined an in-flight request instead of sending their own
+        self.errors = 0  # In-flight requests that failed (each failure is shared by all waiters)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[asyncio.Future, int] = {}  # Callers still awaiting each in-flight request
+
+    async def run(self, key: str, factory):
+        """Await factory() for this key, sharing the result with any concurrent caller using the same key"""
+        self.requests += 1
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.collapsed += 1
+        else:
+            # Run the request in its own task so a cancelled caller doesn't cancel it for everyone else
+            future = asyncio.ensure_future(factory())
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._finish(key, done))
+
+        self._waiters[future] = self._waiters.get(future, 0) + 1
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self._waiters[future] -= 1
+            if not self._waiters[future]:
+                del self._waiters[future]
+                # Every caller went away, like the losing half of a hedged search, so nobody needs the result
+                if not future.done():
+                    # Dropped right away, so a caller arriving while it winds down starts a fresh request
+                    if self._inflight.get(key) is future:
+                        del self._inflight[key]
+                    future.cancel()
+
+    def _finish(self, key: str, future: asyncio.Future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+        # Retrieve the exception so it is never reported as unhandled when every waiter went away
+        if not future.cancelled() and future.exception() is not None:
+            self.errors += 1
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "collapsed": self.collapsed,
+            "errors": self.errors,
+            "inflight": self.inflight,
+        }
+
+
+class SpotifyTrack:
+    """Spotify track metadata, what a playable version of the song is searched by"""
+    __slots__ = ("title", "artists", "length", "isrc")
+
+    def __init__(self, title: str, artists: List[str], length: int, isrc: Optional[str] = None):
+        self.title = title
+        self.artists = artists
+        self.length = length  # Milliseconds
+        self.isrc = isrc
+
+    @classmethod
+    def from_json(cls, data: Optional[dict]) -> Optional["SpotifyTrack"]:
+        """Build from a Spotify track object, None for removed tracks, local files and podcast episodes"""
+        if not data or data.get("is_local") or data.get("type", "track") != "track" or not data.get("name"):
+            return None
+        artists = [artist["name"] for artist in data.get("artists", [])]
+        return cls(data["name"], artists, data.get("duration_ms", 0), data.get("external_ids", {}).get("isrc"))
+
+    @property
+    def artist(self) -> str:
+        return self.artists[0] if self.artists else ""
+
+    @property
+    def keys(self) -> List[str]:
+        """Mapping cache keys, the ISRC first since it names the exact recording"""
+        keys = [f"isrc:{self.isrc.upper()}"] if self.isrc else []
+        keys.append(f"meta:{TrackSuggestionIndex.normalize(f'{self.artist} - {self.title}')}")
+        return keys
+
+    @property
+    def queries(self) -> List[str]:
+        """Searches to try in order, sources that index ISRCs answer the first one exactly"""
+        queries = [f'"{self.isrc}"'] if self.isrc else []
+        queries.append(f"{self.artist} - {self.title}")
+        return queries
+
+
+class SpotifyClient:
+    """Reads playlist, album and track metadata from the Spotify Web API with client credentials"""
+    def __init__(self, client_id: str, client_secret: str, api_url=SPOTIFY_API_URL, token_url=SPOTIFY_TOKEN_URL,
+                 max_tracks=SPOTIFY_MAX_TRACKS, concurrency=SPOTIFY_REQUEST_CONCURRENCY):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.api_url = api_url.rstrip("/")
+        self.token_url = token_url
+        self.max_tracks = max_tracks
+        self.requests = 0
+        self._slots = asyncio.Semaphore(concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._token: Optional[str] = None
+        self._token_expires = 0.0
+        self._token_lock = asyncio.Lock()
+
+    def _http(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15))
+        return self._session
+
+    async def _access_token(self) -> str:
+        async with self._token_lock:
+            if self._token is None or time.monotonic() >= self._token_expires:
+                auth = aiohttp.BasicAuth(self.client_id, self.client_secret)
+                async with self._http().post(self.token_url, data={"grant_type": "client_credentials"}, auth=auth) as response:
+                    response.raise_for_status()
+                    data = await response.json()
+                self._token = data["access_token"]
+                # Renew a minute early so no request goes out with a token that is about to expire
+                self._token_expires = time.monotonic() + data.get("expires_in", 3600) - 60
+            return self._token
+
+    async def _get(self, path: str, **params) -> dict:
+        """GET an API path, retrying rate limits and server errors with the delay Spotify asks for"""
+        for attempt in range(SPOTIFY_MAX_RETRIES + 1):
+            token = await self._access_token()
+            async with self._slots:
+                self.requests += 1
+                async with self._http().get(f"{self.api_url}{path}", params=params,
+                                            headers={"Authorization": f"Bearer {token}"}) as response:
+                    retry = attempt < SPOTIFY_MAX_RETRIES and (response.status in (401, 429) or response.status >= 500)
+                    if not retry:
+                        response.raise_for_status()
+                        return await response.json()
+                    if response.status == 401:
+                        # The token was revoked or expired early, fetch a new one straight away
+                        self._token = None
+                        delay = 0
+                    else:
+                        delay = float(response.headers.get("Retry-After", 2 ** attempt))
+
+            logging.warning(f"Spotify answered {response.status} for {path}, retrying in {delay}s")
+            await asyncio.sleep(delay)
+
+    async def _pages(self, path: str, first: dict, limit: int) -> List[dict]:
+        """Items of a paging object, the pages after the first one are fetched concurrently"""
+        items = list(first["items"])
+        total = min(first["total"], self.max_tracks)
+        pages = await asyncio.gather(*(
+            self._get(path, offset=offset, limit=limit) for offset in range(len(items), total, limit)
+        ))
+        for page in pages:
+            items.extend(page["items"])
+        return items[:self.max_tracks]
+
+    async def track(self, track_id: str) -> Optional[SpotifyTrack]:
+        return SpotifyTrack.from_json(await self._get(f"/tracks/{track_id}"))
+
+    async def playlist(self, playlist_id: str) -> Tuple[dict, List[SpotifyTrack]]:
+        """Playlist info in Lavalink's pluginInfo shape, and its tracks"""
+        data = await self._get(f"/playlists/{playlist_id}")
+        items = await self._pages(f"/playlists/{playlist_id}/tracks", data["tracks"], 100)
+        tracks = [SpotifyTrack.from_json(item.get("track")) for item in items]
+
+        info = {
+            "name": data["name"],
+            "url": data.get("external_urls", {}).get("spotify"),
+            "artworkUrl": data["images"][0]["url"] if data.get("images") else None,
+            "author": (data.get("owner") or {}).get("display_name"),
+        }
+        return info, [track for track in tracks if track]
+
+    async def album(self, album_id: str) -> Tuple[dict, List[SpotifyTrack]]:
+        """Album info in Lavalink's pluginInfo shape, and its tracks"""
+        data = await self._get(f"/albums/{album_id}")
+        items = await self._pages(f"/albums/{album_id}/tracks", data["tracks"], 50)
+
+        # Album track listings leave out ISRCs, the full track objects have them
+        ids = [item["id"] for item in items if item.get("id")]
+        batches = await asyncio.gather(*(
+            self._get("/tracks", ids=",".join(ids[i:i + 50])) for i in range(0, len(ids), 50)
+        ))
+        tracks = [SpotifyTrack.from_json(track) for batch in batches for track in batch["tracks"]]
+
+        info = {
+            "name": data["name"],
+            "url": data.get("external_urls", {}).get("spotify"),
+            "artworkUrl": data["images"][0]["url"] if data.get("images") else None,
+            "author": ", ".join(artist["name"] for artist in data.get("artists", [])) or None,
+        }
+        return info, [track for track in tracks if track]
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class SpotifyTrackMap:
+    """Persistent map from Spotify ISRCs and artist/title pairs to the Lavalink tracks they were matched to"""
+    def __init__(self, file_path=SPOTIFY_MAP_PATH, ttl=SPOTIFY_MAP_TTL):
+        self.file_path = file_path
+        self.ttl = ttl
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.file_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS tracks (key TEXT PRIMARY KEY, payload TEXT NOT NULL, matched_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS tracks_matched_at ON tracks (matched_at)")
+            self._db = db
+        return self._db
+
+    def _get_many(self, keys: List[str]) -> Dict[str, dict]:
+        cutoff = time.time() - self.ttl
+        found = {}
+        with self._lock:
+            db = self._connect()
+            # Stay under SQLite's limit on bound parameters
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = db.execute(
+                    f"SELECT key, payload FROM tracks WHERE matched_at > ? AND key IN ({','.join('?' * len(chunk))})",
+                    (cutoff, *chunk)
+                ).fetchall()
+                found.update((key, json.loads(payload)) for key, payload in rows)
+        return found
+
+    def _put_many(self, payloads: Dict[str, dict]):
+        now = time.time()
+        rows = [(key, json.dumps(data, separators=(",", ":")), now) for key, data in payloads.items()]
+        with self._lock:
+            db = self._connect()
+            db.executemany("INSERT OR REPLACE INTO tracks (key, payload, matched_at) VALUES (?, ?, ?)", rows)
+            db.execute("DELETE FROM tracks WHERE matched_at <= ?", (now - self.ttl,))
+            db.commit()
+
+    async def get_many(self, keys) -> Dict[str, dict]:
+        return await asyncio.to_thread(self._get_many, list(keys))
+
+    async def put_many(self, payloads: Dict[str, dict]):
+        await asyncio.to_thread(self._put_many, payloads)
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class SpotifyResolver:
+    """Expands Spotify links and matches their tracks to playable ones, a few searches at a time"""
+    def __init__(self, client: SpotifyClient, track_map: Optional[SpotifyTrackMap] = None,
+                 concurrency=SPOTIFY_RESOLVE_CONCURRENCY):
+        self.client = client
+        self.track_map = track_map or SpotifyTrackMap()
+        self.concurrency = concurrency
+        self.cached = 0  # Tracks answered from the mapping cache
+        self.searched = 0  # Tracks matched by a Lavalink search
+        self.missing = 0  # Tracks no search found
+
+    async def resolve(self, kind: str, spotify_id: str) -> Union["LazyPlaylist", List[wavelink.Playable]]:
+        """Resolve a track, playlist or album link the way resolve_search resolves a Lavalink one"""
+        if kind == "track":
+            track = await self.client.track(spotify_id)
+            payloads = await self.match_all([track] if track else [])
+            return [wavelink.Playable(data) for data in payloads if data][:1]
+
+        info, tracks = await (self.client.album(spotify_id) if kind == "album" else self.client.playlist(spotify_id))
+        payloads = await self.match_all(tracks)
+        name = info.pop("name")
+        return LazyPlaylist({
+            "info": {"name": name, "selectedTrack": -1},
+            "pluginInfo": {"type": kind, **info},
+            "tracks": [data for data in payloads if data],
+        })
+
+    async def match_all(self, tracks: List[SpotifyTrack]) -> List[Optional[dict]]:
+        """Lavalink payloads for the tracks in order, None where nothing matched"""
+        cached = await self.track_map.get_many({key for track in tracks for key in track.keys})
+        payloads = [next((cached[key] for key in track.keys if key in cached), None) for track in tracks]
+        misses = [i for i, data in enumerate(payloads) if data is None]
+        self.cached += len(tracks) - len(misses)
+
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def search(i: int):
+            async with slots:
+                try:
+                    payloads[i] = await self.match(tracks[i])
+                except (wavelink.LavalinkException, wavelink.NodeException, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    # Counted as missing, one failed search shouldn't lose the rest of the playlist
+                    logging.warning(f"Couldn't match Spotify track {tracks[i].title!r}: {e!r}")
+
+        try:
+            await asyncio.gather(*(search(i) for i in misses))
+        finally:
+            # Saved even when the resolve is cut short, so the tracks found so far aren't searched again
+            matched = {key: payloads[i] for i in misses if payloads[i] is not None for key in tracks[i].keys}
+            if matched:
+                await self.track_map.put_many(matched)
+
+        found = sum(1 for i in misses if payloads[i] is not None)
+        self.searched += found
+        self.missing += len(misses) - found
+        return payloads
+
+    async def match(self, track: SpotifyTrack) -> Optional[dict]:
+        """Search for the track and take the best ranked result of about the same length"""
+        fallback = None
+        for query in track.queries:
+            try:
+                results = await resolve_search(build_search_term(query))
+            except wavelink.LavalinkLoadException:
+                continue
+            if isinstance(results, LazyPlaylist) or not results:
+                continue
+
+            for result in results:
+                if not result.is_stream and abs(result.length - track.length) <= SPOTIFY_LENGTH_TOLERANCE:
+                    return result.raw_data
+            fallback = results[0].raw_data
+
+        # Nothing had the right length, the artist and title search's top result is still the likeliest
+        return fallback
+
+    async def close(self):
+        await self.client.close()
+        self.track_map.close()
+
+
+class SourceHealth:
+    """Latency and failures of a search source's recent Lavalink searches"""
+    def __init__(self, window=SOURCE_HEALTH_WINDOW, ttl=SOURCE_HEALTH_TTL):
+        self.window = window
+        self.ttl = ttl
+        self._samples = deque()  # (monotonic time, seconds taken, failed), oldest first
+        self._latencies: List[float] = []  # Latencies of the successful samples, kept sorted for percentiles
+        self._failures = 0
+
+    def record(self, latency: float, failed: bool):
+        self._samples.append((time.monotonic(), latency, failed))
+        if failed:
+            self._failures += 1
+        else:
+            bisect.insort(self._latencies, latency)
+        if len(self._samples) > self.window:
+            self._evict()
+
+    def _evict(self):
+        _, latency, failed = self._samples.popleft()
+        if failed:
+            self._failures -= 1
+        else:
+            del self._latencies[bisect.bisect_left(self._latencies, latency)]
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        while self._samples and self._samples[0][0] < cutoff:
+            self._evict()
+
+    @property
+    def error_rate(self) -> float:
+        self._expire()
+        return self._failures / len(self._samples) if self._samples else 0.0
+
+    @property
+    def failing(self) -> bool:
+        self._expire()
+        return len(self._samples) >= SOURCE_HEALTH_MIN_SAMPLES and self.error_rate > SOURCE_MAX_ERROR_RATE
+
+    def latency(self, quantile: float) -> Optional[float]:
+        """Latency percentile of recent successful searches, None until there are enough of them"""
+        self._expire()
+        latencies = self._latencies
+        if len(latencies) < SOURCE_HEALTH_MIN_SAMPLES:
+            return None
+        return latencies[min(int(len(latencies) * quantile), len(latencies) - 1)]
+
+
+class SearchHedger:
+    """Sends free-text searches to the healthiest source, and to a backup source as well when the first is slow"""
+    def __init__(self, sources=SEARCH_SOURCES):
+        self.sources = [source for source in sources if source]
+        self.health: Dict[str, SourceHealth] = {source: SourceHealth() for source in self.sources}
+        self.hedged = 0  # Searches that sent a backup request
+        self.backup_wins = 0  # Hedged searches the backup answered first
+
+    def record(self, term: str, latency: float, failed: bool):
+        """Record a Lavalink search, terms without a known source prefix (URLs) are ignored"""
+        health = self.health.get(term.partition(":")[0])
+        if health is not None:
+            health.record(latency, failed)
+
+    def ranked(self, preferred: str) -> List[str]:
+        """Sources to search in order: the preferred one unless it's failing, then the others as configured"""
+        sources = [preferred] + [source for source in self.sources if source != preferred]
+        for source in sources:
+            self.health.setdefault(source, SourceHealth())
+        # A stable sort, so failing sources move to the back and everything else keeps its place
+        return sorted(sources, key=lambda source: self.health[source].failing)
+
+    def hedge_delay(self, source: str) -> float:
+        latency = self.health[source].latency(SEARCH_HEDGE_PERCENTILE)
+        if latency is None:
+            return SEARCH_HEDGE_DEFAULT_DELAY
+        return min(max(latency, SEARCH_HEDGE_MIN_DELAY), SEARCH_HEDGE_MAX_DELAY)
+
+    async def search(self, query: str, preferred: str, resolve) -> List[wavelink.Playable]:
+        """Resolve the query on the first source, racing it against a backup once it's slower than usual"""
+        sources = self.ranked(preferred)
+        primary = sources[0]
+        backup = sources[1] if len(sources) > 1 else None
+        attempts: Dict[asyncio.Future, str] = {}
+
+        def launch(source: str) -> asyncio.Future:
+            task = asyncio.ensure_future(resolve(build_search_term(query, source)))
+            attempts[task] = source
+            return task
+
+        pending = {launch(primary)}
+        empty: Optional[list] = None
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                hedge = backup is not None and len(attempts) == 1
+                done, pending = await asyncio.wait(
+                    pending, timeout=self.hedge_delay(primary) if hedge else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                    elif task.result():
+                        if attempts[task] != primary:
+                            self.backup_wins += 1
+                        return task.result()
+                    else:
+                        empty = task.result()
+
+                # The first source is slow, or answered without a usable result
+                if hedge and (not done or not pending):
+                    self.hedged += 1
+                    pending.add(launch(backup))
+        finally:
+            # The loser's Lavalink request is cancelled with it, unless another search is waiting on it
+            for task in pending:
+                task.cancel()
+
+        if empty is not None:
+            return empty
+        raise error
+
+
+class IdleScheduler:
+    """Disconnects players exactly when their inactivity deadline passes, using a deadline heap"""
+    def __init__(self, timeout=INACTIVITY_TIMEOUT, on_expire=None):
+        self.timeout = timeout
+        self.on_expire = on_expire  # Coroutine function called with each expired player
+        self._heap: List[tuple] = []  # (deadline, guild_id), may contain stale entries
+        self._deadlines: Dict[int, float] = {}  # Current deadline per guild
+        self._players: Dict[int, "MusicPlayer"] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._expiring: Set[asyncio.Task] = set()  # Held so running expiries aren't garbage collected
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def arm(self, player: "MusicPlayer"):
+        """(Re)start the inactivity countdown for a player"""
+        guild_id = player.guild.id
+        deadline = time.monotonic() + self.timeout
+        self._deadlines[guild_id] = deadline
+        self._players[guild_id] = player
+        heapq.heappush(self._heap, (deadline, guild_id))
+
+        # Re-arming leaves the old entry behind, rebuild once stale entries dominate the heap
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(deadline, guild_id) for guild_id, deadline in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+        # Only wake the runner if this is now the earliest deadline
+        if self._heap[0] == (deadline, guild_id):
+            self._wakeup.set()
+
+    def cancel(self, guild_id: int):
+        """Forget a player's deadline, e.g. when it disconnects"""
+        self._deadlines.pop(guild_id, None)
+        self._players.pop(guild_id, None)
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                deadline, guild_id = heapq.heappop(self._heap)
+                if self._deadlines.get(guild_id) != deadline:
+                    continue  # Re-armed or cancelled since this entry was pushed
+
+                del self._deadlines[guild_id]
+                player = self._players.pop(guild_id)
+                task = asyncio.create_task(self._expire(player))
+                self._expiring.add(task)
+                task.add_done_callback(self._expiring.discard)
+
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _expire(self, player: "MusicPlayer"):
+        try:
+            await self.on_expire(player)
+        except Exception as e:
+            logging.error(f"Error handling inactive player: {e}", exc_info=True)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class TrackSuggestion:
+    """A track offered by /play autocomplete"""
+    __slots__ = ("name", "value", "text", "grams", "hits")
+
+    def __init__(self, name: str, value: str, text: str, grams: frozenset):
+        self.name = name  # Shown in the autocomplete list
+        self.value = value  # Sent back as the /play query
+        self.text = text  # Normalized title and author
+        self.grams = grams
+        self.hits = 0  # Times the track was searched for or played
+
+
+class TrackSuggestionIndex:
+    """Trigram index over recently seen titles and authors, so /play autocomplete never waits on Lavalink"""
+    def __init__(self, max_tracks=SUGGEST_MAX_TRACKS):
+        self.max_tracks = max_tracks
+        self._entries: Dict[int, TrackSuggestion] = {}
+        self._ids: OrderedDict = OrderedDict()  # Value -> entry ID, least recently seen first
+        self._postings: Dict[str, set] = {}  # Trigram -> IDs of the entries containing it
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(re.sub(r"[\W_]+", " ", text.casefold()).split())
+
+    @staticmethod
+    def trigrams(text: str, prefix: bool = False) -> set:
+        """Trigrams of every word, padded so word starts match. With prefix, the last word may still be incomplete"""
+        words = text.split()
+        grams = set()
+        for i, word in enumerate(words):
+            padded = f"  {word}" if prefix and i == len(words) - 1 else f"  {word} "
+            grams.update(padded[j:j + 3] for j in range(len(padded) - 2))
+        return grams
+
+    def add(self, track: wavelink.Playable, hits: int = 1):
+        """Offer a track as a suggestion, or count another hit for it"""
+        value = track.uri if track.uri and len(track.uri) <= 100 else f"{track.author} - {track.title}"[:100]
+        entry_id = self._ids.get(value)
+        if entry_id is not None:
+            self._ids.move_to_end(value)
+            self._entries[entry_id].hits += hits
+            return
+
+        text = self.normalize(f"{track.title} {track.author}")
+        if not text:
+            return
+        name = f"{track.title} - {track.author}"
+        entry = TrackSuggestion(name if len(name) <= 100 else f"{name[:99]}…", value, text, frozenset(self.trigrams(text)))
+        entry.hits = hits
+
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        self._ids[value] = entry_id
+        for gram in entry.grams:
+            self._postings.setdefault(gram, set()).add(entry_id)
+
+        while len(self._ids) > self.max_tracks:
+            _, oldest = self._ids.popitem(last=False)
+            for gram in self._entries.pop(oldest).grams:
+                posting = self._postings[gram]
+                posting.discard(oldest)
+                if not posting:
+                    del self._postings[gram]
+
+    def search(self, query: str, limit: int = SUGGEST_LIMIT) -> List[TrackSuggestion]:
+        """Suggestions for what the user typed so far, best match first"""
+        text = self.normalize(query)
+        if not text:
+            # Nothing typed yet, offer what was seen last
+            return [self._entries[entry_id] for entry_id in list(reversed(self._ids.values()))[:limit]]
+
+        grams = self.trigrams(text, prefix=True)
+        postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+        entries = self._entries
+
+        # Usually enough entries contain every trigram, and the set intersection finds them without scoring overlap
+        exact = postings[0].intersection(*postings[1:])
+        if len(exact) >= limit:
+            # Whole-prefix matches first, then popularity
+            best = heapq.nlargest(limit, exact, key=lambda entry_id: (entries[entry_id].text.startswith(text), entries[entry_id].hits))
+            return [entries[entry_id] for entry_id in best]
+
+        # An entry with at least need of the trigrams is in one of the len - need + 1 rarest postings. Generic
+        # queries would have to score too many of those, so they need more trigrams in common instead
+        need = max(1, math.ceil(len(grams) * SUGGEST_MIN_SIMILARITY))
+        rare = scanned = 0
+        for posting in postings[:len(grams) - need + 1]:
+            if rare and scanned + len(posting) > SUGGEST_MAX_CANDIDATES:
+                break
+            rare += 1
+            scanned += len(posting)
+        need = len(grams) - rare + 1
+        candidates = exact if rare == 1 else set().union(*postings[:rare])
+
+        grams = frozenset(grams)
+        scored = []
+        for entry_id in candidates:
+            entry = entries[entry_id]
+            matched = len(entry.grams & grams)
+            if matched >= need:
+                # Whole-prefix matches first, then trigram overlap, then popularity
+                scored.append((entry.text.startswith(text), matched, entry.hits, entry_id))
+        return [entries[entry_id] for *_, entry_id in heapq.nlargest(limit, scored)]
+
+
+class SearchSessionStore:
+    """Bounded store of pending search results keyed by (guild, user), expired by one background reaper"""
+    def __init__(self, ttl=SEARCH_SESSION_TTL, max_sessions=SEARCH_SESSION_MAX,
+                 reap_interval=SEARCH_SESSION_REAP_INTERVAL):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.reap_interval = reap_interval
+        self._sessions: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (expires_at, tracks), LRU order
+        self._expiry = deque()  # (expires_at, key) in insertion order, sorted because the TTL is fixed
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def put(self, guild_id: int, user_id: int, tracks: List[wavelink.Playable]):
+        key = (guild_id, user_id)
+        expires_at = time.monotonic() + self.ttl
+        self._sessions[key] = (expires_at, tracks)
+        self._sessions.move_to_end(key)
+        self._expiry.append((expires_at, key))
+
+        # Drop the least recently used sessions once we're over the cap
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def get(self, guild_id: int, user_id: int) -> Optional[List[wavelink.Playable]]:
+        key = (guild_id, user_id)
+        entry = self._sessions.get(key)
+        if entry is None:
+            return None
+
+        if entry[0] <= time.monotonic():
+            del self._sessions[key]
+            return None
+
+        self._sessions.move_to_end(key)
+        return entry[1]
+
+    def pop(self, guild_id: int, user_id: int) -> Optional[List[wavelink.Playable]]:
+        tracks = self.get(guild_id, user_id)
+        if tracks is not None:
+            del self._sessions[(guild_id, user_id)]
+        return tracks
+
+    def reap(self):
+        """Remove every expired session"""
+        now = time.monotonic()
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, key = self._expiry.popleft()
+            entry = self._sessions.get(key)
+            # Only delete if the session wasn't replaced by a newer search
+            if entry is not None and entry[0] == expires_at:
+                del self._sessions[key]
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            self.reap()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._reap_loop())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class NodeHealth:
+    """Last measured load and latency of a Lavalink node"""
+    __slots__ = ("load", "playing", "players", "cpu", "deficit", "nulled", "latency", "failures", "checked_at")
+
+    def __init__(self):
+        self.load = 0.0  # CPU and frame penalty, see NodeBalancer.load_penalty
+        self.playing = 0  # Playing players reported by Lavalink, including other clients
+        self.players = 0
+        self.cpu = 0.0  # System load, 0-1
+        self.deficit = 0  # Frame deficit over the last minute
+        self.nulled = 0  # Nulled frames over the last minute
+        self.latency = 0.0  # Smoothed REST round trip in seconds
+        self.failures = 0  # Failed health checks in a row
+        self.checked_at = 0.0
+
+
+class NodeBalancer:
+    """Routes players and searches to the least loaded Lavalink node and moves players off failing ones"""
+    def __init__(self, client: discord.Client, probe_interval=NODE_PROBE_INTERVAL, probe_timeout=NODE_PROBE_TIMEOUT):
+        self.client = client
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.health: Dict[str, NodeHealth] = {}
+        self.migrations = 0
+        self.failed_migrations = 0
+        self._migrating: set = set()  # Guild IDs currently switching nodes
+        self._migration_slots = asyncio.Semaphore(NODE_MIGRATION_CONCURRENCY)
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def load_penalty(stats) -> float:
+        """CPU and frame deficit penalty, using the weights common Lavalink clients use"""
+        penalty = 1.05 ** (100 * stats.cpu.system_load) * 10 - 10
+        if stats.frames:
+            # Frame stats are per minute, a healthy player sends 3000 frames a minute
+            penalty += (1.03 ** (500 * stats.frames.deficit / 3000)) * 600 - 600
+            penalty += ((1.03 ** (500 * stats.frames.nulled / 3000)) * 300 - 300) * 2
+        return penalty
+
+    async def probe(self, node: wavelink.Node) -> NodeHealth:
+        """Fetch a node's stats, timing the request"""
+        health = self.health.setdefault(node.identifier, NodeHealth())
+        started = time.perf_counter()
+        try:
+            stats = await asyncio.wait_for(node.fetch_stats(), timeout=self.probe_timeout)
+        except Exception as e:
+            health.failures += 1
+            logging.warning(f"Health check for node {node.identifier} failed ({health.failures} in a row): {e!r}")
+            return health
+
+        latency = time.perf_counter() - started
+        health.latency = latency if not health.checked_at else health.latency * 0.7 + latency * 0.3
+        health.load = self.load_penalty(stats)
+        health.playing = stats.playing
+        health.players = stats.players
+        health.cpu = stats.cpu.system_load
+        health.deficit = stats.frames.deficit if stats.frames else 0
+        health.nulled = stats.frames.nulled if stats.frames else 0
+        health.failures = 0
+        health.checked_at = time.monotonic()
+        return health
+
+    def is_available(self, node: wavelink.Node) -> bool:
+        """Whether the node is connected and answering health checks"""
+        if node.status is not wavelink.NodeStatus.CONNECTED:
+            return False
+        health = self.health.get(node.identifier)
+        return health is None or health.failures < NODE_MAX_PROBE_FAILURES
+
+    def is_degraded(self, node: wavelink.Node) -> bool:
+        """Whether players should be moved off the node"""
+        if not self.is_available(node):
+            return True
+        health = self.health.get(node.identifier)
+        return health is not None and health.load >= NODE_DEGRADED_PENALTY
+
+    def score(self, node: wavelink.Node) -> float:
+        """Lower is better"""
+        health = self.health.get(node.identifier) or NodeHealth()
+        # Our own player count is always current, Lavalink's only as fresh as the last probe
+        playing = max(health.playing, len(node.players))
+        return health.load + playing + health.latency * 1000 / NODE_LATENCY_PENALTY_MS
+
+    def candidates(self, exclude: Optional[wavelink.Node] = None) -> List[wavelink.Node]:
+        """Usable nodes, best first, preferring ones that aren't degraded"""
+        nodes = [
+            node for node in wavelink.Pool.nodes.values()
+            if node.identifier != (exclude and exclude.identifier) and self.is_available(node)
+        ]
+        nodes.sort(key=lambda node: (self.is_degraded(node), self.score(node)))
+        return nodes
+
+    def best_node(self) -> wavelink.Node:
+        """The node new players and searches should use"""
+        nodes = self.candidates()
+        if nodes:
+            return nodes[0]
+        # Nothing passed its health checks, let wavelink pick any connected node (or raise)
+        return wavelink.Pool.get_node()
+
+    def players_on(self, node: wavelink.Node) -> List[wavelink.Player]:
+        # node.players is emptied when its websocket drops, so look at the players we hold instead
+        return [
+            vc for vc in self.client.voice_clients
+            if isinstance(vc, wavelink.Player) and vc.node.identifier == node.identifier
+        ]
+
+    async def migrate(self, player: wavelink.Player) -> bool:
+        """Move a player to the best other node, keeping its track, position, volume and filters"""
+        if not player.guild or player.guild.id in self._migrating:
+            return False
+
+        source = player.node
+        self._migrating.add(player.guild.id)
+        try:
+            async with self._migration_slots:
+                for target in self.candidates(exclude=source):
+                    if target.identifier == player.node.identifier:
+                        continue
+                    # The restarted track isn't a new song, so don't announce it again
+                    player.switching_track = player.current.encoded if player.current else None
+                    try:
+                        await player.switch_node(target)
+                    except Exception as e:
+                        logging.warning(f"Moving guild {player.guild.id} to node {target.identifier} failed: {e!r}")
+                        continue
+
+                    self.migrations += 1
+                    logging.info(f"Moved guild {player.guild.id} from node {source.identifier} to {target.identifier}")
+                    return True
+        finally:
+            self._migrating.discard(player.guild.id)
+
+        player.switching_track = None
+        self.failed_migrations += 1
+        logging.error(f"No healthy node available for guild {player.guild.id}")
+        return False
+
+    async def evacuate(self, node: wavelink.Node):
+        """Move every player off a node, as long as there's somewhere better to put them"""
+        players = self.players_on(node)
+        targets = [target for target in self.candidates(exclude=node) if not self.is_degraded(target)]
+        if not players or not targets:
+            return
+
+        logging.warning(f"Node {node.identifier} is unhealthy, moving {len(players)} players")
+        await asyncio.gather(*(self.migrate(player) for player in players))
+
+    async def check_nodes(self):
+        """Probe every node and evacuate the degraded ones"""
+        nodes = list(wavelink.Pool.nodes.values())
+        await asyncio.gather(*(self.probe(node) for node in nodes))
+        for node in nodes:
+            if self.is_degraded(node):
+                await self.evacuate(node)
+
+    async def _probe_loop(self):
+        while True:
+            try:
+                await self.check_nodes()
+            except Exception as e:
+                logging.error(f"Error checking Lavalink nodes: {e}")
+            await asyncio.sleep(self.probe_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._probe_loop())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class Histogram:
+    """Cumulative Prometheus histogram for one label set"""
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    """Counters, gauges and histograms rendered in the Prometheus text format"""
+    def __init__(self):
+        self._metrics: Dict[str, tuple] = {}  # name -> (type, help, buckets)
+        self._values: Dict[str, Dict[tuple, Union[float, Histogram]]] = {}
+        self._collectors: List[Callable[["MetricsRegistry"], None]] = []
+
+    def describe(self, name: str, kind: str, help_text: str, buckets: Optional[tuple] = None):
+        self._metrics[name] = (kind, help_text, buckets)
+        self._values.setdefault(name, {})
+
+    def add_collector(self, collector: Callable[["MetricsRegistry"], None]):
+        """Register a callback that refreshes gauges right before every scrape"""
+        self._collectors.append(collector)
+
+    @staticmethod
+    def _key(labels: dict) -> tuple:
+        return tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        values = self._values[name]
+        key = self._key(labels)
+        values[key] = values.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        self._values[name][self._key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        values = self._values[name]
+        key = self._key(labels)
+        histogram = values.get(key)
+        if histogram is None:
+            histogram = values[key] = Histogram(self._metrics[name][2])
+        histogram.observe(value)
+
+    def clear(self, name: str):
+        """Drop every label set of a gauge, for gauges rebuilt on each scrape"""
+        self._values[name].clear()
+
+    @staticmethod
+    def _labels(key: tuple, **extra) -> str:
+        pairs = list(key) + list(extra.items())
+        if not pairs:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector(self)
+            except Exception as e:
+                logging.error(f"Error collecting metrics: {e}")
+
+        lines = []
+        for name, (kind, help_text, _) in self._metrics.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in self._values[name].items():
+                if isinstance(value, Histogram):
+                    for bound, count in zip(value.buckets, value.counts):
+                        lines.append(f"{name}_bucket{self._labels(key, le=bound)} {count}")
+                    lines.append(f'{name}_bucket{self._labels(key, le="+Inf")} {value.count}')
+                    lines.append(f"{name}_sum{self._labels(key)} {value.total}")
+                    lines.append(f"{name}_count{self._labels(key)} {value.count}")
+                else:
+                    lines.append(f"{name}{self._labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def lavalink_endpoint(path: str) -> str:
+    """Group Lavalink REST paths into a few labels, so session and guild IDs don't explode cardinality"""
+    parts = path.strip("/").split("/")
+    if len(parts) >= 4 and parts[1] == "sessions" and parts[3] == "players":
+        return "player"
+    if len(parts) >= 2 and parts[1] == "sessions":
+        return "session"
+    return parts[-1] if parts and parts[-1] else "unknown"
+
+
+# Interaction being handled, the REST calls made for it must finish before it expires
+current_interaction: contextvars.ContextVar[Optional[discord.Interaction]] = contextvars.ContextVar(
+    "current_interaction", default=None
+)
+
+
+def request_deadline(timeout=LAVALINK_REQUEST_TIMEOUT) -> float:
+    """Event loop time a REST call has to finish by, the timeout or the current interaction's expiry"""
+    now = asyncio.get_running_loop().time()
+    deadline = now + timeout
+    interaction = current_interaction.get()
+    if interaction is not None:
+        window = INTERACTION_TOKEN_LIFETIME if interaction.response.is_done() else INTERACTION_ACK_WINDOW
+        age = max((discord.utils.utcnow() - interaction.created_at).total_seconds(), 0)
+        deadline = min(deadline, now + window - age)
+    return deadline
+
+
+class RetryBudget:
+    """Token bucket every node's retries draw from, each call earns a fraction of a retry"""
+    def __init__(self, ratio=LAVALINK_RETRY_RATIO, min_rate=LAVALINK_RETRY_MIN_RATE, capacity=LAVALINK_RETRY_BURST):
+        self.ratio = ratio
+        self.min_rate = min_rate
+        self.capacity = capacity
+        self.balance = float(capacity)
+        self.exhausted = 0  # Retries refused because the budget was empty
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.balance = min(self.capacity, self.balance + (now - self._updated) * self.min_rate)
+        self._updated = now
+
+    def deposit(self):
+        self._refill()
+        self.balance = min(self.capacity, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        self._refill()
+        if self.balance < 1:
+            self.exhausted += 1
+            return False
+        self.balance -= 1
+        return True
+
+
+class LavalinkTransport:
+    """aiohttp middleware for one node's REST calls: a concurrency cap, deadlines and budgeted retries"""
+    IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+    def __init__(self, node_identifier: str, metrics: MetricsRegistry, budget: RetryBudget,
+                 concurrency=LAVALINK_NODE_CONCURRENCY):
+        self.node_identifier = node_identifier
+        self.metrics = metrics
+        self.budget = budget
+        self._slots = asyncio.Semaphore(concurrency)
+
+    async def __call__(self, request: aiohttp.ClientRequest, handler) -> aiohttp.ClientResponse:
+        if request.url.path.endswith("/websocket"):
+            # The websocket stays open for the node's lifetime and reconnects by itself
+            return await handler(request)
+
+        loop = asyncio.get_running_loop()
+        endpoint = lavalink_endpoint(request.url.path)
+        deadline = request_deadline()
+        started = loop.time()
+        queued = 0.0
+        attempt = 0
+        self.budget.deposit()
+
+        while True:
+            response: Optional[aiohttp.ClientResponse] = None
+            error: Optional[Exception] = None
+            try:
+                async with asyncio.timeout_at(deadline):
+                    waiting = loop.time()
+                    async with self._slots:
+                        queued += loop.time() - waiting
+                        response = await handler(request)
+            except aiohttp.ClientConnectionError as e:
+                error = e
+            except TimeoutError:
+                self.metrics.inc("stellara_lavalink_deadline_exceeded_total", node=self.node_identifier, endpoint=endpoint)
+                self._record(request, endpoint, "deadline", started, queued, attempt)
+                raise aiohttp.ServerTimeoutError(
+                    f"Lavalink node {self.node_identifier} didn't answer {request.method} {endpoint} in time"
+                )
+
+            if response is not None and response.status not in LAVALINK_RETRY_STATUSES:
+                self._record(request, endpoint, str(response.status), started, queued, attempt)
+                return response
+
+            # Writes are only sent again when the first attempt never reached the node
+            safe = request.method in self.IDEMPOTENT_METHODS or isinstance(error, aiohttp.ClientConnectorError)
+            delay = random.uniform(0, LAVALINK_RETRY_BACKOFF * 2 ** attempt)
+            reason = str(response.status) if response is not None else type(error).__name__
+            if (not safe or attempt >= LAVALINK_MAX_RETRIES or loop.time() + delay >= deadline
+                    or not self.budget.withdraw()):
+                self._record(request, endpoint, reason, started, queued, attempt)
+                if error is not None:
+                    raise error
+                return response
+
+            attempt += 1
+            self.metrics.inc("stellara_lavalink_retries_total", node=self.node_identifier, endpoint=endpoint, reason=reason)
+            if response is not None:
+                response.release()
+            await asyncio.sleep(delay)
+
+    def _record(self, request: aiohttp.ClientRequest, endpoint: str, result: str, started: float, queued: float,
+                retries: int):
+        elapsed = asyncio.get_running_loop().time() - started
+        self.metrics.observe("stellara_lavalink_call_duration_seconds", elapsed, node=self.node_identifier, endpoint=endpoint)
+        self.metrics.observe("stellara_lavalink_queue_wait_seconds", queued, node=self.node_identifier)
+        logging.debug(
+            f"Lavalink {request.method} {endpoint} on {self.node_identifier}: {result} in {elapsed * 1000:.1f}ms "
+            f"({queued * 1000:.1f}ms queued, {retries} retries)"
+        )
+
+
+def lavalink_trace_config(metrics: MetricsRegistry, node_identifier: str) -> aiohttp.TraceConfig:
+    """aiohttp tracing that records every REST request a node makes"""
+    trace = aiohttp.TraceConfig()
+
+    async def on_request_start(session, context, params):
+        context.started = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        endpoint = lavalink_endpoint(params.url.path)
+        metrics.observe("stellara_lavalink_request_duration_seconds", time.perf_counter() - context.started,
+                        node=node_identifier, endpoint=endpoint)
+        metrics.inc("stellara_lavalink_requests_total", node=node_identifier, endpoint=endpoint,
+                    status=str(params.response.status))
+
+    async def on_request_exception(session, context, params):
+        metrics.inc("stellara_lavalink_requests_total", node=node_identifier,
+                    endpoint=lavalink_endpoint(params.url.path), status="error")
+
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    trace.on_request_exception.append(on_request_exception)
+    return trace
+
+
+class MetricsCommandTree(app_commands.CommandTree):
+    """Command tree that records how long every slash command takes"""
+    async def _call(self, interaction: discord.Interaction) -> None:
+        started = time.perf_counter()
+        failed = True
+        # Lets the loop monitor attribute slow callbacks to this command and guild
+        context = ((interaction.data or {}).get("name", "unknown"), interaction.guild_id)
+        current_command.set(context)
+        current_interaction.set(interaction)
+        task = asyncio.current_task()
+        running_commands[task] = context
+        try:
+            await super()._call(interaction)
+            failed = interaction.command_failed
+        finally:
+            running_commands.pop(task, None)
+            kind = "autocomplete" if interaction.type is discord.InteractionType.autocomplete else "command"
+            command = (interaction.data or {}).get("name", "unknown")
+            self.client.metrics.observe("stellara_command_duration_seconds", time.perf_counter() - started,
+                                        command=command, kind=kind, status="error" if failed else "ok")
+
+
+class MetricsServer:
+    """Serves the registry at /metrics from a small aiohttp app in the bot's event loop"""
+    def __init__(self, metrics: MetricsRegistry, host=METRICS_HOST, port=METRICS_PORT):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.metrics.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Prometheus-Format": "0.0.4"})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# Command and guild of the interaction being handled, inherited by the tasks it starts
+current_command: contextvars.ContextVar[Optional[tuple]] = contextvars.ContextVar("current_command", default=None)
+# The same for each task running a command, which the loop monitor's watchdog thread can read on any Python version
+running_commands: Dict[asyncio.Task, tuple] = {}
+
+
+class SlowCallback:
+    """A code location that blocked the event loop, for one command and guild"""
+    __slots__ = ("command", "guild_id", "location", "count", "total", "worst", "stack", "last_seen")
+
+    def __init__(self, command: Optional[str], guild_id: Optional[int], location: str):
+        self.command = command
+        self.guild_id = guild_id
+        self.location = location
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.stack: List[str] = []
+        self.last_seen = 0.0
+
+
+class LoopMonitor:
+    """Samples event loop lag and records the stacks of callbacks that block the loop for too long"""
+    def __init__(self, threshold=SLOW_CALLBACK_THRESHOLD, top_n=SLOW_CALLBACK_TOP_N, interval=LOOP_LAG_SAMPLE_INTERVAL,
+                 patch=LOOP_MONITOR_PATCH):
+        self.threshold = threshold
+        self.top_n = top_n
+        self.interval = interval
+        self.patch = patch
+        self.lag_samples: deque = deque(maxlen=LOOP_LAG_HISTORY)
+        self.max_lag = 0.0
+        self.slow_callbacks: Dict[str, int] = {}  # Slow callbacks per command, "none" outside commands
+        self.offenders: Dict[tuple, SlowCallback] = {}  # (command, guild ID, location) -> offender
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._original_run = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        # Set by the loop thread around every callback, read by the watchdog thread
+        self._running: Optional[tuple] = None  # (handle, started)
+        self._captured: Optional[tuple] = None  # (handle, stack) taken while the handle was still running
+        # Without the patch, the watchdog times how long the loop takes to run a probe callback
+        self._probe: Optional[list] = None  # [sent, stack, command context] of the unanswered probe
+
+    def _capture_stack(self) -> List[str]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return []
+        frames = traceback.extract_stack(frame)
+        # Drop asyncio's own dispatch frames above the blocking callback
+        for i, entry in enumerate(frames):
+            if entry.name == "_run" and entry.filename.endswith("events.py"):
+                frames = frames[i + 1:]
+                break
+        return [f"{entry.filename}:{entry.lineno} in {entry.name}" for entry in frames[-SLOW_CALLBACK_STACK_DEPTH:]]
+
+    def _watch(self):
+        # Poll often enough that a callback over the threshold is still running when we look
+        while not self._stopped.wait(self.threshold / 2):
+            if not self.patch:
+                self._check_probe()
+                continue
+            running = self._running
+            if running is None or (self._captured and self._captured[0] is running[0]):
+                continue
+            if time.perf_counter() - running[1] >= self.threshold:
+                self._captured = (running[0], self._capture_stack())
+
+    def _check_probe(self):
+        probe = self._probe
+        if probe is None:
+            probe = self._probe = [time.perf_counter(), None, None]
+            try:
+                self._loop.call_soon_threadsafe(self._answer_probe, probe)
+            except RuntimeError:
+                # The loop was closed
+                self._stopped.set()
+        elif probe[1] is None and time.perf_counter() - probe[0] >= self.threshold:
+            # Still unanswered, so whatever the loop thread is running now is what blocks it
+            probe[1] = self._capture_stack()
+            task = asyncio.current_task(self._loop)
+            probe[2] = running_commands.get(task)
+            get_context = getattr(task, "get_context", None)  # Python 3.12+, also covers tasks a command started
+            if probe[2] is None and get_context:
+                probe[2] = get_context().get(current_command)
+
+    def _answer_probe(self, probe: list):
+        duration = time.perf_counter() - probe[0]
+        self._probe = None
+        if duration >= self.threshold and probe[1]:
+            command, guild_id = probe[2] or (None, None)
+            self._add(command, guild_id, probe[1][-1], probe[1], duration)
+
+    @staticmethod
+    def _describe(handle: asyncio.Handle) -> str:
+        callback = handle._callback
+        task = getattr(callback, "__self__", None)
+        if isinstance(task, asyncio.Task):
+            coro = task.get_coro()
+            return getattr(coro, "__qualname__", repr(coro))
+        return getattr(callback, "__qualname__", repr(callback))
+
+    def record(self, handle: asyncio.Handle, duration: float):
+        """Attribute a slow callback to the command and guild it ran for"""
+        context = handle._context.get(current_command) if handle._context is not None else None
+        command, guild_id = context or (None, None)
+
+        stack = self._captured[1] if self._captured and self._captured[0] is handle else []
+        self._captured = None
+        self._add(command, guild_id, stack[-1] if stack else self._describe(handle), stack, duration)
+
+    def _add(self, command: Optional[str], guild_id: Optional[int], location: str, stack: List[str], duration: float):
+        key = (command, guild_id, location)
+        offender = self.offenders.get(key)
+        if offender is None:
+            offender = self.offenders[key] = SlowCallback(command, guild_id, location)
+        offender.count += 1
+        offender.total += duration
+        offender.last_seen = time.time()
+        if duration >= offender.worst:
+            offender.worst = duration
+            offender.stack = stack or [location]
+
+        label = command or "none"
+        self.slow_callbacks[label] = self.slow_callbacks.get(label, 0) + 1
+
+        if len(self.offenders) > self.top_n * 2:
+            self._prune()
+
+    def _prune(self):
+        cutoff = time.time() - SLOW_CALLBACK_WINDOW
+        recent = [offender for offender in self.offenders.values() if offender.last_seen >= cutoff]
+        keep = heapq.nlargest(self.top_n, recent, key=lambda offender: offender.worst)
+        self.offenders = {(o.command, o.guild_id, o.location): o for o in keep}
+
+    def top(self) -> List[SlowCallback]:
+        """The worst recent offenders, slowest first"""
+        self._prune()
+        return sorted(self.offenders.values(), key=lambda offender: offender.worst, reverse=True)
+
+    def lag_percentile(self, pct: float) -> float:
+        if not self.lag_samples:
+            return 0.0
+        samples = sorted(self.lag_samples)
+        return samples[min(len(samples) - 1, int(len(samples) * pct))]
+
+    async def _sample_lag(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.lag_samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def _install(self):
+        # Handle._run is private to CPython's asyncio, so this is opt-in and close() puts the original back
+        monitor = self
+        original = self._original_run = asyncio.Handle._run
+
+        def _run(handle):
+            if handle._loop is not monitor._loop:
+                return original(handle)
+            started = time.perf_counter()
+            monitor._running = (handle, started)
+            try:
+                return original(handle)
+            finally:
+                monitor._running = None
+                duration = time.perf_counter() - started
+                if duration >= monitor.threshold:
+                    monitor.record(handle, duration)
+
+        # TimerHandle inherits _run, so timers are covered as well
+        asyncio.Handle._run = _run
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        if self.patch:
+            self._install()
+        self._probe = None
+        self._stopped.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        self._task = asyncio.create_task(self._sample_lag())
+
+    def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        self._stopped.set()
+        if self._original_run is not None:
+            asyncio.Handle._run = self._original_run
+            self._original_run = None
+
+
+def ipc_encode(message: dict) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+class ClusterIPCServer:
+    """Launcher side of the IPC channel, fans requests from one cluster out to all of them"""
+    def __init__(self, host=IPC_HOST, port=0, timeout=IPC_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._clusters: Dict[int, asyncio.StreamWriter] = {}
+        self._calls: Dict[int, tuple] = {}  # call ID -> (replies, expected cluster IDs, event)
+        self._next_call = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        cluster_id = None
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                op = message.get("op")
+                if op == "hello":
+                    cluster_id = message["cluster"]
+                    self._clusters[cluster_id] = writer
+                elif op == "request":
+                    asyncio.create_task(self._serve_request(writer, message))
+                elif op == "reply":
+                    self._collect_reply(cluster_id, message)
+        except (ConnectionError, json.JSONDecodeError) as e:
+            logging.warning(f"IPC connection from cluster {cluster_id} failed: {e!r}")
+        finally:
+            if cluster_id is not None and self._clusters.get(cluster_id) is writer:
+                del self._clusters[cluster_id]
+            writer.close()
+
+    def _collect_reply(self, cluster_id: Optional[int], message: dict):
+        call = self._calls.get(message["id"])
+        if call is None:
+            return
+        replies, expected, done = call
+        replies[cluster_id] = message.get("data")
+        if expected <= replies.keys():
+            done.set()
+
+    async def _serve_request(self, requester: asyncio.StreamWriter, message: dict):
+        self._next_call += 1
+        call_id = self._next_call
+        replies: Dict[int, object] = {}
+        done = asyncio.Event()
+        clusters = dict(self._clusters)
+        self._calls[call_id] = (replies, set(clusters), done)
+
+        call = ipc_encode({"op": "call", "id": call_id, "action": message["action"], "data": message.get("data")})
+        for writer in clusters.values():
+            writer.write(call)
+        try:
+            await asyncio.wait_for(done.wait(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"IPC {message['action']} timed out, clusters {sorted(clusters.keys() - replies.keys())} didn't answer")
+        finally:
+            del self._calls[call_id]
+
+        requester.write(ipc_encode({
+            "op": "response",
+            "id": message["id"],
+            "data": [replies[cluster_id] for cluster_id in sorted(replies)],
+        }))
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            for writer in self._clusters.values():
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+class ClusterIPCClient:
+    """Worker side of the IPC channel, answers calls from the launcher and makes cross-cluster requests"""
+    def __init__(self, cluster_id: int, host=IPC_HOST, port=IPC_PORT, timeout=IPC_TIMEOUT):
+        self.cluster_id = cluster_id
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.handlers: Dict[str, Callable] = {}  # action -> async handler(data) returning JSON-able data
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._requests: Dict[int, asyncio.Future] = {}
+        self._next_request = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self._writer.write(ipc_encode({"op": "hello", "cluster": self.cluster_id}))
+        self._task = asyncio.create_task(self._read_loop(reader))
+
+    async def _read_loop(self, reader: asyncio.StreamReader):
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                if message["op"] == "call":
+                    asyncio.create_task(self._answer(message))
+                elif message["op"] == "response":
+                    future = self._requests.pop(message["id"], None)
+                    if future and not future.done():
+                        future.set_result(message["data"])
+        finally:
+            logging.warning("IPC connection to the launcher closed")
+            for future in self._requests.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("IPC connection closed"))
+            self._requests.clear()
+
+    async def _answer(self, message: dict):
+        handler = self.handlers.get(message["action"])
+        try:
+            data = await handler(message.get("data")) if handler else None
+        except Exception as e:
+            logging.error(f"Error answering IPC {message['action']}: {e}")
+            data = None
+        self._writer.write(ipc_encode({"op": "reply", "id": message["id"], "data": data}))
+
+    async def request(self, action: str, data=None) -> list:
+        """Run action on every cluster, including this one, and return their answers by cluster ID"""
+        if self._writer is None or self._writer.is_closing():
+            raise ConnectionError("Not connected to the launcher")
+        self._next_request += 1
+        future = self._requests[self._next_request] = asyncio.get_running_loop().create_future()
+        self._writer.write(ipc_encode({"op": "request", "id": self._next_request, "action": action, "data": data}))
+        # The launcher stops waiting for slow clusters after its own timeout
+        return await asyncio.wait_for(future, timeout=self.timeout * 2)
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+
+class ClusterLauncher:
+    """Spreads the bot's shards over worker processes and restarts workers that crash"""
+    def __init__(self, token: str, workers=SHARD_WORKERS, shard_count=SHARD_COUNT):
+        self.token = token
+        self.workers = workers
+        self.shard_count = shard_count
+        self.max_concurrency = 1
+        self.ipc = ClusterIPCServer()
+        self._processes: Dict[int, asyncio.subprocess.Process] = {}
+        self._stopping = asyncio.Event()
+
+    async def fetch_gateway_limits(self):
+        """Recommended shard count and identify concurrency from Discord"""
+        async with aiohttp.ClientSession() as session:
+            async with session.get(
+                "https://discord.com/api/v10/gateway/bot",
+                headers={"Authorization": f"Bot {self.token}"}
+            ) as response:
+                response.raise_for_status()
+                data = await response.json()
+        if not self.shard_count:
+            self.shard_count = data["shards"]
+        self.max_concurrency = data["session_start_limit"]["max_concurrency"]
+
+    def clusters(self) -> List[List[int]]:
+        """Contiguous blocks of shard IDs, one per worker"""
+        workers = max(1, min(self.workers, self.shard_count))
+        size = math.ceil(self.shard_count / workers)
+        return [list(range(start, min(start + size, self.shard_count))) for start in range(0, self.shard_count, size)]
+
+    async def _run_worker(self, cluster_id: int, shard_ids: List[int], start_delay: float):
+        env = dict(
+            os.environ,
+            SHARD_COUNT=str(self.shard_count),
+            SHARD_IDS=",".join(map(str, shard_ids)),
+            CLUSTER_ID=str(cluster_id),
+            IPC_PORT=str(self.ipc.port),
+        )
+        await asyncio.sleep(start_delay)
+        while not self._stopping.is_set():
+            logging.info(f"Starting cluster {cluster_id} with shards {shard_ids[0]}-{shard_ids[-1]}")
+            process = self._processes[cluster_id] = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), env=env
+            )
+            code = await process.wait()
+            if self._stopping.is_set():
+                break
+            logging.error(f"Cluster {cluster_id} exited with code {code}, restarting in {WORKER_RESTART_DELAY}s")
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+
+    def stop(self):
+        self._stopping.set()
+        for process in self._processes.values():
+            if process.returncode is None:
+                process.terminate()
+
+    async def run(self):
+        await self.fetch_gateway_limits()
+        await self.ipc.start()
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except NotImplementedError:
+                # Windows event loops have no signal handlers, take the signal in place of KeyboardInterrupt
+                signal.signal(sig, lambda signum, frame: loop.call_soon_threadsafe(self.stop))
+
+        # Workers identify their shards on their own, so stagger them to stay inside Discord's identify limit
+        clusters = self.clusters()
+        logging.info(f"Running {self.shard_count} shards in {len(clusters)} worker processes")
+        delay = 0.0
+        workers = []
+        for cluster_id, shard_ids in enumerate(clusters):
+            workers.append(self._run_worker(cluster_id, shard_ids, delay))
+            delay += IDENTIFY_WINDOW * math.ceil(len(shard_ids) / self.max_concurrency)
+
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            await self.ipc.close()
+
+
+class _TrackNode:
+    """Node of the implicit treap behind TrackList"""
+    __slots__ = ("track", "priority", "size", "total_length", "left", "right")
+
+    def __init__(self, track: wavelink.Playable):
+        self.track = track
+        self.priority = random.random()
+        self.size = 1
+        self.total_length = track.length  # Sum of track lengths in this subtree
+        self.left: Optional["_TrackNode"] = None
+        self.right: Optional["_TrackNode"] = None
+
+
+def _node_size(node: Optional[_TrackNode]) -> int:
+    return node.size if node else 0
+
+
+def _node_length(node: Optional[_TrackNode]) -> int:
+    return node.total_length if node else 0
+
+
+def _node_update(node: _TrackNode):
+    node.size = 1 + _node_size(node.left) + _node_size(node.right)
+    node.total_length = node.track.length + _node_length(node.left) + _node_length(node.right)
+
+
+def _treap_split(node: Optional[_TrackNode], count: int) -> tuple:
+    """Split a treap into (first count tracks, remaining tracks)"""
+    if node is None:
+        return None, None
+
+    if _node_size(node.left) >= count:
+        left, node.left = _treap_split(node.left, count)
+        _node_update(node)
+        return left, node
+
+    node.right, right = _treap_split(node.right, count - _node_size(node.left) - 1)
+    _node_update(node)
+    return node, right
+
+
+def _treap_merge(left: Optional[_TrackNode], right: Optional[_TrackNode]) -> Optional[_TrackNode]:
+    """Concatenate two treaps, every track in left comes before every track in right"""
+    if left is None:
+        return right
+    if right is None:
+        return left
+
+    if left.priority > right.priority:
+        left.right = _treap_merge(left.right, right)
+        _node_update(left)
+        return left
+
+    right.left = _treap_merge(left, right.left)
+    _node_update(right)
+    return right
+
+
+def _treap_build(tracks: List[wavelink.Playable]) -> Optional[_TrackNode]:
+    """Build a treap from a list of tracks in O(n)"""
+    stack: List[_TrackNode] = []
+    for track in tracks:
+        node = _TrackNode(track)
+        last = None
+        while stack and stack[-1].priority < node.priority:
+            last = stack.pop()
+            _node_update(last)
+        node.left = last
+        if stack:
+            stack[-1].right = node
+        stack.append(node)
+
+    # Nodes still on the stack form the right spine, fix their sizes bottom-up
+    for node in reversed(stack):
+        _node_update(node)
+
+    return stack[0] if stack else None
+
+
+def track_requester(track: wavelink.Playable) -> Optional[int]:
+    """The ID of the user who queued a track, stored in the track's extras"""
+    return getattr(track.extras, "requester_id", None)
+
+
+def track_key(track: wavelink.Playable) -> str:
+    """Identifies a song across searches, the same song loaded twice gets the same key"""
+    return f"{track.source}:{track.identifier}"
+
+
+def _read_utf(data: bytes, offset: int) -> Tuple[str, int]:
+    """Read a Java DataOutput.writeUTF string, returning it and the offset after it"""
+    size = int.from_bytes(data[offset:offset + 2], "big")
+    end = offset + 2 + size
+    if end > len(data):
+        raise ValueError("Encoded track ends inside a string")
+    raw = data[offset + 2:end]
+    try:
+        return raw.decode("utf-8"), end
+    except UnicodeDecodeError:
+        # Java's modified UTF-8 writes NUL as two bytes and characters outside the BMP as surrogate pairs
+        text = raw.replace(b"\xc0\x80", b"\x00").decode("utf-8", "surrogatepass")
+        return text.encode("utf-16-le", "surrogatepass").decode("utf-16-le"), end
+
+
+def _write_utf(text: str) -> bytes:
+    """Encode a string the way Java's DataOutput.writeUTF does"""
+    if text.isascii() and "\x00" not in text:
+        raw = text.encode()
+    else:
+        text = "".join(
+            char if ord(char) <= 0xFFFF else
+            chr(0xD800 + ((ord(char) - 0x10000) >> 10)) + chr(0xDC00 + ((ord(char) - 0x10000) & 0x3FF))
+            for char in text
+        )
+        raw = text.encode("utf-8", "surrogatepass").replace(b"\x00", b"\xc0\x80")
+    if len(raw) > 0xFFFF:
+        raise ValueError("String is too long for a track encoding")
+    return len(raw).to_bytes(2, "big") + raw
+
+
+def decode_track(encoded: str) -> dict:
+    """Build the Lavalink payload for an encoded track locally, without asking the node to decode it"""
+    data = base64.b64decode(encoded)
+    header, = struct.unpack_from(">I", data)
+    flags, size = header >> 30, header & 0x3FFFFFFF
+    if len(data) < 4 + size:
+        raise ValueError("Encoded track is truncated")
+
+    offset = 4
+    version = 1
+    if flags & TRACK_INFO_VERSIONED:
+        version = data[offset]
+        offset += 1
+    if version > TRACK_INFO_VERSION:
+        raise ValueError(f"Unknown track encoding version {version}")
+
+    title, offset = _read_utf(data, offset)
+    author, offset = _read_utf(data, offset)
+    length, = struct.unpack_from(">q", data, offset)
+    identifier, offset = _read_utf(data, offset + 8)
+    is_stream = data[offset] != 0
+    offset += 1
+
+    # Later versions added nullable fields, each written as a presence flag and the string
+    optional = {"uri": None, "artworkUrl": None, "isrc": None}
+    fields = ("uri", "artworkUrl", "isrc") if version >= 3 else ("uri",) if version == 2 else ()
+    for field in fields:
+        present = data[offset]
+        offset += 1
+        if present:
+            optional[field], offset = _read_utf(data, offset)
+
+    source, offset = _read_utf(data, offset)
+    # Sources may write their own fields after the name, the position always comes last
+    position, = struct.unpack_from(">q", data, 4 + size - 8)
+
+    info = {
+        "identifier": identifier,
+        "isSeekable": not is_stream,
+        "author": author,
+        "length": length,
+        "isStream": is_stream,
+        "position": position,
+        "title": title,
+        **optional,
+        "sourceName": source,
+    }
+    return {"encoded": encoded, "info": info, "pluginInfo": {}, "userData": {}}
+
+
+def decode_tracks(encoded: List[str]) -> List[Optional[dict]]:
+    """Decode a batch of tracks, None for any this decoder can't read"""
+    payloads = []
+    for track in encoded:
+        try:
+            payloads.append(decode_track(track))
+        except (ValueError, struct.error, IndexError) as e:
+            logging.debug(f"Couldn't decode track locally: {e}")
+            payloads.append(None)
+    return payloads
+
+
+def encode_track(info: dict, source_data: bytes = b"") -> str:
+    """Encode track info in Lavalink's format. source_data holds the fields some sources add after their name"""
+    body = bytearray([TRACK_INFO_VERSION])
+    body += _write_utf(info["title"])
+    body += _write_utf(info["author"])
+    body += struct.pack(">q", info["length"])
+    body += _write_utf(info["identifier"])
+    body += b"\x01" if info["isStream"] else b"\x00"
+    for field in ("uri", "artworkUrl", "isrc"):
+        value = info.get(field)
+        body += b"\x00" if value is None else b"\x01" + _write_utf(value)
+    body += _write_utf(info["sourceName"])
+    body += source_data
+    body += struct.pack(">q", info.get("position", 0))
+
+    header = struct.pack(">I", (TRACK_INFO_VERSIONED << 30) | len(body))
+    return base64.b64encode(header + bytes(body)).decode()
+
+
+class TrackList:
+    """List of tracks backed by an implicit treap, indexing, insertion and removal are O(log n)"""
+    def __init__(self, tracks=()):
+        self._root = None
+        self.version = 0  # Bumped on every change, used to invalidate rendered pages
+        self.requester_counts: Dict[Optional[int], int] = {}  # Queued tracks per requester
+        self.rebuild(tracks)
+
+    @property
+    def total_length(self) -> int:
+        """Total length of every track in milliseconds, maintained incrementally"""
+        return _node_length(self._root)
+
+    def _count_requesters(self, tracks, delta: int):
+        counts = self.requester_counts
+        for track in tracks:
+            requester = track_requester(track)
+            count = counts.get(requester, 0) + delta
+            if count > 0:
+                counts[requester] = count
+            else:
+                counts.pop(requester, None)
+        self.version += 1
+
+    def __len__(self) -> int:
+        return _node_size(self._root)
+
+    def __bool__(self) -> bool:
+        return self._root is not None
+
+    def __iter__(self):
+        return self.iter_range(0, len(self))
+
+    def __reversed__(self):
+        stack = []
+        node = self._root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.right
+            node = stack.pop()
+            yield node.track
+            node = node.left
+
+    def __contains__(self, item) -> bool:
+        return any(track == item for track in self)
+
+    def __repr__(self) -> str:
+        return f"TrackList(tracks={len(self)})"
+
+    def _index(self, index: int) -> int:
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("TrackList index out of range")
+        return index
+
+    def _node_at(self, index: int) -> _TrackNode:
+        node = self._root
+        while True:
+            left_size = _node_size(node.left)
+            if index < left_size:
+                node = node.left
+            elif index == left_size:
+                return node
+            else:
+                index -= left_size + 1
+                node = node.right
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return list(self.iter_range(start, stop))
+            return list(self)[index]
+        return self._node_at(self._index(index)).track
+
+    def __setitem__(self, index: int, track: wavelink.Playable):
+        index = self._index(index)
+        left, rest = _treap_split(self._root, index)
+        middle, right = _treap_split(rest, 1)
+        self._count_requesters([middle.track], -1)
+        self._count_requesters([track], 1)
+        middle.track = track
+        _node_update(middle)
+        self._root = _treap_merge(_treap_merge(left, middle), right)
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                self.delete_range(start, stop)
+            else:
+                tracks = list(self)
+                del tracks[index]
+                self.rebuild(tracks)
+        else:
+            self.pop(index)
+
+    def iter_range(self, start: int, stop: int):
+        """Yield the tracks in [start, stop) in O(log n + k)"""
+        count = stop - start
+        if count <= 0:
+            return
+
+        # Walk down to start, keeping every ancestor that comes after it
+        stack = []
+        node = self._root
+        index = start
+        while node:
+            left_size = _node_size(node.left)
+            if index < left_size:
+                stack.append(node)
+                node = node.left
+            elif index == left_size:
+                stack.append(node)
+                break
+            else:
+                index -= left_size + 1
+                node = node.right
+
+        while stack and count > 0:
+            node = stack.pop()
+            yield node.track
+            count -= 1
+            node = node.right
+            while node:
+                stack.append(node)
+                node = node.left
+
+    def append(self, track: wavelink.Playable):
+        self._root = _treap_merge(self._root, _TrackNode(track))
+        self._count_requesters([track], 1)
+
+    def extend(self, tracks):
+        tracks = list(tracks)
+        self._root = _treap_merge(self._root, _treap_build(tracks))
+        self._count_requesters(tracks, 1)
+
+    def insert(self, index: int, track: wavelink.Playable):
+        self.insert_many(index, [track])
+
+    def insert_many(self, index: int, tracks):
+        """Insert tracks before index, clamped like list.insert"""
+        size = len(self)
+        if index < 0:
+            index = max(0, index + size)
+        tracks = list(tracks)
+        left, right = _treap_split(self._root, min(index, size))
+        self._root = _treap_merge(_treap_merge(left, _treap_build(tracks)), right)
+        self._count_requesters(tracks, 1)
+
+    def pop(self, index: int = -1) -> wavelink.Playable:
+        index = self._index(index)
+        left, rest = _treap_split(self._root, index)
+        middle, right = _treap_split(rest, 1)
+        self._root = _treap_merge(left, right)
+        self._count_requesters([middle.track], -1)
+        return middle.track
+
+    def delete_range(self, start: int, stop: int) -> List[wavelink.Playable]:
+        """Remove and return the tracks in [start, stop)"""
+        if stop <= start:
+            return []
+        left, rest = _treap_split(self._root, start)
+        middle, right = _treap_split(rest, stop - start)
+        self._root = _treap_merge(left, right)
+        removed = TrackList()
+        removed._root = middle
+        tracks = list(removed)
+        self._count_requesters(tracks, -1)
+        return tracks
+
+    def move(self, source: int, destination: int) -> wavelink.Playable:
+        """Move the track at source so it ends up at destination"""
+        destination = self._index(destination)
+        track = self.pop(source)
+        self.insert(destination, track)
+        return track
+
+    def index(self, item) -> int:
+        for i, track in enumerate(self):
+            if track == item:
+                return i
+        raise ValueError(f"{item!r} is not in TrackList")
+
+    def remove(self, item):
+        self.pop(self.index(item))
+
+    def copy(self) -> "TrackList":
+        return TrackList(self)
+
+    def clear(self):
+        self._root = None
+        self.requester_counts = {}
+        self.version += 1
+
+    def rebuild(self, tracks):
+        """Replace the contents in O(n)"""
+        tracks = list(tracks)
+        self._root = _treap_build(tracks)
+        self.requester_counts = {}
+        self._count_requesters(tracks, 1)
+
+    def shuffle(self):
+        tracks = list(self)
+        random.shuffle(tracks)
+        self.rebuild(tracks)
+
+
+class LazyPlaylist:
+    """Lavalink playlist result that only builds Playable objects for the tracks that are taken"""
+    def __init__(self, data: dict):
+        info = data["info"]
+        plugin = data["pluginInfo"]
+        self.name: str = info["name"]
+        self.url: Optional[str] = plugin.get("url")
+        self.artwork: Optional[str] = plugin.get("artworkUrl")
+        self.author: Optional[str] = plugin.get("author")
+        self.extras: Optional[dict] = None  # Applied to every track as it's built
+
+        self._raw: List[dict] = data["tracks"]
+        self._info = wavelink.PlaylistInfo(data)
+        self._cursor = 0  # Index of the next raw track to build
+        self._taken_length = 0
+        self._total_length: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._raw)
+
+    def __repr__(self) -> str:
+        return f"LazyPlaylist(name={self.name}, tracks={len(self)}, remaining={self.remaining})"
+
+    @property
+    def remaining(self) -> int:
+        return len(self._raw) - self._cursor
+
+    @property
+    def total_length(self) -> int:
+        """Length of the whole playlist in milliseconds, read from the raw track info"""
+        if self._total_length is None:
+            self._total_length = sum(data["info"]["length"] for data in self._raw if not data["info"]["isStream"])
+        return self._total_length
+
+    @property
+    def remaining_length(self) -> int:
+        return self.total_length - self._taken_length
+
+    def take(self, count: int) -> List[wavelink.Playable]:
+        """Build the next count tracks"""
+        chunk = self._raw[self._cursor:self._cursor + count]
+        self._cursor += len(chunk)
+
+        tracks = [wavelink.Playable(data, playlist=self._info) for data in chunk]
+        for track in tracks:
+            if self.extras:
+                track.extras = self.extras
+            if not track.is_stream:
+                self._taken_length += track.length
+        return tracks
+
+
+class QueuedTracks:
+    """Built tracks waiting behind a pending playlist, so they keep their place without building it"""
+    def __init__(self, tracks: List[wavelink.Playable]):
+        self._tracks: deque = deque()
+        self._length = 0
+        self.extend(tracks)
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def __iter__(self):
+        return iter(self._tracks)
+
+    @property
+    def remaining(self) -> int:
+        return len(self._tracks)
+
+    @property
+    def remaining_length(self) -> int:
+        return self._length
+
+    def extend(self, tracks: List[wavelink.Playable]) -> None:
+        self._tracks.extend(tracks)
+        self._length += sum(track.length for track in tracks if not track.is_stream)
+
+    def take(self, count: int) -> List[wavelink.Playable]:
+        tracks = [self._tracks.popleft() for _ in range(min(count, len(self._tracks)))]
+        self._length -= sum(track.length for track in tracks if not track.is_stream)
+        return tracks
+
+
+class PlayedTracks(wavelink.Queue):
+    """Queue.history that only keeps the latest tracks, the full history is in the PlayHistoryStore"""
+    def __init__(self, limit: int = HISTORY_MEMORY_TRACKS):
+        super().__init__(history=False)
+        self.limit = limit
+
+    def put(self, item, /, *, atomic: bool = True) -> int:
+        added = super().put(item, atomic=atomic)
+        # Trimmed in bulk so the list isn't shifted on every play
+        if len(self._items) > self.limit * 2:
+            del self._items[:-self.limit]
+        return added
+
+
+class MusicQueue(wavelink.Queue):
+    """wavelink.Queue backed by a TrackList, with atomic bulk edits for the queue commands"""
+    def __init__(self, *, history: bool = True):
+        super().__init__(history=history)
+        if history:
+            self._history = PlayedTracks()
+        self._items = TrackList()
+        self._pending: deque = deque()  # LazyPlaylists and QueuedTracks behind the built tracks, in queue order
+        self.taken = 0  # Tracks taken from the front by get()
+        # Version changes that leave the order of the upcoming tracks as it was, from get() and materialize()
+        self._quiet_changes = 0
+        self._pending_changes = 0  # Changes to the pending segments only, which the version doesn't see
+
+    @property
+    def version(self) -> int:
+        return self._items.version
+
+    @property
+    def edits(self) -> int:
+        """Changes to the upcoming tracks other than taking them from the front, for snapshots"""
+        return self._items.version - self._quiet_changes + self._pending_changes
+
+    @property
+    def pending_count(self) -> int:
+        """Tracks waiting behind the built ones, for playlists and anything queued after them"""
+        return sum(segment.remaining for segment in self._pending)
+
+    @property
+    def pending_length(self) -> int:
+        return sum(segment.remaining_length for segment in self._pending)
+
+    @property
+    def count(self) -> int:
+        return len(self._items) + self.pending_count
+
+    @property
+    def is_empty(self) -> bool:
+        return not self._items and not self._pending
+
+    @property
+    def needs_refill(self) -> bool:
+        return bool(self._pending) and len(self._items) < PLAYLIST_REFILL_THRESHOLD
+
+    def put_lazy(self, playlist: LazyPlaylist, eager: int = PLAYLIST_EAGER_TRACKS) -> int:
+        """Queue a playlist, only building its first tracks now. Returns the playlist's track count"""
+        # A playlist queued behind another pending one has to wait its turn
+        self._pending_changes += 1
+        if not self._pending:
+            super().put(playlist.take(eager))
+        if playlist.remaining:
+            self._pending.append(playlist)
+        return len(playlist)
+
+    def materialize(self, limit: Optional[int] = None) -> int:
+        """Build and queue up to limit pending playlist tracks, or all of them. Returns how many were added"""
+        added = 0
+        version = self._items.version
+        while self._pending and (limit is None or added < limit):
+            segment = self._pending[0]
+            tracks = segment.take(segment.remaining if limit is None else limit - added)
+            super().put(tracks)
+            added += len(tracks)
+            if not segment.remaining:
+                self._pending.popleft()
+        self._quiet_changes += self._items.version - version
+        return added
+
+    def _top_up(self) -> None:
+        # Never look empty while playlist tracks are still pending
+        if not self._items and self._pending:
+            self.materialize(PLAYLIST_BATCH_SIZE)
+
+    def _reach(self, index: int) -> None:
+        # Build the pending tracks up to index, for edits addressed by queue position
+        if index >= len(self._items):
+            self.materialize(index + 1 - len(self._items))
+
+    def _defer(self, item, atomic: bool) -> int:
+        # Tracks queued after a playlist go after the whole playlist, which stays unbuilt
+        if isinstance(item, Iterable):
+            if atomic:
+                self._check_atomic(item)
+                tracks = list(item)
+            else:
+                tracks = [track for track in item if isinstance(track, wavelink.Playable)]
+        else:
+            self._check_compatibility(item)
+            tracks = [item]
+
+        self._pending_changes += 1
+        if isinstance(self._pending[-1], QueuedTracks):
+            self._pending[-1].extend(tracks)
+        elif tracks:
+            self._pending.append(QueuedTracks(tracks))
+        return len(tracks)
+
+    def put(self, item, /, *, atomic: bool = True) -> int:
+        if self._pending:
+            return self._defer(item, atomic)
+        return super().put(item, atomic=atomic)
+
+    async def put_wait(self, item, /, *, atomic: bool = True) -> int:
+        if self._pending:
+            return self._defer(item, atomic)
+        return await super().put_wait(item, atomic=atomic)
+
+    def get(self) -> wavelink.Playable:
+        self._top_up()
+        version = self._items.version
+        track = super().get()
+        self.taken += 1
+        self._quiet_changes += self._items.version - version
+        return track
+
+    def clear(self) -> None:
+        self._pending.clear()
+        super().clear()
+
+    @property
+    def total_length(self) -> int:
+        """Total length of the queued tracks in milliseconds"""
+        return self._items.total_length
+
+    @property
+    def requester_counts(self) -> Dict[Optional[int], int]:
+        return self._items.requester_counts
+
+    def remove_at(self, index: int) -> wavelink.Playable:
+        """Remove and return the track at index"""
+        self._reach(index)
+        track = self._items.pop(index)
+        self._top_up()
+        return track
+
+    def remove_range(self, start: int, stop: int) -> List[wavelink.Playable]:
+        """Remove and return the tracks in [start, stop)"""
+        self._reach(stop - 1)
+        removed = self._items.delete_range(start, stop)
+        self._top_up()
+        return removed
+
+    def move(self, source: int, destination: int) -> wavelink.Playable:
+        """Move the track at source to destination"""
+        self._reach(max(source, destination))
+        return self._items.move(source, destination)
+
+    def insert_at(self, index: int, tracks) -> int:
+        """Insert a track, a list of tracks or a playlist before index"""
+        if index >= self.count and self._pending:
+            return self._defer(tracks, True)
+        self._reach(index - 1)
+        tracks = [tracks] if isinstance(tracks, wavelink.Playable) else list(tracks)
+        self._check_atomic(tracks)
+        self._items.insert_many(index, tracks)
+        self._wakeup_next()
+        return len(tracks)
+
+    def dedupe(self) -> int:
+        """Remove repeated tracks, keeping the first occurrence. Returns how many were removed"""
+        self.materialize()
+        seen = set()
+        unique = []
+        for track in self._items:
+            if track.identifier not in seen:
+                seen.add(track.identifier)
+                unique.append(track)
+
+        removed = len(self._items) - len(unique)
+        if removed:
+            self._items.rebuild(unique)
+        return removed
+
+    def shuffle(self) -> None:
+        self.materialize()
+        self._items.shuffle()
+
+    def remove(self, item: wavelink.Playable, /, count: Optional[int] = 1) -> int:
+        # Single pass instead of wavelink's copy-and-remove per match
+        kept = []
+        deleted = 0
+        for track in self._items:
+            if track == item and (count is None or deleted < max(count, 1)):
+                deleted += 1
+            else:
+                kept.append(track)
+
+        if deleted:
+            self._items.rebuild(kept)
+            self._top_up()
+        return deleted
+
+    def copy(self) -> "MusicQueue":
+        self.materialize()
+        queue = MusicQueue(history=self.history is not None)
+        queue._items = self._items.copy()
+        return queue
+
+
+class FilterPreset:
+    """A named Lavalink filter payload"""
+    __slots__ = ("name", "label", "payload")
 
-    def _load(self) -> Dict[int, int]:
+    def __init__(self, name: str, label: str, payload: dict):
+        self.name = name
+        self.label = label
+        self.payload = payload
+
+
+class FilterPresetRegistry:
+    """Filter presets that stack, with each combination composed into a Lavalink payload once"""
+    def __init__(self):
+        self._presets: Dict[str, FilterPreset] = {}
+        self._composed: Dict[tuple, dict] = {}
+
+    def register(self, name: str, label: str, payload: dict):
+        self._presets[name] = FilterPreset(name, label, payload)
+        self._composed.clear()
+
+    def load_file(self, path: str):
+        """Add user-defined presets from a JSON file of {"name": {"label": ..., "filters": {...}}}"""
         try:
-            with open(self.file_path, "r") as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {}
+            with open(path, "r") as f:
+                presets = json.load(f)
+        except FileNotFoundError:
+            return
+        except json.JSONDecodeError as e:
+            logging.error(f"Ignoring filter presets in {path}: {e}")
+            return
+
+        for name, preset in presets.items():
+            self.register(name, preset.get("label", name), preset["filters"])
+        logging.info(f"Loaded {len(presets)} filter presets from {path}")
 
-    def save(self):
-        with open(self.file_path, "w") as f:
-            # Convert int keys to strings for JSON
-            serializable_volumes = {str(k): v for k, v in self.volumes.items()}
-            json.dump(serializable_volumes, f)
+    def get(self, name: str) -> Optional[FilterPreset]:
+        return self._presets.get(name)
 
-    def get_volume(self, guild_id: int) -> int:
-        return self.volumes.get(str(guild_id), 30)  # Default volume is 30%
+    def __iter__(self):
+        return iter(self._presets.values())
 
-    def set_volume(self, guild_id: int, volume: int):
-        self.volumes[str(guild_id)] = volume
-        self.save()
+    def compose(self, names: tuple) -> dict:
+        """Stack presets in order. Equalizer gains add up per band, volumes multiply and later presets win otherwise"""
+        payload = self._composed.get(names)
+        if payload is not None:
+            return payload
+
+        bands: Dict[int, float] = {}
+        payload = {}
+        for name in names:
+            for key, value in self._presets[name].payload.items():
+                if key == "equalizer":
+                    for band in value:
+                        bands[band["band"]] = bands.get(band["band"], 0.0) + band["gain"]
+                elif key == "volume":
+                    payload["volume"] = payload.get("volume", 1.0) * value
+                elif isinstance(value, dict):
+                    payload[key] = {**payload.get(key, {}), **value}
+                else:
+                    payload[key] = value
+
+        if bands:
+            # wavelink.Filters only reads back a full 15 band equalizer
+            low, high = EQ_GAIN_RANGE
+            payload["equalizer"] = [
+                {"band": band, "gain": max(low, min(high, bands.get(band, 0.0)))} for band in range(EQ_BANDS)
+            ]
+        self._composed[names] = payload
+        return payload
+
+
+filter_presets = FilterPresetRegistry()
+filter_presets.register("bassboost", "Bass Boost", {"equalizer": [
+    {"band": 0, "gain": 0.6},  # 60Hz
+    {"band": 1, "gain": 0.5},  # 150Hz
+    {"band": 2, "gain": 0.3},  # 400Hz
+    {"band": 3, "gain": 0.1},  # 1kHz
+]})
+filter_presets.register("nightcore", "Nightcore", {"timescale": {"speed": 1.15, "pitch": 1.2, "rate": 1.0}})
+filter_presets.register("8d", "8D Audio", {"rotation": {"rotationHz": 0.2}})  # Rotate 0.2 times per second
+filter_presets.load_file(FILTER_PRESETS_PATH)
 
 
 class MusicPlayer(wavelink.Player):
     """Extended Player class with additional functionality"""
     def __init__(self, *args, **kwargs):
+        # Start on the least loaded node instead of wavelink's player count pick
+        client = args[0] if args else kwargs.get("client")
+        balancer = getattr(client, "node_balancer", None)
+        if balancer and not kwargs.get("nodes"):
+            kwargs["nodes"] = [balancer.best_node()]
+
         super().__init__(*args, **kwargs)
+        self.autoplay = wavelink.AutoPlayMode.partial  # Move through the queue, /autoplay adds recommendations
+        self.queue = MusicQueue()  # Supports cheap edits on very large queues
+        self.auto_queue._history = PlayedTracks()
         self.home = None  # Channel where the player was invoked
         self.loop = False  # Loop the current track
         self.loop_queue = False  # Loop the entire queue
         self.last_interaction = datetime.now()  # Track when the player was last used
-        self.dj_role_required = True  # Whether DJ role is required for certain commands
-        self.dj_members = set()  # Set of user IDs with DJ permissions
+        self.settings = GuildSettings(0)  # Replaced with the guild's stored settings on connect
         self.current_track = None  # Currently playing track
+        self.switching_track = None  # Encoded track being restarted on another node
+        self.active_presets: tuple = ()  # Stacked filter presets, in the order they were applied
+        self._pending_update: dict = {}  # Changes waiting for the next coalesced Lavalink update
+        self._update_future: Optional[asyncio.Future] = None
+        self._update_task: Optional[asyncio.Task] = None
+        self._resync = False  # Send every update in full, the node doesn't have the recorded state
+        self._page_cache: Dict[int, str] = {}  # Rendered /queue pages for the current queue version
+        self._page_cache_version = -1
+        self._refill_task: Optional[asyncio.Task] = None
         self.progress_message = None  # Message showing track progress
 
+    @property
+    def dj_role_required(self) -> bool:
+        """Whether DJ role is required for certain commands"""
+        return self.settings.dj_mode
+
+    @property
+    def dj_members(self) -> set:
+        """Set of user IDs with DJ permissions"""
+        return self.settings.dj_members
+
     async def update_last_interaction(self):
         """Update the timestamp of the last interaction with the player"""
         self.last_interaction = datetime.now()
+        if self.guild:
+            self.client.idle_scheduler.arm(self)
+
+    async def refill_queue(self):
+        """Build pending playlist tracks in batches until the queue is comfortably ahead of playback"""
+        while self.queue.needs_refill:
+            self.queue.materialize(PLAYLIST_BATCH_SIZE)
+            await asyncio.sleep(0)
+
+    def schedule_refill(self):
+        if self.queue.needs_refill and (self._refill_task is None or self._refill_task.done()):
+            self._refill_task = asyncio.create_task(self.refill_queue())
+
+    async def _auto_play_event(self, payload: wavelink.TrackEndEventPayload) -> None:
+        # A looped track is restarted by on_wavelink_track_end instead of moving on
+        if self.loop and payload.reason == "finished":
+            return
+        await super()._auto_play_event(payload)
+
+    async def _do_recommendation(self, *, populate_track: Optional[wavelink.Playable] = None,
+                                 max_population: Optional[int] = None) -> None:
+        """Play on from the local recommendation index, instead of wavelink's Lavalink searches"""
+        if len(self.auto_queue) < AUTOPLAY_REFILL_THRESHOLD:
+            await self.fill_auto_queue()
+        if populate_track is not None or self._current is not None or self.auto_queue.is_empty:
+            return
+
+        track = self.auto_queue.get()
+        self.auto_queue.history.put(track)
+        await self.play(track, add_history=False)
+
+    async def fill_auto_queue(self) -> int:
+        """Add tracks that other guilds played after this player's recent tracks to the auto queue"""
+        # Tracks people queued weigh more than earlier autoplay picks
+        played = self.queue.history[-RECOMMEND_SEED_TRACKS:][::-1]
+        played += self.auto_queue.history[-RECOMMEND_SEED_TRACKS:][::-1]
+        if self.current:
+            played.insert(0, self.current)
+        exclude = [
+            *self.queue.history[-AUTOPLAY_EXCLUDE_RECENT:], *self.auto_queue.history[-AUTOPLAY_EXCLUDE_RECENT:],
+            *self.queue, *self.auto_queue,
+        ]
+
+        tracks = await self.client.recommendations.recommend(played, exclude)
+        for track in tracks:
+            track.extras = {"autoplay": True}
+        self.auto_queue.put(tracks)
+        self.client.metrics.inc("stellara_autoplay_recommendations_total", len(tracks))
+        return len(tracks)
+
+    async def update(self, *, volume: Optional[int] = None, filters: Optional[wavelink.Filters] = None,
+                     paused: Optional[bool] = None, position: Optional[int] = None):
+        """Change the player, sending this and any other change made within PLAYER_UPDATE_WINDOW as one request"""
+        pending = self._pending_update
+        if volume is not None:
+            pending["volume"] = max(0, min(volume, 1000))
+        if filters is not None:
+            pending["filters"] = filters
+        if paused is not None:
+            pending["paused"] = paused
+        if position is not None:
+            pending["position"] = position
+        self.client.metrics.inc("stellara_player_update_changes_total")
+
+        if self._update_future is None:
+            self._update_future = asyncio.get_running_loop().create_future()
+            self._update_task = asyncio.create_task(self._send_update())
+        await asyncio.shield(self._update_future)
+
+    async def _send_update(self):
+        await asyncio.sleep(PLAYER_UPDATE_WINDOW)
+        pending, self._pending_update = self._pending_update, {}
+        future, self._update_future = self._update_future, None
+
+        # Only send what differs from the state Lavalink already has
+        force = self._resync
+        request = {}
+        if "volume" in pending and (force or pending["volume"] != self._volume):
+            request["volume"] = pending["volume"]
+        if "filters" in pending and (force or pending["filters"]() != self._filters()):
+            request["filters"] = pending["filters"]()
+        if "paused" in pending and (force or pending["paused"] != self._paused):
+            request["paused"] = pending["paused"]
+        if "position" in pending and self._current:
+            request["position"] = pending["position"]
+
+        try:
+            if request and self.guild:
+                await self.node._update_player(self.guild.id, data=request)
+                self.client.metrics.inc("stellara_player_updates_total")
+        except Exception as e:
+            future.set_exception(e)
+            return
+
+        if "volume" in request:
+            self._volume = request["volume"]
+        if "filters" in request:
+            self._filters = pending["filters"]
+        if "paused" in request:
+            self._paused = request["paused"]
+        future.set_result(None)
+
+    async def switch_node(self, new_node: wavelink.Node, /) -> None:
+        # wavelink reapplies filters, volume and pause to the new node's blank player, which
+        # matches the recorded state and would otherwise be skipped as unchanged
+        self._resync = True
+        try:
+            await super().switch_node(new_node)
+        finally:
+            self._resync = False
+
+    async def set_volume(self, value: int = 100, /) -> None:
+        await self.update(volume=value)
+
+    async def set_filters(self, filters: Optional[wavelink.Filters] = None, /, *, seek: bool = False) -> None:
+        await self.update(filters=filters or wavelink.Filters(), position=self.position if seek and self.playing else None)
+
+    async def pause(self, value: bool, /) -> None:
+        await self.update(paused=value)
+
+    async def seek(self, position: int = 0, /) -> None:
+        if self._current:
+            await self.update(position=position)
+
+    async def apply_presets(self, names: tuple):
+        """Replace the stacked filter presets"""
+        await self.set_filters(wavelink.Filters(data=filter_presets.compose(names)))
+        self.active_presets = names
+
+    async def apply_saved_filters(self):
+        """Apply the guild's default filter presets, skipping any that no longer exist"""
+        names = tuple(name for name in self.settings.presets if filter_presets.get(name))
+        if names:
+            await self.apply_presets(names)
+        elif self.settings.filters:
+            await self.set_filters(wavelink.Filters(data=self.settings.filters))
+
+    async def disconnect(self, **kwargs) -> None:
+        if self._refill_task:
+            self._refill_task.cancel()
+        if self._update_task:
+            self._update_task.cancel()
+            if self._update_future and not self._update_future.done():
+                self._update_future.set_result(None)
+            self._update_future = None
+        if self.guild:
+            self.client.idle_scheduler.cancel(self.guild.id)
+            # On shutdown the Lavalink player is left running for the next process to reattach to
+            if self.client.shutting_down:
+                self.cleanup()
+                return
+            self.client.player_snapshots.discard(self.guild.id)
+        await super().disconnect(**kwargs)
+
+    def snapshot_signature(self) -> tuple:
+        """Changes whenever the snapshot would, without building it"""
+        current = self.current.encoded if self.current else None
+        # Steady playback keeps the same start time, a seek or pause moves it
+        anchor = self.position if self.paused else round(time.time() - self.position / 1000)
+        return (
+            current, anchor, self.paused, self.volume, self.queue.taken, self.queue.edits,
+            self.loop, self.loop_queue, self.autoplay, self.active_presets, json.dumps(self.filters(), sort_keys=True),
+            self.channel.id if self.channel else None, self.home.id if self.home else None, self.node.identifier,
+        )
+
+    @staticmethod
+    def track_state(data: dict, user_data: dict) -> dict:
+        # The encoded track is enough, its info is decoded again locally on restore
+        state = {"encoded": data["encoded"], "userData": user_data}
+        if data.get("pluginInfo"):
+            state["pluginInfo"] = data["pluginInfo"]
+        return state
+
+    async def restore_tracks(self, states: List[dict]) -> List[dict]:
+        """Full Lavalink payloads for snapshot tracks, the node only decodes what the local decoder can't"""
+        payloads: List[Optional[dict]] = [state if "info" in state else None for state in states]
+        missing = [i for i, data in enumerate(payloads) if data is None]
+        decoded = dict(zip(missing, decode_tracks([states[i]["encoded"] for i in missing])))
+
+        failed = [i for i in missing if decoded[i] is None]
+        if failed:
+            try:
+                remote = await self.node.send("POST", path="v4/decodetracks", data=[states[i]["encoded"] for i in failed])
+                decoded.update(zip(failed, remote))
+            except (wavelink.LavalinkException, wavelink.NodeException) as e:
+                logging.warning(f"Couldn't decode {len(failed)} restored tracks for guild {self.guild.id}: {e!r}")
+
+        for i in missing:
+            if decoded[i] is not None:
+                payloads[i] = {**decoded[i], "pluginInfo": states[i].get("pluginInfo", {}), "userData": states[i]["userData"]}
+        return [data for data in payloads if data is not None]
+
+    def snapshot_queue(self) -> List[dict]:
+        """The upcoming tracks, built and pending, in queue order"""
+        tracks = [self.track_state(track.raw_data, dict(track.extras)) for track in self.queue]
+        for segment in self.queue._pending:
+            if isinstance(segment, QueuedTracks):
+                tracks.extend(self.track_state(track.raw_data, dict(track.extras)) for track in segment)
+            else:
+                extras = segment.extras or {}
+                tracks.extend(self.track_state(data, extras) for data in segment._raw[segment._cursor:])
+        return tracks
+
+    def snapshot_state(self) -> dict:
+        """Everything but the queue, which is only snapshotted again after it was edited"""
+        return {
+            "node": self.node.identifier,
+            "channel_id": self.channel.id if self.channel else None,
+            "home_id": self.home.id if self.home else None,
+            "current": self.track_state(self.current.raw_data, dict(self.current.extras)) if self.current else None,
+            "position": self.position,
+            "paused": self.paused,
+            "volume": self.volume,
+            "filters": self.filters(),
+            "loop": self.loop,
+            "loop_queue": self.loop_queue,
+            "autoplay": self.autoplay is wavelink.AutoPlayMode.enabled,
+            "presets": list(self.active_presets),
+        }
+
+    async def restore_snapshot(self, state: dict, elapsed: float, resumed: bool):
+        """Bring back a snapshot after reconnecting, reattaching to the Lavalink player if it kept running"""
+        self.settings = await self.client.settings.get(self.guild.id)
+        self.home = self.guild.get_channel(state["home_id"]) if state["home_id"] else None
+        self.loop = state["loop"]
+        self.loop_queue = state["loop_queue"]
+        if state.get("autoplay"):
+            self.autoplay = wavelink.AutoPlayMode.enabled
+        self.active_presets = tuple(name for name in state.get("presets", ()) if filter_presets.get(name))
+        queued = await self.restore_tracks(state["tracks"])
+        if queued:
+            self.queue.put_lazy(LazyPlaylist({
+                "info": {"name": "Restored queue", "selectedTrack": -1},
+                "pluginInfo": {},
+                "tracks": queued,
+            }))
+
+        current = await self.restore_tracks([state["current"]]) if state["current"] else []
+        if not current:
+            await self.set_volume(state["volume"])
+            return
 
-    def is_inactive(self) -> bool:
-        """Check if the player has been inactive for too long"""
-        return (datetime.now() - self.last_interaction).total_seconds() > INACTIVITY_TIMEOUT
+        track = wavelink.Playable(current[0])
+        info = None
+        if resumed:
+            try:
+                info = await self.node.fetch_player_info(self.guild.id)
+            except (wavelink.LavalinkException, wavelink.NodeException) as e:
+                logging.warning(f"Couldn't fetch the Lavalink player for guild {self.guild.id}: {e!r}")
+
+        if info and info.track and info.track.encoded == track.encoded:
+            # Lavalink is still playing the track, so take over its state without replacing the track.
+            # The position only applies to a track that starts, the running one carries on where it is
+            await self.play(
+                track,
+                replace=False,
+                start=info.state.position,
+                volume=info.volume,
+                paused=info.paused,
+                filters=info.filters,
+                add_history=False,
+            )
+            self.current_track = track
+            return
 
-    def format_duration(self, milliseconds: int) -> str:
+        position = state["position"] + (0 if state["paused"] else int(elapsed * 1000))
+        if not track.is_stream and position >= track.length:
+            position = 0
+            track = self.queue.get() if not self.queue.is_empty else None
+            if track is None:
+                await self.set_volume(state["volume"])
+                return
+
+        # Restarting the track isn't a new song, so don't announce it again
+        self.switching_track = track.encoded
+        await self.play(
+            track,
+            start=position,
+            volume=state["volume"],
+            paused=state["paused"],
+            filters=wavelink.Filters(data=state["filters"]),
+        )
+
+    @staticmethod
+    def format_duration(milliseconds: int) -> str:
         """Format milliseconds into mm:ss format"""
         seconds = milliseconds // 1000
         minutes, seconds = divmod(seconds, 60)
         return f"{minutes}:{seconds:02d}"
 
+    @property
+    def queue_pages(self) -> int:
+        return max(1, -(-self.queue.count // QUEUE_PAGE_SIZE))
+
+    def queue_page_text(self, page: int) -> str:
+        """Render one page of the queue, cached until the queue changes"""
+        # Pending playlist tracks are only built up to the end of the page
+        start = page * QUEUE_PAGE_SIZE
+        self.queue._reach(start + QUEUE_PAGE_SIZE - 1)
+        if self._page_cache_version != self.queue.version:
+            self._page_cache.clear()
+            self._page_cache_version = self.queue.version
+
+        text = self._page_cache.get(page)
+        if text is None:
+            lines = []
+            for i, track in enumerate(self.queue._items.iter_range(start, start + QUEUE_PAGE_SIZE), start + 1):
+                duration = self.format_duration(track.length)
+                lines.append(f"`{i}.` **{track.title}** - `{track.author}` • `{duration}`")
+            text = "\n".join(lines)
+            self._page_cache[page] = text
+
+        return text
+
     def create_progress_bar(self, current_ms: int, total_ms: int, length: int = 15) -> str:
         """Create a text-based progress bar"""
         if total_ms <= 0:
@@ -91,38 +4042,494 @@ class MusicPlayer(wavelink.Player):
         return bar
 
 
-class Bot(commands.Bot):
+class Bot(commands.AutoShardedBot):
     def __init__(self) -> None:
         intents: discord.Intents = discord.Intents.default()
         intents.message_content = True
-        intents.members = True  # Need member intent for role checks
+        # DJ checks use the role IDs sent with each interaction, so no member intent or member cache
+        intents.members = False
+
+        # Launcher workers run a fixed block of shards, otherwise this process runs all of them
+        shards = {}
+        if SHARD_IDS:
+            shards = {"shard_ids": [int(shard_id) for shard_id in SHARD_IDS.split(",")], "shard_count": SHARD_COUNT}
+        elif SHARD_COUNT:
+            shards = {"shard_count": SHARD_COUNT}
 
         discord.utils.setup_logging(level=logging.INFO)
-        super().__init__(command_prefix="!", intents=intents)
+        super().__init__(
+            command_prefix="!",
+            intents=intents,
+            tree_cls=MetricsCommandTree,
+            member_cache_flags=discord.MemberCacheFlags.none(),
+            chunk_guilds_at_startup=False,
+            **shards
+        )
+
+        # Prometheus metrics, served when METRICS_PORT is set. Each worker process gets its own port
+        self.metrics = MetricsRegistry()
+        self.describe_metrics()
+        self.metrics_server = MetricsServer(self.metrics, port=METRICS_PORT + CLUSTER_ID) if METRICS_PORT else None
+
+        # Channel to the launcher and the other worker processes, when started by the launcher
+        self.ipc = ClusterIPCClient(CLUSTER_ID) if IPC_PORT else None
         
-        # Initialize volume manager
-        self.volume_manager = VolumeManager()
+        # Per-guild volume, DJ and filter settings
+        self.settings = GuildSettingsStore()
+
+        # Persistent cache of resolved tracks, shared by every guild
+        self.track_cache = TrackCache()
+
+        # Disconnects players once they've been idle for INACTIVITY_TIMEOUT
+        self.idle_scheduler = IdleScheduler(on_expire=self.disconnect_inactive_player)
+
+        # Identical searches running at the same time share one Lavalink request
+        self.search_coalescer = SearchCoalescer()
+
+        # Picks the search source for free-text queries, with a backup source when it's slow
+        self.search_hedger = SearchHedger()
         
-        # Dictionary to track search results for users
-        self.search_results = {}
+        # Pending search results for /select, per guild and user
+        self.search_sessions = SearchSessionStore()
 
-    async def setup_hook(self) -> None:
-        # Use your provided Lavalink server credentials
-        nodes = [
-            wavelink.Node(
-                uri=LAVALINK_URI,
-                password=LAVALINK_PASSWORD
+        # Titles and authors /play autocomplete answers from
+        self.suggestions = TrackSuggestionIndex()
+        self._suggestion_seed_task: Optional[asyncio.Task] = None
+
+        # Retries of Lavalink REST calls, shared by every node
+        self.retry_budget = RetryBudget()
+
+        # Picks Lavalink nodes by load and moves players off failing ones
+        self.node_balancer = NodeBalancer(self)
+
+        # Event loop lag and slow callback profiling, shown by /debug
+        self.loop_monitor = LoopMonitor()
+
+        # Every guild's plays, for /history and /top
+        self.play_history = PlayHistoryStore()
+
+        # Matches Spotify playlists and albums to playable tracks, only with Spotify API credentials
+        self.spotify: Optional[SpotifyResolver] = None
+        if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET:
+            self.spotify = SpotifyResolver(SpotifyClient(SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET))
+
+        # Tracks played one after another across guilds, for autoplay
+        self.recommendations = RecommendationIndex()
+
+        # DJ role IDs per guild, rebuilt when the guild's roles change
+        self.dj_roles = DJRoleIndex()
+
+        # Set once the first Lavalink node is ready, commands are accepted before that
+        self.nodes_ready = asyncio.Event()
+        self._node_connect_task: Optional[asyncio.Task] = None
+
+        # Player state kept across restarts
+        self.player_snapshots = PlayerSnapshotStore()
+        self.resumed_nodes = set()  # Identifiers of nodes whose previous Lavalink session was resumed
+        self.shutting_down = False
+        self._restore_task: Optional[asyncio.Task] = None
+
+    def lavalink_nodes(self) -> List[wavelink.Node]:
+        """Nodes from LAVALINK_NODES, or the single LAVALINK_URI node"""
+        configs = json.loads(LAVALINK_NODES) if LAVALINK_NODES else [{"identifier": "default", "uri": LAVALINK_URI}]
+
+        nodes = []
+        for i, config in enumerate(configs, 1):
+            identifier = config.get("identifier") or f"node-{i}"
+            # Each node gets its own session so REST metrics can be labelled by node, and its own connection pool.
+            # The pool has one connection more than the request cap, for the websocket
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=LAVALINK_NODE_CONCURRENCY + 1, keepalive_timeout=LAVALINK_KEEPALIVE),
+                trace_configs=[lavalink_trace_config(self.metrics, identifier)],
+                middlewares=(LavalinkTransport(identifier, self.metrics, self.retry_budget),),
             )
-        ]
+            nodes.append(wavelink.Node(
+                identifier=identifier,
+                uri=config["uri"],
+                password=config.get("password", LAVALINK_PASSWORD),
+                session=session,
+                resume_timeout=SESSION_RESUME_TIMEOUT
+            ))
+        return nodes
+
+    def describe_metrics(self):
+        metrics = self.metrics
+        metrics.describe("stellara_command_duration_seconds", "histogram",
+                         "Time spent handling slash commands and autocompletes", COMMAND_LATENCY_BUCKETS)
+        metrics.describe("stellara_lavalink_request_duration_seconds", "histogram",
+                         "Lavalink REST request latency", LAVALINK_LATENCY_BUCKETS)
+        metrics.describe("stellara_lavalink_call_duration_seconds", "histogram",
+                         "Lavalink REST calls from the first attempt to the final answer, with queueing and retries",
+                         LAVALINK_LATENCY_BUCKETS)
+        metrics.describe("stellara_lavalink_queue_wait_seconds", "histogram",
+                         "Time Lavalink REST calls waited for one of the node's request slots", LAVALINK_LATENCY_BUCKETS)
+        metrics.describe("stellara_lavalink_retries_total", "counter", "Lavalink REST attempts sent again, by reason")
+        metrics.describe("stellara_lavalink_retry_budget_exhausted_total", "counter",
+                         "Lavalink REST retries skipped because the shared retry budget was empty")
+        metrics.describe("stellara_lavalink_deadline_exceeded_total", "counter",
+                         "Lavalink REST calls abandoned because their deadline passed")
+        metrics.describe("stellara_lavalink_requests_total", "counter",
+                         "Lavalink REST requests by response status, or error when no response arrived")
+        metrics.describe("stellara_track_cache_hits_total", "counter", "Searches answered from the track cache")
+        metrics.describe("stellara_track_cache_misses_total", "counter", "Searches that went to Lavalink")
+        metrics.describe("stellara_track_cache_hit_ratio", "gauge", "Track cache hits over all cache lookups")
+        metrics.describe("stellara_search_collapsed_total", "counter",
+                         "Searches that joined an identical in-flight Lavalink request")
+        metrics.describe("stellara_search_sessions", "gauge", "Pending /play search result sessions")
+        metrics.describe("stellara_search_hedged_total", "counter", "Free-text searches also sent to a backup source")
+        metrics.describe("stellara_search_backup_wins_total", "counter", "Hedged searches the backup source answered first")
+        metrics.describe("stellara_search_source_latency_seconds", "gauge",
+                         "Recent Lavalink search latency percentiles per search source")
+        metrics.describe("stellara_search_source_error_ratio", "gauge", "Share of recent searches per source that failed")
+        metrics.describe("stellara_autocomplete_suggestions", "gauge", "Tracks in the /play autocomplete index")
+        metrics.describe("stellara_players", "gauge", "Connected players per node")
+        metrics.describe("stellara_players_playing", "gauge", "Players with a track playing per node")
+        metrics.describe("stellara_queue_length", "gauge",
+                         "Players whose queue holds at most le tracks, including unloaded playlist tracks")
+        metrics.describe("stellara_node_up", "gauge", "Whether the node is connected and passing health checks")
+        metrics.describe("stellara_node_players", "gauge", "Players on the node as reported by Lavalink")
+        metrics.describe("stellara_node_playing_players", "gauge", "Playing players as reported by Lavalink")
+        metrics.describe("stellara_node_cpu_load", "gauge", "Lavalink system CPU load, 0-1")
+        metrics.describe("stellara_node_frame_deficit", "gauge", "Audio frames missing over the last minute")
+        metrics.describe("stellara_node_frames_nulled", "gauge", "Audio frames nulled over the last minute")
+        metrics.describe("stellara_node_penalty", "gauge", "Load penalty the balancer gives the node")
+        metrics.describe("stellara_node_stats_latency_seconds", "gauge", "Smoothed latency of the node's stats endpoint")
+        metrics.describe("stellara_node_migrations_total", "counter", "Players moved to another node")
+        metrics.describe("stellara_node_failed_migrations_total", "counter", "Players no node could take")
+        metrics.describe("stellara_player_update_changes_total", "counter",
+                         "Volume, filter, pause and seek changes requested on players")
+        metrics.describe("stellara_player_updates_total", "counter",
+                         "Lavalink player updates sent for those changes after coalescing")
+        metrics.describe("stellara_recommendation_tracks", "gauge", "Tracks in the autoplay recommendation index")
+        metrics.describe("stellara_spotify_tracks_total", "counter",
+                         "Spotify tracks resolved, by whether the match was cached, searched for or missing")
+        metrics.describe("stellara_autoplay_recommendations_total", "counter",
+                         "Tracks added to auto queues from the recommendation index")
+        metrics.describe("stellara_event_loop_lag_seconds", "gauge",
+                         "Event loop lag over the recent samples, by quantile")
+        metrics.describe("stellara_event_loop_lag_max_seconds", "gauge", "Worst event loop lag since startup")
+        metrics.describe("stellara_slow_callbacks_total", "counter",
+                         "Callbacks that blocked the event loop longer than the threshold, by command")
+        metrics.add_collector(self.collect_metrics)
+
+    def collect_metrics(self, metrics: MetricsRegistry):
+        """Refresh the gauges that are read from live state on every scrape"""
+        cache = self.track_cache
+        lookups = cache.hits + cache.misses
+        metrics.set("stellara_track_cache_hits_total", cache.hits)
+        metrics.set("stellara_track_cache_misses_total", cache.misses)
+        metrics.set("stellara_track_cache_hit_ratio", cache.hits / lookups if lookups else 0)
+        metrics.set("stellara_search_collapsed_total", self.search_coalescer.collapsed)
+        metrics.set("stellara_lavalink_retry_budget_exhausted_total", self.retry_budget.exhausted)
+        metrics.set("stellara_search_sessions", len(self.search_sessions))
+        hedger = self.search_hedger
+        metrics.set("stellara_search_hedged_total", hedger.hedged)
+        metrics.set("stellara_search_backup_wins_total", hedger.backup_wins)
+        for source, health in hedger.health.items():
+            for quantile in (0.5, SEARCH_HEDGE_PERCENTILE):
+                latency = health.latency(quantile)
+                if latency is not None:
+                    metrics.set("stellara_search_source_latency_seconds", latency, source=source, quantile=quantile)
+            metrics.set("stellara_search_source_error_ratio", health.error_rate, source=source)
+        metrics.set("stellara_autocomplete_suggestions", len(self.suggestions))
+
+        players: Dict[str, int] = {}
+        playing: Dict[str, int] = {}
+        queue_lengths = [0] * len(QUEUE_LENGTH_BUCKETS)
+        for vc in self.voice_clients:
+            if not isinstance(vc, MusicPlayer):
+                continue
+            node = vc.node.identifier
+            players[node] = players.get(node, 0) + 1
+            playing[node] = playing.get(node, 0) + (1 if vc.playing else 0)
+            length = vc.queue.count
+            for i, bound in enumerate(QUEUE_LENGTH_BUCKETS):
+                if length <= bound:
+                    queue_lengths[i] += 1
+
+        for name in ("stellara_players", "stellara_players_playing", "stellara_queue_length"):
+            metrics.clear(name)
+        for node in wavelink.Pool.nodes:
+            metrics.set("stellara_players", players.get(node, 0), node=node)
+            metrics.set("stellara_players_playing", playing.get(node, 0), node=node)
+        for bound, count in zip(QUEUE_LENGTH_BUCKETS, queue_lengths):
+            metrics.set("stellara_queue_length", count, le=bound)
+        metrics.set("stellara_queue_length", sum(players.values()), le="+Inf")
+
+        balancer = self.node_balancer
+        for identifier, node in wavelink.Pool.nodes.items():
+            health = balancer.health.get(identifier) or NodeHealth()
+            metrics.set("stellara_node_up", 1 if balancer.is_available(node) else 0, node=identifier)
+            metrics.set("stellara_node_players", health.players, node=identifier)
+            metrics.set("stellara_node_playing_players", health.playing, node=identifier)
+            metrics.set("stellara_node_cpu_load", health.cpu, node=identifier)
+            metrics.set("stellara_node_frame_deficit", health.deficit, node=identifier)
+            metrics.set("stellara_node_frames_nulled", health.nulled, node=identifier)
+            metrics.set("stellara_node_penalty", health.load, node=identifier)
+            metrics.set("stellara_node_stats_latency_seconds", health.latency, node=identifier)
+        metrics.set("stellara_node_migrations_total", balancer.migrations)
+        metrics.set("stellara_node_failed_migrations_total", balancer.failed_migrations)
+        metrics.set("stellara_recommendation_tracks", len(self.recommendations))
+        if self.spotify:
+            metrics.set("stellara_spotify_tracks_total", self.spotify.cached, result="cached")
+            metrics.set("stellara_spotify_tracks_total", self.spotify.searched, result="searched")
+            metrics.set("stellara_spotify_tracks_total", self.spotify.missing, result="missing")
+
+        monitor = self.loop_monitor
+        for quantile in (0.5, 0.99):
+            metrics.set("stellara_event_loop_lag_seconds", monitor.lag_percentile(quantile), quantile=quantile)
+        metrics.set("stellara_event_loop_lag_max_seconds", monitor.max_lag)
+        for command, count in monitor.slow_callbacks.items():
+            metrics.set("stellara_slow_callbacks_total", count, command=command)
 
-        # Connect to the Lavalink nodes
-        await wavelink.Pool.connect(nodes=nodes, client=self, cache_capacity=100)
+    async def connect_nodes(self, nodes: List[wavelink.Node]):
+        """Connect to every node at once, instead of one after another as Pool.connect does"""
+        # Search results are cached by our own TrackCache, so wavelink's in-memory cache stays off
+        await asyncio.gather(*(wavelink.Pool.connect(nodes=[node], client=self) for node in nodes))
+        if not wavelink.Pool.nodes:
+            logging.error("Couldn't connect to any Lavalink node, /play will fail until one is available")
 
-        # Start inactive player check task
-        self.check_inactive_players.start()
+    async def wait_for_nodes(self, timeout=NODE_READY_TIMEOUT) -> bool:
+        """Wait until a Lavalink node is ready, for commands that arrive right after a restart"""
+        if self.nodes_ready.is_set():
+            return True
+        try:
+            await asyncio.wait_for(self.nodes_ready.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def command_tree_hash(self) -> str:
+        """Hash of the commands as Discord sees them, changes whenever a sync is needed"""
+        commands = sorted(self.tree.get_commands(), key=lambda command: command.name)
+        payload = {
+            "application_id": self.application_id,
+            "commands": [command.to_dict(self.tree) for command in commands],
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    async def sync_commands(self, path=COMMAND_TREE_HASH_PATH):
+        """Sync the command tree with Discord, unless it's the same as the last time we synced"""
+        # Commands are global, so one worker process syncing is enough
+        if CLUSTER_ID != 0:
+            return
+
+        digest = self.command_tree_hash()
+        try:
+            with open(path, "r") as f:
+                if f.read().strip() == digest:
+                    logging.info("Command tree unchanged, skipping sync")
+                    return
+        except FileNotFoundError:
+            pass
+
+        try:
+            synced = await self.tree.sync()
+        except discord.HTTPException as e:
+            # The commands Discord already has keep working, so don't hold up startup
+            logging.error(f"Error syncing commands: {e}")
+            return
+
+        with open(path, "w") as f:
+            f.write(digest)
+        logging.info(f"Synced {len(synced)} commands")
+
+    async def setup_hook(self) -> None:
+        nodes = self.lavalink_nodes()
+
+        # Ask Lavalink to resume the sessions of the previous process, their players may still be playing
+        sessions = await self.player_snapshots.load_sessions()
+        for node in nodes:
+            node._session_id = sessions.get(node.identifier)
+
+        # Connect to the Lavalink nodes in the background, /play waits for them through nodes_ready
+        self._node_connect_task = asyncio.create_task(self.connect_nodes(nodes))
+
+        # Start writing changed guild settings in the background
+        self.settings.start()
+
+        # Start snapshotting player state
+        self.player_snapshots.start(lambda: self.voice_clients)
+
+        # Start writing the play history in batches
+        self.play_history.start()
+
+        # Fill the autocomplete index from earlier searches and plays
+        self._suggestion_seed_task = asyncio.create_task(self.seed_suggestions())
+
+        # Load the recommendation index and start writing new plays
+        self.recommendations.start()
+
+        # Start the inactive player scheduler
+        self.idle_scheduler.start()
+
+        # Start expiring old search results
+        self.search_sessions.start()
+
+        # Start checking node health
+        self.node_balancer.start()
+
+        # Answer stats requests from the other worker processes
+        if self.ipc:
+            self.ipc.handlers["stats"] = self.cluster_stats
+            await self.ipc.start()
+
+        # Start watching for callbacks that block the event loop
+        self.loop_monitor.start()
+
+        # Serve Prometheus metrics
+        if self.metrics_server:
+            await self.metrics_server.start()
+
+        # Sync slash commands while the nodes connect
+        await self.sync_commands()
+
+    async def close(self) -> None:
+        if self._node_connect_task:
+            self._node_connect_task.cancel()
+        if self._restore_task:
+            self._restore_task.cancel()
+        if self._suggestion_seed_task:
+            self._suggestion_seed_task.cancel()
+        # Keep the Lavalink players running and their snapshots on disk for the next process
+        self.shutting_down = True
+        await self.player_snapshots.close()
+        self.idle_scheduler.close()
+        self.search_sessions.close()
+        self.node_balancer.close()
+        self.loop_monitor.close()
+        if self.ipc:
+            await self.ipc.close()
+        if self.metrics_server:
+            await self.metrics_server.close()
+        await super().close()
+        await self.settings.close()
+        await self.play_history.close()
+        await self.recommendations.close()
+        if self.spotify:
+            await self.spotify.close()
+        self.track_cache.close()
+
+    async def seed_suggestions(self, limit=SUGGEST_SEED_TRACKS):
+        """Load recently searched and played tracks into the autocomplete index"""
+        try:
+            searched = await self.track_cache.recent_tracks(limit)
+            played = await self.play_history.popular_tracks(limit)
+        except Exception as e:
+            logging.error(f"Error loading autocomplete suggestions: {e}", exc_info=True)
+            return
+
+        # Oldest first, so the most recent end up last in the index's recency order
+        for data in reversed(searched):
+            self.suggestions.add(wavelink.Playable(data))
+        for data, plays in reversed(played):
+            self.suggestions.add(wavelink.Playable(data), hits=plays)
+        logging.info(f"Loaded {len(self.suggestions)} autocomplete suggestions")
 
-        # Sync slash commands
-        await self.tree.sync()
+    async def cluster_stats(self, data=None) -> dict:
+        """Summary of this process, aggregated across processes by /cluster"""
+        players = [vc for vc in self.voice_clients if isinstance(vc, MusicPlayer)]
+        return {
+            "cluster": CLUSTER_ID,
+            "shards": sorted(self.shards),
+            "guilds": len(self.guilds),
+            "players": len(players),
+            "playing": sum(1 for player in players if player.playing),
+            "latency_ms": round(self.latency * 1000) if self.shards else None,
+            "loop_lag_ms": round(self.loop_monitor.lag_percentile(0.99) * 1000, 1),
+        }
+
+    async def all_cluster_stats(self) -> List[dict]:
+        """Stats of every worker process, or just this one when running without the launcher"""
+        if self.ipc:
+            return [stats for stats in await self.ipc.request("stats") if stats]
+        return [await self.cluster_stats()]
+
+    async def restore_players(self):
+        """Reattach to or rebuild the players the previous process had, from their snapshots"""
+        if not await self.wait_for_nodes():
+            logging.error("No Lavalink node became ready, player snapshots weren't restored")
+            return
+
+        snapshots = await self.player_snapshots.load_all()
+        slots = asyncio.Semaphore(RESTORE_CONCURRENCY)
+
+        async def restore(guild_id: int, state: dict, updated_at: float) -> bool:
+            async with slots:
+                try:
+                    return await self.restore_player(guild_id, state, updated_at)
+                except Exception as e:
+                    logging.error(f"Error restoring the player for guild {guild_id}: {e!r}")
+                    self.player_snapshots.discard(guild_id)
+                    return False
+
+        started = time.perf_counter()
+        restored = await asyncio.gather(*(restore(*snapshot) for snapshot in snapshots))
+        if snapshots:
+            logging.info(f"Restored {sum(restored)} of {len(snapshots)} players in {time.perf_counter() - started:.1f}s")
+        await self.player_snapshots.drop_stale()
+
+        await self.destroy_orphaned_players()
+
+    async def restore_player(self, guild_id: int, state: dict, updated_at: float) -> bool:
+        guild = self.get_guild(guild_id)
+        if guild is None:
+            # Another cluster's guild, it restores its own players
+            return False
+
+        channel = guild.get_channel(state["channel_id"]) if state["channel_id"] else None
+        if channel is None or guild.voice_client or time.time() - updated_at > SNAPSHOT_MAX_AGE:
+            self.player_snapshots.discard(guild_id)
+            return False
+
+        # A resumed session may still be playing this guild, so go back to the same node when we can
+        node = wavelink.Pool.nodes.get(state["node"])
+        resumed = node is not None and node.identifier in self.resumed_nodes and self.node_balancer.is_available(node)
+        if not resumed:
+            node = self.node_balancer.best_node()
+
+        # What VoiceChannel.connect does, except that the node is chosen here
+        player = MusicPlayer(self, channel, nodes=[node])
+        self._connection._add_voice_client(guild.id, player)
+        try:
+            await player.connect(timeout=60.0, reconnect=True)
+        except Exception:
+            self._connection._remove_voice_client(guild.id)
+            raise
+
+        await player.restore_snapshot(state, time.time() - updated_at, resumed)
+        await player.update_last_interaction()
+        return True
+
+    async def destroy_orphaned_players(self):
+        """Stop players a resumed session kept running for guilds that weren't restored"""
+        for identifier in self.resumed_nodes:
+            node = wavelink.Pool.nodes.get(identifier)
+            if node is None:
+                continue
+            try:
+                players = await node.fetch_players()
+            except (wavelink.LavalinkException, wavelink.NodeException):
+                continue
+            for info in players:
+                guild = self.get_guild(info.guild_id)
+                if guild is not None and guild.voice_client is None:
+                    await node._destroy_player(info.guild_id)
+
+    async def on_guild_role_create(self, role: discord.Role) -> None:
+        if role.name == DJ_ROLE_NAME:
+            self.dj_roles.invalidate(role.guild.id)
+
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role) -> None:
+        if DJ_ROLE_NAME in (before.name, after.name):
+            self.dj_roles.invalidate(after.guild.id)
+
+    async def on_guild_role_delete(self, role: discord.Role) -> None:
+        if role.name == DJ_ROLE_NAME:
+            self.dj_roles.invalidate(role.guild.id)
+
+    async def on_guild_remove(self, guild: discord.Guild) -> None:
+        self.dj_roles.invalidate(guild.id)
 
     async def on_ready(self) -> None:
         logging.info("Logged in: %s | %s", self.user, self.user.id)
@@ -133,26 +4540,27 @@ class Bot(commands.Bot):
         
         logging.info(f"Connected to {len(self.guilds)} guilds!")
 
-    @tasks.loop(seconds=30)
-    async def check_inactive_players(self):
-        """Task to check and disconnect inactive players"""
-        for guild in self.guilds:
-            player = cast(MusicPlayer, guild.voice_client)
-            if not player:
-                continue
-                
-            # Check if player is inactive and not playing anything
-            if player.is_inactive() and not player.playing:
-                await player.disconnect()
-                if player.home:
-                    try:
-                        await player.home.send("🔌 Disconnected due to inactivity.")
-                    except discord.HTTPException:
-                        pass
-    
-    @check_inactive_players.before_loop
-    async def before_check_inactive(self):
-        await self.wait_until_ready()
+        # Only the first on_ready follows a restart, later ones are gateway reconnects
+        if self._restore_task is None:
+            self._restore_task = asyncio.create_task(self.restore_players())
+
+    async def disconnect_inactive_player(self, player: MusicPlayer):
+        """Called by the idle scheduler when a player's inactivity deadline passes"""
+        # The player may have been replaced or kicked from voice since it was scheduled
+        if not player.guild or player.guild.voice_client is not player:
+            return
+
+        # Keep playing players connected and check again later
+        if player.playing:
+            self.idle_scheduler.arm(player)
+            return
+
+        await player.disconnect()
+        if player.home:
+            try:
+                await player.home.send("🔌 Disconnected due to inactivity.")
+            except discord.HTTPException:
+                pass
 
     async def on_wavelink_track_start(self, payload: wavelink.TrackStartEventPayload) -> None:
         player: MusicPlayer = payload.player
@@ -162,47 +4570,45 @@ class Bot(commands.Bot):
         player.current_track = track
         await player.update_last_interaction()
 
-        # Create embed for now playing
-        embed = discord.Embed(
-            title="Now Playing 🎶",
-            description=f"**{track.title}**\nby `{track.author}`",
-            color=discord.Color.blurple()
-        )
-        
-        if track.artwork:
-            embed.set_image(url=track.artwork)
-        
-        embed.add_field(
-            name="Duration", 
-            value=player.format_duration(track.length), 
-            inline=True
-        )
-        
-        # Add progress bar
-        progress_bar = player.create_progress_bar(0, track.length)
-        time_display = f"0:00 {progress_bar} {player.format_duration(track.length)}"
-        embed.add_field(name="Progress", value=time_display, inline=False)
-        
-        # Add source info
-        source_icon = "🎵"
-        if "youtube" in track.source:
-            source_icon = "🔴"
-        elif "spotify" in track.source:
-            source_icon = "💚"
-            
-        embed.add_field(name="Source", value=f"{source_icon} {track.source}", inline=True)
-        
-        if player.loop:
-            embed.add_field(name="Loop", value="🔂 Track loop enabled", inline=True)
-        elif player.loop_queue:
-            embed.add_field(name="Loop", value="🔁 Queue loop enabled", inline=True)
-            
+        # Keep building queued playlists as playback moves through them
+        player.schedule_refill()
+
+        # A track restarted after a node switch has already been announced
+        if player.switching_track:
+            switched = player.switching_track == track.encoded
+            player.switching_track = None
+            if switched:
+                return
+
+        # Log the play, tracks restarted after a node switch returned above
+        if player.guild:
+            self.play_history.record(player.guild.id, track)
+        self.suggestions.add(track)
+
+        # Learn which tracks follow each other, leaving out autoplay's own picks
+        if player.guild and not getattr(track.extras, "autoplay", False):
+            self.recommendations.record(player.guild.id, track)
+
+        embed = build_now_playing_embed(player, track)
+
         # Send now playing message
         if hasattr(player, "home") and player.home:
             player.progress_message = await player.home.send(embed=embed)
 
     async def on_wavelink_track_end(self, payload: wavelink.TrackEndEventPayload) -> None:
         player: MusicPlayer = payload.player
+        if not player:
+            return
+
+        # Start the inactivity countdown from the end of the track
+        if player.guild:
+            self.idle_scheduler.arm(player)
+
+        # Handle queue loops before wavelink's autoplay takes the next track from the queue
+        if player.loop_queue and payload.reason == 'finished' and not player.queue.is_empty:
+            # If we reached the end of a track and queue loop is enabled,
+            # add the current track to the end of the queue
+            player.queue.put(payload.track)
         
         # Clean up progress message if it exists
         if player.progress_message:
@@ -216,19 +4622,29 @@ class Bot(commands.Bot):
         if player.loop and payload.reason == 'finished':
             # If track loop is enabled, play the same track again
             await player.play(payload.track)
-            return
-        
-        # Handle queue loops
-        if player.loop_queue and payload.reason == 'finished' and not player.queue.is_empty:
-            # If we reached the end of a track and queue loop is enabled,
-            # add the current track to the end of the queue
-            await player.queue.put_wait(payload.track)
     
     async def on_wavelink_node_ready(self, payload: wavelink.NodeReadyEventPayload) -> None:
-        logging.info(f"Wavelink Node {payload.node.identifier} is ready!")
+        logging.info(f"Wavelink Node {payload.node.identifier} is ready! (resumed: {payload.resumed})")
+        if payload.resumed:
+            self.resumed_nodes.add(payload.node.identifier)
+        await self.player_snapshots.save_session(payload.node.identifier, payload.session_id)
+        self.nodes_ready.set()
     
+    async def on_wavelink_node_disconnected(self, payload: wavelink.NodeDisconnectedEventPayload) -> None:
+        logging.warning(f"Wavelink Node {payload.node.identifier} disconnected")
+        await self.node_balancer.evacuate(payload.node)
+
     async def on_wavelink_websocket_closed(self, payload: wavelink.WebsocketClosedEventPayload) -> None:
-        logging.warning(f"Wavelink WebSocket closed with code {payload.code} for guild {payload.guild_id}")
+        player = payload.player
+        guild_id = player.guild.id if player and player.guild else None
+        logging.warning(f"Wavelink WebSocket closed with code {payload.code} for guild {guild_id}")
+        if not player or payload.code is wavelink.DiscordVoiceCloseType.DISCONNECTED:
+            return
+
+        # Voice connections also drop for reasons unrelated to Lavalink, so only move if the node looks unhealthy
+        await self.node_balancer.probe(player.node)
+        if self.node_balancer.is_degraded(player.node):
+            await self.node_balancer.migrate(player)
 
 
 bot = Bot()
@@ -244,9 +4660,8 @@ async def has_dj_permissions(interaction: discord.Interaction) -> bool:
     if interaction.user.id == interaction.guild.owner_id or await bot.is_owner(interaction.user):
         return True
     
-    # Check if user has the DJ role
-    dj_role = discord.utils.get(interaction.guild.roles, name=DJ_ROLE_NAME)
-    if dj_role and dj_role in interaction.user.roles:
+    # Check if user has the DJ role, using the role IDs that come with the interaction
+    if any(interaction.user.get_role(role_id) for role_id in bot.dj_roles.role_ids(interaction.guild)):
         return True
         
     # Check if user is in the DJ members set
@@ -257,28 +4672,109 @@ async def has_dj_permissions(interaction: discord.Interaction) -> bool:
     return False
 
 
+def build_search_term(query: str, prefix: Optional[str] = DEFAULT_SEARCH_PREFIX) -> str:
+    """Build the Lavalink identifier for a query the same way wavelink.Playable.search does"""
+    if not prefix or yarl.URL(query).host:
+        return query
+    return f"{prefix}:{query}"
+
+
+def normalize_search_term(term: str) -> str:
+    """Normalize a search term so equivalent queries share a cache entry"""
+    term = " ".join(term.split())
+    # URLs can be case sensitive (video IDs), plain text searches are not
+    if yarl.URL(term).host:
+        return term
+    return term.lower()
+
+
+def build_search(result: dict) -> Union[LazyPlaylist, List[wavelink.Playable]]:
+    """Turn a raw Lavalink load result into wavelink objects, mirroring wavelink.Pool.fetch_tracks"""
+    load_type = result["loadType"]
+
+    if load_type == "track":
+        return [wavelink.Playable(result["data"])]
+    elif load_type == "search":
+        return [wavelink.Playable(data) for data in result["data"]]
+    elif load_type == "playlist":
+        # Tracks are only built once they're about to be queued
+        return LazyPlaylist(result["data"])
+    elif load_type == "error":
+        raise wavelink.LavalinkLoadException(data=result["data"])
+
+    return []
+
+
+async def fetch_load_result(term: str, node: Optional[wavelink.Node] = None) -> dict:
+    """Run a Lavalink loadtracks request and return the raw response"""
+    node = node or bot.node_balancer.best_node()
+    return await node._fetch_tracks(urllib.parse.quote(term))
+
+
+async def load_search_result(key: str, term: str) -> dict:
+    """Load the raw result for a search term through the persistent track cache, falling back to Lavalink"""
+    cached = await bot.track_cache.get(key)
+    if cached is not None:
+        return cached
+
+    started = time.perf_counter()
+    try:
+        result = await fetch_load_result(term)
+    except asyncio.CancelledError:
+        # Cancelled searches were at least this slow, leaving them out would make the source look faster than it is
+        bot.search_hedger.record(term, time.perf_counter() - started, failed=False)
+        raise
+    except Exception:
+        bot.search_hedger.record(term, time.perf_counter() - started, failed=True)
+        raise
+    bot.search_hedger.record(term, time.perf_counter() - started, failed=result["loadType"] == "error")
+    if result["loadType"] in ("track", "search", "playlist") and result["data"]:
+        await bot.track_cache.put(key, result)
+
+    return result
+
+
+async def resolve_search(term: str) -> Union[LazyPlaylist, List[wavelink.Playable]]:
+    """Resolve a search term, coalescing identical concurrent searches into one request"""
+    key = normalize_search_term(term)
+    result = await bot.search_coalescer.run(key, lambda: load_search_result(key, term))
+
+    # Every caller builds its own objects so queues never share Playable instances
+    tracks = build_search(result)
+    if isinstance(tracks, list):
+        for track in tracks[:SUGGEST_PER_SEARCH]:
+            bot.suggestions.add(track)
+    return tracks
+
+
 # Search track helper function
-async def search_tracks(query: str) -> wavelink.Search:
+async def search_tracks(query: str) -> Union[LazyPlaylist, List[wavelink.Playable]]:
     # Check if it's a Spotify link
     spotify_match = SPOTIFY_REGEX.match(query)
     if spotify_match:
         spotify_type = spotify_match.group("type")
         spotify_id = spotify_match.group("id")
-        
+
+        # With API credentials every track is matched here, through the mapping cache
+        if bot.spotify:
+            return await bot.spotify.resolve(spotify_type, spotify_id)
+
         # Create proper Spotify URL format for wavelink
         if spotify_type == "track":
             query = f"spsearch:{query}"  # Search Spotify track
         else:
             # It's a playlist or album - use direct Spotify URL
-            return await wavelink.Playable.search(query)
+            return await resolve_search(build_search_term(query))
     
     # YouTube playlist handling
     youtube_playlist_match = YOUTUBE_PLAYLIST_REGEX.match(query)
     if youtube_playlist_match:
-        return await wavelink.Playable.search(query)
+        return await resolve_search(build_search_term(query))
     
-    # Regular search
-    return await wavelink.Playable.search(query)
+    # Regular search, links go straight to Lavalink and free text is hedged across sources
+    if yarl.URL(query).host:
+        return await resolve_search(query)
+    return await bot.search_hedger.search(query, DEFAULT_SEARCH_PREFIX, resolve_search)
 
 
 @bot.tree.command(name="play", description="Play a song with the given query.")
@@ -302,12 +4798,18 @@ async def play(interaction: discord.Interaction, query: str) -> None:
 
     player: MusicPlayer = cast(MusicPlayer, interaction.guild.voice_client)
 
+    # Right after a restart the Lavalink nodes may still be connecting
+    if not await bot.wait_for_nodes():
+        await interaction.followup.send("The music server is still starting up. Please try again in a moment.", ephemeral=True)
+        return
+
     if not player:
         try:
             player = await interaction.user.voice.channel.connect(cls=MusicPlayer)
-            # Set the volume from saved settings
-            volume = bot.volume_manager.get_volume(interaction.guild.id)
-            await player.set_volume(volume)
+            # Apply the guild's saved volume and default filters
+            player.settings = await bot.settings.get(interaction.guild.id)
+            await player.set_volume(player.settings.volume)
+            await player.apply_saved_filters()
         except AttributeError:
             await interaction.followup.send("Please join a voice channel first before using this command.", ephemeral=True)
             return
@@ -315,7 +4817,7 @@ async def play(interaction: discord.Interaction, query: str) -> None:
             await interaction.followup.send("I was unable to join this voice channel. Please try again.", ephemeral=True)
             return
 
-    if not hasattr(player, "home"):
+    if player.home is None:
         player.home = interaction.channel
     elif player.home != interaction.channel:
         await interaction.followup.send(f"You can only play songs in {player.home.mention}, as the player has already started there.", ephemeral=True)
@@ -323,14 +4825,17 @@ async def play(interaction: discord.Interaction, query: str) -> None:
 
     try:
         # Use the improved search function
-        tracks: wavelink.Search = await search_tracks(query)
+        tracks = await search_tracks(query)
         
         if not tracks:
             await interaction.followup.send(f"Could not find any tracks with that query. Please try again.", ephemeral=True)
             return
 
-        if isinstance(tracks, wavelink.Playlist):
-            added: int = await player.queue.put_wait(tracks)
+        if isinstance(tracks, LazyPlaylist):
+            # Remember who queued the tracks, Lavalink echoes extras back in track events
+            tracks.extras = {"requester_id": interaction.user.id}
+            # Only the first tracks are built now, the rest follow in batches as the queue drains
+            added: int = player.queue.put_lazy(tracks)
             
             # Create an embed with playlist information
             embed = discord.Embed(
@@ -340,7 +4845,7 @@ async def play(interaction: discord.Interaction, query: str) -> None:
             )
             
             embed.add_field(name="Tracks Added", value=f"{added} songs", inline=True)
-            embed.add_field(name="Total Duration", value=f"{player.format_duration(sum(track.length for track in tracks))}", inline=True)
+            embed.add_field(name="Total Duration", value=f"{player.format_duration(tracks.total_length)}", inline=True)
             
             if tracks.artwork:
                 embed.set_thumbnail(url=tracks.artwork)
@@ -348,17 +4853,18 @@ async def play(interaction: discord.Interaction, query: str) -> None:
             await interaction.followup.send(embed=embed)
         elif len(tracks) > 1:
             # Store the search results for this user
-            bot.search_results[interaction.user.id] = tracks[:5]  # Store up to 5 results
+            results = tracks[:SEARCH_RESULT_LIMIT]
+            bot.search_sessions.put(interaction.guild.id, interaction.user.id, results)
             
             # Create selection embed
             embed = discord.Embed(
                 title="Search Results 🔍",
-                description="Please select a track to play by using the `/select` command with the track number.",
+                description="Please select a track to play from the menu below, or use the `/select` command with the track number.",
                 color=discord.Color.blue()
             )
             
             # Add tracks to embed
-            for i, track in enumerate(tracks[:5], 1):
+            for i, track in enumerate(results, 1):
                 duration = player.format_duration(track.length)
                 embed.add_field(
                     name=f"{i}. {track.title}",
@@ -366,17 +4872,15 @@ async def play(interaction: discord.Interaction, query: str) -> None:
                     inline=False
                 )
                 
-            embed.set_footer(text=f"Use '/select <number>' to choose a track • Results will expire in 60 seconds")
+            embed.set_footer(text=f"Use '/select <number>' to choose a track • Results will expire in {SEARCH_SESSION_TTL} seconds")
             
-            await interaction.followup.send(embed=embed)
-            
-            # Set a timer to clear these results after 60 seconds
-            await asyncio.sleep(60)
-            if interaction.user.id in bot.search_results:
-                del bot.search_results[interaction.user.id]
+            await interaction.followup.send(embed=embed, view=SearchResultView(interaction.user.id, results))
+            # Nothing is queued until a result is selected
+            return
         else:
             # Single track found
             track: wavelink.Playable = tracks[0]
+            track.extras = {"requester_id": interaction.user.id}
             await player.queue.put_wait(track)
             
             # Create an embed with track information
@@ -395,26 +4899,37 @@ async def play(interaction: discord.Interaction, query: str) -> None:
             await interaction.followup.send(embed=embed)
 
         if not player.playing:
-            await player.play(player.queue.get(), volume=bot.volume_manager.get_volume(interaction.guild.id))
+            await player.play(player.queue.get(), volume=player.settings.volume)
             
     except Exception as e:
         logging.error(f"Error in play command: {e}", exc_info=True)
         await interaction.followup.send(f"An error occurred: {e}", ephemeral=True)
 
 
-@bot.tree.command(name="select", description="Select a track from your search results.")
-@app_commands.describe(number="The track number to select (1-5)")
-async def select(interaction: discord.Interaction, number: int) -> None:
-    """Select a track from search results."""
-    await interaction.response.defer()
-    await MusicPlayer.update_last_interaction(interaction.guild.voice_client if interaction.guild.voice_client else None)
+@play.autocomplete("query")
+async def play_query_autocomplete(interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+    # Answered from memory only, a Lavalink search per keystroke would be far too slow
+    try:
+        if yarl.URL(current.strip()).host:
+            return []
+    except ValueError:
+        # A link that is still being typed, like "http://[::1"
+        return []
+    return [app_commands.Choice(name=entry.name, value=entry.value) for entry in bot.suggestions.search(current)]
+
+
+async def add_search_selection(interaction: discord.Interaction, number: int) -> None:
+    """Queue a track from the user's pending search results, after the interaction was deferred"""
+    if interaction.guild.voice_client:
+        await MusicPlayer.update_last_interaction(interaction.guild.voice_client)
     
-    if interaction.user.id not in bot.search_results:
+    results = bot.search_sessions.get(interaction.guild.id, interaction.user.id)
+    if results is None:
         await interaction.followup.send("You don't have any active search results. Use `/play` to search for songs first.", ephemeral=True)
         return
         
-    if not 1 <= number <= len(bot.search_results[interaction.user.id]):
-        await interaction.followup.send(f"Please select a valid number between 1 and {len(bot.search_results[interaction.user.id])}.", ephemeral=True)
+    if not 1 <= number <= len(results):
+        await interaction.followup.send(f"Please select a valid number between 1 and {len(results)}.", ephemeral=True)
         return
         
     player: MusicPlayer = cast(MusicPlayer, interaction.guild.voice_client)
@@ -423,7 +4938,8 @@ async def select(interaction: discord.Interaction, number: int) -> None:
         return
     
     # Get the selected track and add it to the queue
-    track = bot.search_results[interaction.user.id][number-1]
+    track = results[number-1]
+    track.extras = {"requester_id": interaction.user.id}
     await player.queue.put_wait(track)
     
     # Create an embed with track information
@@ -440,12 +4956,52 @@ async def select(interaction: discord.Interaction, number: int) -> None:
         embed.set_thumbnail(url=track.artwork)
     
     # Clean up search results
-    del bot.search_results[interaction.user.id]
+    bot.search_sessions.pop(interaction.guild.id, interaction.user.id)
     
     await interaction.followup.send(embed=embed)
     
     if not player.playing:
-        await player.play(player.queue.get(), volume=bot.volume_manager.get_volume(interaction.guild.id))
+        await player.play(player.queue.get(), volume=player.settings.volume)
+
+
+class SearchResultSelect(discord.ui.Select):
+    """Select menu listing the results of a search"""
+    def __init__(self, tracks: List[wavelink.Playable]):
+        options = [
+            discord.SelectOption(
+                label=f"{i}. {track.title}"[:100],
+                description=f"by {track.author} • {MusicPlayer.format_duration(track.length)}"[:100],
+                value=str(i)
+            )
+            for i, track in enumerate(tracks, 1)
+        ]
+        super().__init__(placeholder="Choose a track to play", options=options)
+
+    async def callback(self, interaction: discord.Interaction) -> None:
+        await interaction.response.defer()
+        await add_search_selection(interaction, int(self.values[0]))
+
+
+class SearchResultView(discord.ui.View):
+    """Select menu for picking one of the user's search results"""
+    def __init__(self, user_id: int, tracks: List[wavelink.Playable]):
+        super().__init__(timeout=SEARCH_SESSION_TTL)
+        self.user_id = user_id
+        self.add_item(SearchResultSelect(tracks))
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.user_id:
+            await interaction.response.send_message("These search results belong to someone else.", ephemeral=True)
+            return False
+        return True
+
+
+@bot.tree.command(name="select", description="Select a track from your search results.")
+@app_commands.describe(number="The track number to select (1-5)")
+async def select(interaction: discord.Interaction, number: int) -> None:
+    """Select a track from search results."""
+    await interaction.response.defer()
+    await add_search_selection(interaction, number)
 
 
 @bot.tree.command(name="skip", description="Skip the current song.")
@@ -541,29 +5097,60 @@ async def stop(interaction: discord.Interaction) -> None:
         await interaction.response.send_message("You need the DJ role to use this command.", ephemeral=True)
         return
 
-    await player.stop()
+    # Empty everything first: with partial autoplay wavelink can start the next queued
+    # track as soon as the track end event arrives, before stop() returns
+    player.autoplay = wavelink.AutoPlayMode.partial
+    player.auto_queue.clear()
     player.queue.clear()
     player.loop = False
     player.loop_queue = False
+    await player.stop()
     
     await interaction.response.send_message("⏹️ Stopped the music and cleared the queue.")
 
 
-@bot.tree.command(name="queue", description="Show the current music queue.")
-async def queue(interaction: discord.Interaction) -> None:
-    """Show the current music queue."""
-    player: MusicPlayer = cast(MusicPlayer, interaction.guild.voice_client)
-    await MusicPlayer.update_last_interaction(player)
+def build_now_playing_embed(player: MusicPlayer, track: wavelink.Playable) -> discord.Embed:
+    """Build the embed announcing a track that just started"""
+    # Create embed for now playing
+    embed = discord.Embed(
+        title="Now Playing 🎶",
+        description=f"**{track.title}**\nby `{track.author}`",
+        color=discord.Color.blurple()
+    )
     
-    if not player:
-        await interaction.response.send_message("I'm not currently in a voice channel.", ephemeral=True)
-        return
+    if track.artwork:
+        embed.set_image(url=track.artwork)
+    
+    embed.add_field(
+        name="Duration", 
+        value=player.format_duration(track.length), 
+        inline=True
+    )
+    
+    # Add progress bar
+    progress_bar = player.create_progress_bar(0, track.length)
+    time_display = f"0:00 {progress_bar} {player.format_duration(track.length)}"
+    embed.add_field(name="Progress", value=time_display, inline=False)
+    
+    # Add source info
+    source_icon = "🎵"
+    if "youtube" in track.source:
+        source_icon = "🔴"
+    elif "spotify" in track.source:
+        source_icon = "💚"
+        
+    embed.add_field(name="Source", value=f"{source_icon} {track.source}", inline=True)
+    
+    if player.loop:
+        embed.add_field(name="Loop", value="🔂 Track loop enabled", inline=True)
+    elif player.loop_queue:
+        embed.add_field(name="Loop", value="🔁 Queue loop enabled", inline=True)
 
-    if player.queue.is_empty and not player.current_track:
-        await interaction.response.send_message("The queue is empty.", ephemeral=True)
-        return
+    return embed
 
-    queue_list = list(player.queue)
+
+def build_queue_embed(player: MusicPlayer, page: int) -> discord.Embed:
+    """Build the /queue embed for one page of the queue"""
     embed = discord.Embed(title="🎶 Music Queue", color=discord.Color.blue())
     
     # Add queue status info
@@ -595,32 +5182,187 @@ async def queue(interaction: discord.Interaction) -> None:
         if current_track.artwork:
             embed.set_thumbnail(url=current_track.artwork)
 
-    # Calculate total duration of queue
-    total_duration = sum(track.length for track in queue_list)
-    total_tracks = len(queue_list)
+    # Totals are maintained by the queue as tracks come and go
+    pending = player.queue.pending_count
+    total_tracks = player.queue.count
+    total_duration = player.queue.total_length + (player.queue.pending_length if pending else 0)
     
     # Show queue tracks
-    if queue_list:
-        queue_text = ""
-        for i, track in enumerate(queue_list[:10], 1):
-            duration = player.format_duration(track.length)
-            queue_text += f"`{i}.` **{track.title}** - `{track.author}` • `{duration}`\n"
-            
-        if len(queue_list) > 10:
-            queue_text += f"\n... and {len(queue_list) - 10} more tracks"
-            
-        embed.add_field(name="Up Next", value=queue_text, inline=False)
+    if total_tracks:
+        embed.add_field(name="Up Next", value=player.queue_page_text(page), inline=False)
         
         # Add queue summary
-        embed.add_field(
-            name="Queue Summary", 
-            value=f"**{total_tracks}** tracks • Total duration: **{player.format_duration(total_duration)}**",
-            inline=False
-        )
+        requesters = len([requester for requester in player.queue.requester_counts if requester is not None])
+        summary = f"**{total_tracks}** tracks • Total duration: **{player.format_duration(total_duration)}**"
+        if requesters:
+            summary += f" • Requested by **{requesters}** users"
+        if pending:
+            summary += f"\n{pending} more playlist tracks are added as the queue plays"
+        embed.add_field(name="Queue Summary", value=summary, inline=False)
+        embed.set_footer(text=f"Page {page + 1}/{player.queue_pages}")
     else:
         embed.add_field(name="Up Next", value="No more tracks in queue", inline=False)
+
+    return embed
+
+
+class QueueJumpModal(discord.ui.Modal, title="Jump to page"):
+    """Modal asking for a queue page number"""
+    page = discord.ui.TextInput(label="Page number", max_length=6)
+
+    def __init__(self, view: "QueueView"):
+        super().__init__()
+        self.view = view
+
+    async def on_submit(self, interaction: discord.Interaction) -> None:
+        try:
+            page = int(self.page.value)
+        except ValueError:
+            await interaction.response.send_message("Please enter a valid page number.", ephemeral=True)
+            return
+
+        self.view.page = page - 1
+        await self.view.show(interaction)
+
+
+class QueueView(discord.ui.View):
+    """Buttons for paging through the /queue embed"""
+    def __init__(self, player: MusicPlayer, page: int = 0):
+        super().__init__(timeout=QUEUE_VIEW_TIMEOUT)
+        self.player = player
+        self.page = page
+        self.update_buttons()
+
+    def update_buttons(self):
+        self.page = max(0, min(self.page, self.player.queue_pages - 1))
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.player.queue_pages - 1
+
+    async def show(self, interaction: discord.Interaction):
+        await MusicPlayer.update_last_interaction(self.player)
+        self.update_buttons()
+        await interaction.response.edit_message(embed=build_queue_embed(self.player, self.page), view=self)
+
+    @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button) -> None:
+        self.page -= 1
+        await self.show(interaction)
+
+    @discord.ui.button(label="Jump to page", style=discord.ButtonStyle.secondary)
+    async def jump_page(self, interaction: discord.Interaction, button: discord.ui.Button) -> None:
+        await interaction.response.send_modal(QueueJumpModal(self))
+
+    @discord.ui.button(emoji="▶️", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button) -> None:
+        self.page += 1
+        await self.show(interaction)
+
+
+@bot.tree.command(name="queue", description="Show the current music queue.")
+@app_commands.describe(page="The page of the queue to show")
+async def queue(interaction: discord.Interaction, page: int = 1) -> None:
+    """Show the current music queue."""
+    player: MusicPlayer = cast(MusicPlayer, interaction.guild.voice_client)
+    await MusicPlayer.update_last_interaction(player)
     
-    await interaction.response.send_message(embed=embed)
+    if not player:
+        await interaction.response.send_message("I'm not currently in a voice channel.", ephemeral=True)
+        return
+
+    if player.queue.is_empty and not player.current_track:
+        await interaction.response.send_message("The queue is empty.", ephemeral=True)
+        return
+
+    view = QueueView(player, page - 1)
+    await interaction.response.send_message(embed=build_queue_embed(player, view.page), view=view)
+
+
+@bot.tree.command(name="history", description="Show the tracks recently played in this server.")
+@app_commands.describe(page="Page of the history to show", user="Only show tracks this member queued")
+async def history(interaction: discord.Interaction, page: int = 1, user: Optional[discord.Member] = None) -> None:
+    """Show the tracks recently played in this server."""
+    if page < 1:
+        await interaction.response.send_message("Page must be 1 or higher.", ephemeral=True)
+        return
+
+    await interaction.response.defer()
+    plays = await bot.play_history.recent(
+        interaction.guild.id, (page - 1) * HISTORY_PAGE_SIZE, requester_id=user.id if user else None, fresh=page == 1
+    )
+    if not plays:
+        message = "Nothing has been played here yet." if page == 1 else f"There's no page {page} of the history."
+        await interaction.followup.send(message, ephemeral=True)
+        return
+
+    lines = []
+    for i, (track, requester_id, played_at) in enumerate(plays, (page - 1) * HISTORY_PAGE_SIZE + 1):
+        requester = f"<@{requester_id}>" if requester_id else "autoplay"
+        played = discord.utils.format_dt(datetime.fromtimestamp(played_at), "R")
+        lines.append(f"`{i}.` **{track.title}** - `{track.author}` • {played} • {requester}")
+
+    title = f"📜 Tracks queued by {user.display_name}" if user else "📜 Recently Played"
+    embed = discord.Embed(title=title, description="\n".join(lines), color=discord.Color.blue())
+    embed.set_footer(text=f"Page {page} • Use /replay <number> to queue a track again")
+    await interaction.followup.send(embed=embed)
+
+
+@bot.tree.command(name="top", description="Show the most played tracks in this server.")
+async def top(interaction: discord.Interaction) -> None:
+    """Show the most played tracks in this server."""
+    await interaction.response.defer()
+    tracks = await bot.play_history.top(interaction.guild.id)
+    if not tracks:
+        await interaction.followup.send("Nothing has been played here yet.", ephemeral=True)
+        return
+
+    lines = []
+    for i, (track, plays, last_played) in enumerate(tracks, 1):
+        played = discord.utils.format_dt(datetime.fromtimestamp(last_played), "R")
+        lines.append(f"`{i}.` **{track.title}** - `{track.author}` • {plays} play{'s' if plays != 1 else ''} • last {played}")
+
+    embed = discord.Embed(title="🏆 Most Played", description="\n".join(lines), color=discord.Color.gold())
+    await interaction.followup.send(embed=embed)
+
+
+@bot.tree.command(name="replay", description="Queue a track from the play history again.")
+@app_commands.describe(number="Number of the track in /history", user="The member whose /history the number is from")
+async def replay(interaction: discord.Interaction, number: int, user: Optional[discord.Member] = None) -> None:
+    """Queue a track from the play history again."""
+    player: MusicPlayer = cast(MusicPlayer, interaction.guild.voice_client)
+    if not player:
+        await interaction.response.send_message("I'm not currently in a voice channel.", ephemeral=True)
+        return
+    await MusicPlayer.update_last_interaction(player)
+
+    if number < 1:
+        await interaction.response.send_message("Please pick a number from `/history`.", ephemeral=True)
+        return
+
+    await interaction.response.defer()
+    # Numbered like the /history pages that were last shown
+    plays = await bot.play_history.recent(interaction.guild.id, number - 1, limit=1, requester_id=user.id if user else None)
+    if not plays:
+        await interaction.followup.send(f"There's no track #{number} in the history.", ephemeral=True)
+        return
+
+    # The stored payload is played as is, without searching again
+    track = plays[0][0]
+    track.extras = {"requester_id": interaction.user.id}
+    await player.queue.put_wait(track)
+
+    embed = discord.Embed(
+        title="Added to Queue 🎵",
+        description=f"**{track.title}**\nby `{track.author}`",
+        color=discord.Color.green()
+    )
+    embed.add_field(name="Duration", value=player.format_duration(track.length), inline=True)
+    embed.add_field(name="Position", value=f"#{player.queue.count}" if player.playing else "Next", inline=True)
+    if track.artwork:
+        embed.set_thumbnail(url=track.artwork)
+    await interaction.followup.send(embed=embed)
+
+    if not player.playing:
+        await player.play(player.queue.get(), volume=player.settings.volume)
 
 
 @bot.tree.command(name="nowplaying", description="Show information about the currently playing song.")
@@ -715,7 +5457,7 @@ async def volume(interaction: discord.Interaction, value: int) -> None:
 
     # Set the volume and save the preference
     await player.set_volume(value)
-    bot.volume_manager.set_volume(interaction.guild.id, value)
+    await bot.settings.set_volume(interaction.guild.id, value)
     
     # Create volume embed with visual indicator
     volume_bar = player.create_progress_bar(value, 100, length=10)
@@ -767,6 +5509,32 @@ async def loop(interaction: discord.Interaction, mode: str) -> None:
     await interaction.response.send_message(message)
 
 
+@bot.tree.command(name="autoplay", description="Keep playing similar tracks once the queue runs out.")
+async def autoplay(interaction: discord.Interaction) -> None:
+    """Keep playing similar tracks once the queue runs out."""
+    player: MusicPlayer = cast(MusicPlayer, interaction.guild.voice_client)
+    await MusicPlayer.update_last_interaction(player)
+
+    if not player:
+        await interaction.response.send_message("I'm not currently in a voice channel.", ephemeral=True)
+        return
+
+    # Check DJ permissions
+    if player.dj_role_required and not await has_dj_permissions(interaction):
+        await interaction.response.send_message("You need DJ permissions to change autoplay.", ephemeral=True)
+        return
+
+    if player.autoplay is wavelink.AutoPlayMode.enabled:
+        player.autoplay = wavelink.AutoPlayMode.partial
+        player.auto_queue.clear()
+        message = "⏹️ Disabled autoplay. Playback stops when the queue runs out."
+    else:
+        player.autoplay = wavelink.AutoPlayMode.enabled
+        message = "📻 Enabled autoplay! Similar tracks will play once the queue runs out."
+
+    await interaction.response.send_message(message)
+
+
 @bot.tree.command(name="shuffle", description="Shuffle the current queue.")
 async def shuffle(interaction: discord.Interaction) -> None:
     """Shuffle the current queue."""
@@ -786,20 +5554,12 @@ async def shuffle(interaction: discord.Interaction) -> None:
         await interaction.response.send_message("You need DJ permissions to shuffle the queue.", ephemeral=True)
         return
     
-    # Get all tracks from queue
-    queue_tracks = list(player.queue)
-    
-    # Clear the queue and shuffle tracks
-    player.queue.clear()
-    random.shuffle(queue_tracks)
-    
-    # Add shuffled tracks back to queue
-    for track in queue_tracks:
-        await player.queue.put_wait(track)
+    # Shuffle in place, without emptying the queue
+    player.queue.shuffle()
         
     embed = discord.Embed(
         title="Queue Shuffled 🔀",
-        description=f"Shuffled {len(queue_tracks)} tracks in the queue.",
+        description=f"Shuffled {player.queue.count} tracks in the queue.",
         color=discord.Color.green()
     )
     
@@ -807,9 +5567,12 @@ async def shuffle(interaction: discord.Interaction) -> None:
 
 
 @bot.tree.command(name="remove", description="Remove a specific track from the queue.")
-@app_commands.describe(position="The position of the track to remove (1, 2, 3, etc.)")
-async def remove(interaction: discord.Interaction, position: int) -> None:
-    """Remove a specific track from the queue."""
+@app_commands.describe(
+    position="The position of the track to remove (1, 2, 3, etc.)",
+    to_position="Optional last position to remove a whole range of tracks"
+)
+async def remove(interaction: discord.Interaction, position: int, to_position: Optional[int] = None) -> None:
+    """Remove a specific track, or a range of tracks, from the queue."""
     player: MusicPlayer = cast(MusicPlayer, interaction.guild.voice_client)
     await MusicPlayer.update_last_interaction(player)
     
@@ -827,31 +5590,97 @@ async def remove(interaction: discord.Interaction, position: int) -> None:
         return
     
     # Validate position
-    if position < 1 or position > player.queue.count:
+    last_position = to_position if to_position is not None else position
+    if position < 1 or last_position < position or last_position > player.queue.count:
         await interaction.response.send_message(f"Invalid position. Please choose a number between 1 and {player.queue.count}.", ephemeral=True)
         return
     
-    # Get all tracks from queue
-    queue_tracks = list(player.queue)
-    
-    # Get track to remove
-    removed_track = queue_tracks[position - 1]
-    
-    # Clear queue and add back all tracks except the removed one
-    player.queue.clear()
-    for i, track in enumerate(queue_tracks):
-        if i != position - 1:
-            await player.queue.put_wait(track)
+    if last_position == position:
+        removed_track = player.queue.remove_at(position - 1)
+        description = f"Removed **{removed_track.title}**\nby `{removed_track.author}` from the queue."
+    else:
+        removed_tracks = player.queue.remove_range(position - 1, last_position)
+        description = f"Removed **{len(removed_tracks)}** tracks (positions {position}-{last_position}) from the queue."
     
     embed = discord.Embed(
         title="Track Removed ❌",
-        description=f"Removed **{removed_track.title}**\nby `{removed_track.author}` from the queue.",
+        description=description,
         color=discord.Color.red()
     )
     
     await interaction.response.send_message(embed=embed)
 
 
+@bot.tree.command(name="move", description="Move a track to a different position in the queue.")
+@app_commands.describe(
+    position="The current position of the track (1, 2, 3, etc.)",
+    new_position="The position to move the track to"
+)
+async def move(interaction: discord.Interaction, position: int, new_position: int) -> None:
+    """Move a track to a different position in the queue."""
+    player: MusicPlayer = cast(MusicPlayer, interaction.guild.voice_client)
+    await MusicPlayer.update_last_interaction(player)
+    
+    if not player:
+        await interaction.response.send_message("I'm not currently in a voice channel.", ephemeral=True)
+        return
+    
+    if player.queue.is_empty:
+        await interaction.response.send_message("The queue is empty.", ephemeral=True)
+        return
+    
+    # Check DJ permissions
+    if player.dj_role_required and not await has_dj_permissions(interaction):
+        await interaction.response.send_message("You need DJ permissions to move tracks in the queue.", ephemeral=True)
+        return
+    
+    # Validate positions
+    count = player.queue.count
+    if not 1 <= position <= count or not 1 <= new_position <= count:
+        await interaction.response.send_message(f"Invalid position. Please choose a number between 1 and {count}.", ephemeral=True)
+        return
+    
+    track = player.queue.move(position - 1, new_position - 1)
+    
+    embed = discord.Embed(
+        title="Track Moved ↕️",
+        description=f"Moved **{track.title}**\nby `{track.author}` to position **#{new_position}**.",
+        color=discord.Color.blue()
+    )
+    
+    await interaction.response.send_message(embed=embed)
+
+
+@bot.tree.command(name="dedupe", description="Remove duplicate tracks from the queue.")
+async def dedupe(interaction: discord.Interaction) -> None:
+    """Remove duplicate tracks from the queue."""
+    player: MusicPlayer = cast(MusicPlayer, interaction.guild.voice_client)
+    await MusicPlayer.update_last_interaction(player)
+    
+    if not player:
+        await interaction.response.send_message("I'm not currently in a voice channel.", ephemeral=True)
+        return
+    
+    if player.queue.is_empty:
+        await interaction.response.send_message("The queue is empty.", ephemeral=True)
+        return
+    
+    # Check DJ permissions
+    if player.dj_role_required and not await has_dj_permissions(interaction):
+        await interaction.response.send_message("You need DJ permissions to edit the queue.", ephemeral=True)
+        return
+    
+    removed = player.queue.dedupe()
+    
+    embed = discord.Embed(
+        title="Duplicates Removed 🧹",
+        description=f"Removed {removed} duplicate tracks from the queue.",
+        color=discord.Color.green()
+    )
+    
+    await interaction.response.send_message(embed=embed)
+
+
 @bot.tree.command(name="clear", description="Clear the entire queue.")
 async def clear(interaction: discord.Interaction) -> None:
     """Clear the entire queue."""
@@ -942,19 +5771,12 @@ async def dj(
         await interaction.response.send_message("You need administrator permissions to manage DJ settings.", ephemeral=True)
         return
     
-    if not player and interaction.guild.voice_client:
-        player = cast(MusicPlayer, interaction.guild.voice_client)
-    
-    if not player:
-        # Create a temporary player object if none exists
-        player = MusicPlayer(client=bot)
-    
     if action == "enable":
-        player.dj_role_required = True
+        await bot.settings.set_dj_mode(interaction.guild.id, True)
         await interaction.response.send_message("🎧 Enabled DJ mode. Only users with the DJ role can use certain commands.")
     
     elif action == "disable":
-        player.dj_role_required = False
+        await bot.settings.set_dj_mode(interaction.guild.id, False)
         await interaction.response.send_message("🎧 Disabled DJ mode. All users can use all commands.")
     
     elif action in ["add", "remove"]:
@@ -963,27 +5785,21 @@ async def dj(
             return
         
         if action == "add":
-            player.dj_members.add(user.id)
+            await bot.settings.add_dj_member(interaction.guild.id, user.id)
             await interaction.response.send_message(f"🎧 Added {user.mention} as a DJ.")
         else:  # remove
-            if user.id in player.dj_members:
-                player.dj_members.remove(user.id)
+            if await bot.settings.remove_dj_member(interaction.guild.id, user.id):
                 await interaction.response.send_message(f"🎧 Removed {user.mention} from DJs.")
             else:
                 await interaction.response.send_message(f"{user.mention} is not a DJ.", ephemeral=True)
     
     # Update last interaction
-    await MusicPlayer.update_last_interaction(player)
+    if player:
+        await MusicPlayer.update_last_interaction(player)
 
 
 @bot.tree.command(name="boost", description="Apply a sound filter to the player.")
-@app_commands.describe(filter_type="The type of audio filter to apply")
-@app_commands.choices(filter_type=[
-    app_commands.Choice(name="Bass Boost", value="bassboost"),
-    app_commands.Choice(name="Nightcore", value="nightcore"),
-    app_commands.Choice(name="8D Audio", value="8d"),
-    app_commands.Choice(name="Clear Filters", value="clear"),
-])
+@app_commands.describe(filter_type="The filter to stack on the player, or remove if it's already applied")
 async def boost(interaction: discord.Interaction, filter_type: str) -> None:
     """Apply a sound filter to the player."""
     player: MusicPlayer = cast(MusicPlayer, interaction.guild.voice_client)
@@ -993,47 +5809,40 @@ async def boost(interaction: discord.Interaction, filter_type: str) -> None:
         await interaction.response.send_message("No song is currently playing.", ephemeral=True)
         return
     
-    filters = player.filters
-    filter_name = filter_type.capitalize()
+    preset = filter_presets.get(filter_type)
+    if preset is None and filter_type != "clear":
+        await interaction.response.send_message(f"There's no filter called `{filter_type}`.", ephemeral=True)
+        return
     
     await interaction.response.defer()
     
     try:
-        if filter_type == "bassboost":
-            # Apply bass boost EQ
-            bands = [
-                {"band": 0, "gain": 0.6},  # 60Hz
-                {"band": 1, "gain": 0.5},  # 150Hz
-                {"band": 2, "gain": 0.3},  # 400Hz
-                {"band": 3, "gain": 0.1},  # 1kHz
-            ]
-            filters.equalizer.set(bands=bands)
-            filter_name = "Bass Boost"
-            
-        elif filter_type == "nightcore":
-            # Increase speed and pitch
-            filters.timescale.set(speed=1.15, pitch=1.2, rate=1.0)
-            filter_name = "Nightcore"
-            
-        elif filter_type == "8d":
-            # Apply rotating 8D audio effect
-            filters.rotation.set(rotation_hz=0.2)  # Rotate 0.2 times per second
-            filter_name = "8D Audio"
-            
-        elif filter_type == "clear":
+        if filter_type == "clear":
             # Reset all filters
-            await player.set_filters()
+            await player.apply_presets(())
+            await bot.settings.set_presets(interaction.guild.id, ())
             await interaction.followup.send("🔄 Cleared all audio filters.")
             return
         
-        # Apply the selected filter
-        await player.set_filters(filters)
+        # Presets stack, choosing an applied one again takes it off
+        if preset.name in player.active_presets:
+            presets = tuple(name for name in player.active_presets if name != preset.name)
+            title, action = "Filter Removed 🎛️", "Removed"
+        else:
+            presets = player.active_presets + (preset.name,)
+            title, action = "Filter Applied 🎛️", "Applied"
+        
+        # Apply the filters and remember them as the guild's default
+        await player.apply_presets(presets)
+        await bot.settings.set_presets(interaction.guild.id, presets)
         
+        active = ", ".join(filter_presets.get(name).label for name in presets) or "None"
         embed = discord.Embed(
-            title="Filter Applied 🎛️",
-            description=f"Applied the **{filter_name}** filter to the player.",
+            title=title,
+            description=f"{action} the **{preset.label}** filter.",
             color=discord.Color.purple()
         )
+        embed.add_field(name="Active Filters", value=active, inline=False)
         await interaction.followup.send(embed=embed)
         
     except Exception as e:
@@ -1041,6 +5850,18 @@ async def boost(interaction: discord.Interaction, filter_type: str) -> None:
         await interaction.followup.send(f"An error occurred while applying the filter: {e}", ephemeral=True)
 
 
+@boost.autocomplete("filter_type")
+async def boost_filter_autocomplete(interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+    current = current.lower()
+    choices = [
+        app_commands.Choice(name=preset.label, value=preset.name)
+        for preset in filter_presets
+        if current in preset.name.lower() or current in preset.label.lower()
+    ]
+    choices.append(app_commands.Choice(name="Clear Filters", value="clear"))
+    return choices[:25]
+
+
 @bot.tree.command(name="lyrics", description="Try to find lyrics for the current song.")
 async def lyrics(interaction: discord.Interaction) -> None:
     """Try to find lyrics for the current song."""
@@ -1074,6 +5895,79 @@ async def lyrics(interaction: discord.Interaction) -> None:
     await interaction.followup.send(embed=embed)
 
 
+@bot.tree.command(name="debug", description="Show event loop lag and the slowest callbacks (bot owner only).")
+async def debug(interaction: discord.Interaction) -> None:
+    """Show event loop lag and the slowest callbacks (bot owner only)."""
+    if not await bot.is_owner(interaction.user):
+        await interaction.response.send_message("Only the bot owner can use this command.", ephemeral=True)
+        return
+
+    monitor = bot.loop_monitor
+    embed = discord.Embed(title="Event Loop", color=discord.Color.dark_grey())
+    embed.add_field(
+        name="Loop Lag",
+        value=(
+            f"p50 `{monitor.lag_percentile(0.5) * 1000:.1f}ms` | "
+            f"p99 `{monitor.lag_percentile(0.99) * 1000:.1f}ms` | "
+            f"max `{monitor.max_lag * 1000:.1f}ms`"
+        ),
+        inline=False
+    )
+
+    offenders = monitor.top()
+    if not offenders:
+        embed.description = f"No callback has blocked the loop for more than {monitor.threshold * 1000:.0f}ms."
+    for offender in offenders[:5]:
+        where = f"/{offender.command}" if offender.command else "background"
+        if offender.guild_id:
+            where += f" in guild {offender.guild_id}"
+        # Embed fields hold 1024 characters, keep the innermost frames
+        stack = "\n".join(offender.stack[-4:])[-900:]
+        embed.add_field(
+            name=f"{offender.worst * 1000:.0f}ms worst, {offender.count}x - {where}",
+            value=f"```{stack}```",
+            inline=False
+        )
+
+    embed.set_footer(text=f"Players: {len(bot.voice_clients)} | Slow callbacks: {sum(monitor.slow_callbacks.values())}")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+@bot.tree.command(name="cluster", description="Show guilds, players and latency for every shard cluster (bot owner only).")
+async def cluster(interaction: discord.Interaction) -> None:
+    """Show guilds, players and latency for every shard cluster (bot owner only)."""
+    if not await bot.is_owner(interaction.user):
+        await interaction.response.send_message("Only the bot owner can use this command.", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True)
+    try:
+        clusters = await bot.all_cluster_stats()
+    except (ConnectionError, asyncio.TimeoutError) as e:
+        await interaction.followup.send(f"Couldn't reach the other clusters: {e!r}", ephemeral=True)
+        return
+
+    embed = discord.Embed(title="Clusters", color=discord.Color.dark_grey())
+    for stats in clusters[:25]:
+        shards = stats["shards"]
+        latency = f"{stats['latency_ms']}ms" if stats["latency_ms"] is not None else "n/a"
+        embed.add_field(
+            name=f"Cluster {stats['cluster']} (shards {shards[0]}-{shards[-1]})" if shards else f"Cluster {stats['cluster']}",
+            value=(
+                f"Guilds: `{stats['guilds']}` | Players: `{stats['playing']}/{stats['players']}`\n"
+                f"Gateway: `{latency}` | Loop lag p99: `{stats['loop_lag_ms']}ms`"
+            ),
+            inline=False
+        )
+
+    embed.set_footer(
+        text=f"Guilds: {sum(stats['guilds'] for stats in clusters)} | "
+             f"Players: {sum(stats['players'] for stats in clusters)} | "
+             f"Clusters answering: {len(clusters)}"
+    )
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+
 @bot.tree.command(name="help", description="Show a list of all available commands.")
 async def help_command(interaction: discord.Interaction) -> None:
     """Show a list of all available commands."""
@@ -1102,9 +5996,15 @@ async def help_command(interaction: discord.Interaction) -> None:
             "`/queue` - Show the current music queue\n"
             "`/nowplaying` - Show details about the currently playing track\n"
             "`/clear` - Clear the entire queue\n"
-            "`/remove <position>` - Remove a specific track from the queue\n"
+            "`/remove <position> [to_position]` - Remove a track, or a range of tracks, from the queue\n"
+            "`/move <position> <new_position>` - Move a track to a different position in the queue\n"
+            "`/dedupe` - Remove duplicate tracks from the queue\n"
             "`/shuffle` - Shuffle the tracks in the queue\n"
-            "`/loop <mode>` - Set loop mode (track, queue, or off)"
+            "`/loop <mode>` - Set loop mode (track, queue, or off)\n"
+            "`/history [page] [user]` - Show the tracks recently played in this server\n"
+            "`/top` - Show the most played tracks in this server\n"
+            "`/replay <number>` - Queue a track from the history again\n"
+            "`/autoplay` - Keep playing similar tracks once the queue runs out"
         ),
         inline=False
     )
@@ -1121,7 +6021,7 @@ async def help_command(interaction: discord.Interaction) -> None:
         name="🔊 Audio Controls",
         value=(
             "`/volume <value>` - Change the volume of the player (0-100)\n"
-            "`/boost <filter>` - Apply audio filters (bassboost, nightcore, 8d, clear)"
+            "`/boost <filter>` - Stack or remove audio filters (bassboost, nightcore, 8d, clear)"
         ),
         inline=False
     )
@@ -1131,7 +6031,9 @@ async def help_command(interaction: discord.Interaction) -> None:
         value=(
             "`/disconnect` - Disconnect the bot from the voice channel\n"
             "`/lyrics` - Try to find lyrics for the current song\n"
-            "`/dj <action>` - Manage DJ mode and permissions"
+            "`/dj <action>` - Manage DJ mode and permissions\n"
+            "`/debug` - Show event loop lag and slow callbacks (bot owner only)\n"
+            "`/cluster` - Show stats for every shard cluster (bot owner only)"
         ),
         inline=False
     )
@@ -1148,8 +6050,14 @@ async def main() -> None:
     if not bot_token:
         raise ValueError("Bot token not found in .env file.")
 
+    # Spread the shards over worker processes, each of which runs this file again with SHARD_IDS set
+    if SHARD_WORKERS > 1 and not SHARD_IDS:
+        await ClusterLauncher(bot_token).run()
+        return
+
     async with bot:
         await bot.start(bot_token)
 
 
-asyncio.run(main())
\ No newline at end of file
+if __name__ == "__main__":
+    asyncio.run(main())
\ No newline at end of file